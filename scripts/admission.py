@@ -0,0 +1,90 @@
+import shutil
+import threading
+
+import yaml
+
+from metrics import get_metrics
+from utils import get_threshold_from_config
+
+MB = 1024 * 1024
+
+DEFAULT_BUCKETS = [
+    {"NAME": "tiny", "MAX_MB": 1, "QUOTA": 0},
+    {"NAME": "small", "MAX_MB": 10, "QUOTA": 0},
+    {"NAME": "medium", "MAX_MB": 50, "QUOTA": 200},
+    {"NAME": "large", "MAX_MB": 200, "QUOTA": 30},
+    {"NAME": "huge", "MAX_MB": None, "QUOTA": 5},
+]
+
+UNKNOWN = "unknown"
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("ADMISSION_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+class AdmissionControl:
+    """
+    下載前的准入檢查：依下載大小分桶，每個桶在一輪中有最多下載數 (QUOTA，0 表示不限)，
+    並在每次下載前重新檢查磁碟用量 (已使用 + 進行中的下載 + 這次的大小 不能超過門檻)。
+    """
+
+    def __init__(self, settings=None, threshold=None, path="."):
+        settings = load_settings() if settings is None else settings
+        self.buckets = [(b["NAME"], b.get("MAX_MB"), b.get("QUOTA", 0) or 0)
+                        for b in settings.get("BUCKETS", DEFAULT_BUCKETS)]
+        self.unknown_quota = settings.get("UNKNOWN_QUOTA", 0) or 0
+        max_mb = settings.get("MAX_DOWNLOAD_MB")
+        self.max_size = max_mb * MB if max_mb else None
+        self.head_requests = settings.get("HEAD_REQUESTS", True)
+        self.threshold = get_threshold_from_config() if threshold is None else threshold
+        self.path = path
+        self.counts = {}
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    def bucket_for(self, size):
+        if size is None:
+            return UNKNOWN, self.unknown_quota
+        for name, max_mb, quota in self.buckets:
+            if max_mb is None or size <= max_mb * MB:
+                return name, quota
+        return self.buckets[-1][0], self.buckets[-1][2]
+
+    def admit(self, size):
+        """
+        回傳 (是否准許, 原因)。准許時會保留 size 的磁碟空間，下載結束後呼叫 release()。
+        """
+        metrics = get_metrics()
+        if size is not None and self.max_size and size > self.max_size:
+            metrics.inc("admission_total", bucket="oversize", result="too_large")
+            return False, f"larger than MAX_DOWNLOAD_MB ({size / MB:.1f} MB)"
+
+        bucket, quota = self.bucket_for(size)
+        with self._lock:
+            if quota and self.counts.get(bucket, 0) >= quota:
+                metrics.inc("admission_total", bucket=bucket, result="bucket_full")
+                return False, f"bucket '{bucket}' is full ({quota} downloads this run)"
+
+            total, used, _ = shutil.disk_usage(self.path)
+            needed = used + self.reserved + (size or 0)
+            if needed >= total * self.threshold:
+                metrics.inc("admission_total", bucket=bucket, result="disk_budget")
+                return False, (f"disk budget exceeded ({needed / total:.1%} of disk "
+                               f"with in-flight downloads, threshold {self.threshold:.1%})")
+
+            self.counts[bucket] = self.counts.get(bucket, 0) + 1
+            self.reserved += size or 0
+        metrics.inc("admission_total", bucket=bucket, result="admitted")
+        return True, bucket
+
+    def release(self, size):
+        with self._lock:
+            self.reserved = max(0, self.reserved - (size or 0))
+
+    def summary(self):
+        return ", ".join(f"{name}: {count}" for name, count in sorted(self.counts.items()))
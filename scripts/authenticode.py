@@ -0,0 +1,221 @@
+import pefile
+
+from utils import close_pe
+
+# WIN_CERTIFICATE.wCertificateType
+WIN_CERT_TYPE_PKCS_SIGNED_DATA = 0x0002
+
+OID_SIGNED_DATA = "1.2.840.113549.1.7.2"
+
+DIGEST_ALGORITHMS = {
+    "1.2.840.113549.2.5": "md5",
+    "1.3.14.3.2.26": "sha1",
+    "2.16.840.1.101.3.4.2.1": "sha256",
+    "2.16.840.1.101.3.4.2.2": "sha384",
+    "2.16.840.1.101.3.4.2.3": "sha512",
+}
+
+NAME_ATTRIBUTES = {
+    "2.5.4.3": "CN",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+}
+
+
+class ASN1Error(ValueError):
+    pass
+
+
+def _read_tlv(data, pos):
+    """
+    讀取一個 DER TLV，回傳 (tag, value_start, value_end)。
+    """
+    if pos + 2 > len(data):
+        raise ASN1Error("truncated TLV")
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        if n == 0 or n > 4 or pos + n > len(data):
+            raise ASN1Error("unsupported length encoding")
+        length = int.from_bytes(data[pos:pos + n], "big")
+        pos += n
+    if pos + length > len(data):
+        raise ASN1Error("TLV exceeds buffer")
+    return tag, pos, pos + length
+
+
+def _children(data, start, end):
+    children = []
+    pos = start
+    while pos < end:
+        tag, vstart, vend = _read_tlv(data, pos)
+        children.append((tag, vstart, vend))
+        pos = vend
+    return children
+
+
+def _decode_oid(raw):
+    first = raw[0]
+    parts = [str(min(first // 40, 2)), str(first - 40 * min(first // 40, 2))]
+    value = 0
+    for b in raw[1:]:
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            parts.append(str(value))
+            value = 0
+    return ".".join(parts)
+
+
+def _decode_string(tag, raw):
+    if tag == 0x1E:  # BMPString
+        return raw.decode("utf-16-be", "replace")
+    return raw.decode("utf-8", "replace")
+
+
+def _decode_name(data, start, end):
+    """
+    將 X.500 Name 轉成 "CN=..., O=..., C=..." 字串。
+    """
+    parts = []
+    for _, set_start, set_end in _children(data, start, end):
+        for _, seq_start, seq_end in _children(data, set_start, set_end):
+            attr = _children(data, seq_start, seq_end)
+            if len(attr) < 2:
+                continue
+            oid = _decode_oid(data[attr[0][1]:attr[0][2]])
+            key = NAME_ATTRIBUTES.get(oid, oid)
+            parts.append(f"{key}={_decode_string(attr[1][0], data[attr[1][1]:attr[1][2]])}")
+    return ", ".join(parts)
+
+
+def _name_field(name, key):
+    for part in name.split(", "):
+        if part.startswith(key + "="):
+            return part[len(key) + 1:]
+    return None
+
+
+def _parse_certificate(data, start, end):
+    """
+    從 X.509 憑證取出 (issuer, serial, subject)。
+    """
+    tbs = _children(data, start, end)[0]
+    fields = _children(data, tbs[1], tbs[2])
+    # version 為 [0] EXPLICIT，可省略
+    if fields[0][0] == 0xA0:
+        fields = fields[1:]
+    serial = data[fields[0][1]:fields[0][2]]
+    issuer = _decode_name(data, fields[2][1], fields[2][2])
+    subject = _decode_name(data, fields[4][1], fields[4][2])
+    return issuer, serial, subject
+
+
+def parse_pkcs7(blob):
+    """
+    解析 Authenticode 的 PKCS#7 SignedData，回傳簽署者資訊。
+    只解析需要的欄位，不驗證憑證鏈。
+    """
+    _, ci_start, ci_end = _read_tlv(blob, 0)
+    content_info = _children(blob, ci_start, ci_end)
+    if _decode_oid(blob[content_info[0][1]:content_info[0][2]]) != OID_SIGNED_DATA:
+        raise ASN1Error("not a PKCS#7 SignedData blob")
+
+    explicit = content_info[1]
+    signed_data = _children(blob, explicit[1], explicit[2])[0]
+    fields = _children(blob, signed_data[1], signed_data[2])
+
+    certificates = []
+    signer_infos = None
+    for tag, vstart, vend in fields[3:]:
+        if tag == 0xA0:  # [0] IMPLICIT certificates
+            for _, cstart, cend in _children(blob, vstart, vend):
+                try:
+                    certificates.append(_parse_certificate(blob, cstart, cend))
+                except (ASN1Error, IndexError):
+                    continue
+        elif tag == 0x31:
+            signer_infos = (vstart, vend)
+
+    if signer_infos is None:
+        raise ASN1Error("no signerInfos")
+    signer = _children(blob, *signer_infos)[0]
+    signer_fields = _children(blob, signer[1], signer[2])
+
+    # issuerAndSerialNumber
+    ias = _children(blob, signer_fields[1][1], signer_fields[1][2])
+    issuer = _decode_name(blob, ias[0][1], ias[0][2])
+    serial = blob[ias[1][1]:ias[1][2]]
+
+    digest_alg = _children(blob, signer_fields[2][1], signer_fields[2][2])[0]
+    digest_oid = _decode_oid(blob[digest_alg[1]:digest_alg[2]])
+
+    subject = None
+    for cert_issuer, cert_serial, cert_subject in certificates:
+        if cert_serial == serial and cert_issuer == issuer:
+            subject = cert_subject
+            break
+
+    return {
+        "subject": subject,
+        "issuer": issuer,
+        "serial": serial.hex(),
+        "digest_algorithm": DIGEST_ALGORITHMS.get(digest_oid, digest_oid),
+        "signer": _name_field(subject or "", "CN") or _name_field(subject or "", "O"),
+    }
+
+
+def get_signature_info(file_path=None, data=None):
+    """
+    讀取 PE 的 IMAGE_DIRECTORY_ENTRY_SECURITY，解析其中的 Authenticode 簽章。
+    可傳入檔案路徑 (以 mmap 讀取) 或已經在記憶體中的 bytes。
+    未簽署或無法解析時回傳 None；有簽章但解析失敗時回傳只有 signed 欄位的 dict。
+    """
+    try:
+        if data is not None:
+            pe = pefile.PE(data=data, fast_load=True)
+        else:
+            pe = pefile.PE(str(file_path), fast_load=True)
+    except Exception:
+        return None
+
+    try:
+        index = pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_SECURITY"]
+        directories = pe.OPTIONAL_HEADER.DATA_DIRECTORY
+        if len(directories) <= index:
+            return None
+        # Security directory 的 VirtualAddress 是檔案偏移，不是 RVA
+        offset = directories[index].VirtualAddress
+        size = directories[index].Size
+        raw = pe.__data__[offset:offset + size]
+    finally:
+        close_pe(pe)
+
+    if offset == 0 or size < 8 or len(raw) < 8:
+        return None
+
+    length = int.from_bytes(raw[0:4], "little")
+    cert_type = int.from_bytes(raw[6:8], "little")
+    if cert_type != WIN_CERT_TYPE_PKCS_SIGNED_DATA:
+        return None
+
+    info = {"signed": True}
+    try:
+        info.update(parse_pkcs7(bytes(raw[8:min(length, len(raw))])))
+    except (ASN1Error, IndexError):
+        pass
+    return info
+
+
+def matches_vendor(info, vendors):
+    """
+    檢查簽署者是否屬於指定的廠商清單 (不分大小寫，比對 subject 子字串)。
+    """
+    if not info or not info.get("subject"):
+        return False
+    subject = info["subject"].lower()
+    return any(vendor.lower() in subject for vendor in vendors)
@@ -0,0 +1,191 @@
+import argparse
+import importlib
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from fixture_server import FixtureServer, load_settings
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+# (來源名稱, 爬蟲模組)
+CRAWLERS = [
+    ("github", "crawler_github"),
+    ("choco", "crawler_choco"),
+    ("portable", "crawler_portable"),
+]
+
+UNTHROTTLED_RATE = 1000.0
+
+
+def build_config(overrides, unthrottled):
+    """
+    以目前的 config.yaml 為基礎，把所有來源指到 fixture server 並開啟下載。
+    unthrottled 時移除每個主機的速率限制與 API 額度的預估值 (只量測程式本身的吞吐量)，
+    fixture server 送出的 X-RateLimit header 仍然有效。
+    """
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f) or {}
+    config["ENABLE_DOWNLOAD"] = True
+    config["DISK_USAGE_THRESHOLD"] = 1.0
+
+    fetch = config.setdefault("FETCH_SETTINGS", {})
+    fetch["URL_OVERRIDES"] = overrides
+    if unthrottled:
+        for conf in [fetch.setdefault("DEFAULT", {})] + list((fetch.get("HOSTS") or {}).values()):
+            conf["RATE_PER_SEC"] = UNTHROTTLED_RATE
+            conf["BURST"] = UNTHROTTLED_RATE
+        for conf in ((fetch.get("RATE_LIMITS") or {}).get("FAMILIES") or {}).values():
+            conf.pop("LIMIT", None)
+            conf.pop("WINDOW", None)
+    return config
+
+
+def run_child(module_name, stats_path):
+    """
+    在子行程中執行一個爬蟲的 main() 並把摘要寫成 JSON (由父行程計時與量測記憶體)。
+    """
+    module = importlib.import_module(module_name)
+    started = time.time()
+    result = module.main() or {}
+    result["wall_seconds"] = time.time() - started
+    # 行程池的 worker 已經結束，RUSAGE_CHILDREN 是其中最大的 RSS (KB)
+    result["worker_rss_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    with open(stats_path, "w") as f:
+        json.dump(result, f)
+
+
+def stored_files(workdir, source):
+    db_path = workdir / "benign_pe" / "metadata" / "state.db"
+    if not db_path.exists():
+        return 0, 0
+    conn = sqlite3.connect(str(db_path))
+    try:
+        count, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files WHERE source = ? AND scan_result = 'clean'",
+            (source,)).fetchone()
+    finally:
+        conn.close()
+    return count, size
+
+
+def run_crawler(source, module_name, workdir, server, token, verbose):
+    stats_path = workdir / f"bench-{source}.json"
+    env = dict(os.environ, PYTHONPATH=str(SCRIPTS_DIR), PYTHONUNBUFFERED="1")
+    if token:
+        env["GITHUB_TOKEN"] = "bench-token"
+    else:
+        env.pop("GITHUB_TOKEN", None)
+
+    server.reset_counters()
+    log_path = workdir / f"bench-{source}.log"
+    started = time.time()
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "--child", module_name, str(stats_path)],
+            cwd=str(workdir), env=env, stdout=None if verbose else log, stderr=subprocess.STDOUT)
+        # wait4 取得這個子行程自己的 peak RSS (RUSAGE_CHILDREN 會累計所有子行程)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.time() - started
+
+    summary = {}
+    if stats_path.exists():
+        with open(stats_path) as f:
+            summary = json.load(f)
+    files, size = stored_files(workdir, source)
+    return {
+        "source": source,
+        "exit_code": proc.returncode,
+        "wall_seconds": round(wall, 2),
+        "files": files,
+        "stored_mb": round(size / (1024 * 1024), 2),
+        "downloaded_mb": round(server.bytes_sent / (1024 * 1024), 2),
+        "requests": server.requests_total,
+        "files_per_sec": round(files / wall, 2) if wall else 0,
+        "mb_per_sec": round(server.bytes_sent / (1024 * 1024) / wall, 2) if wall else 0,
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "worker_rss_mb": round(summary.get("worker_rss_kb", 0) / 1024, 1),
+        "stages": summary.get("stages", {}),
+        "log": str(log_path),
+    }
+
+
+def print_report(results):
+    print("\n=== Benchmark Results ===")
+    print(f"  {'crawler':<10} {'wall':>7} {'files':>6} {'files/s':>8} {'MB down':>8} {'MB/s':>7} "
+          f"{'requests':>8} {'RSS MB':>7} {'workers':>8}")
+    for r in results:
+        flag = "" if r["exit_code"] == 0 else f"  [exit {r['exit_code']}, see {r['log']}]"
+        print(f"  {r['source']:<10} {r['wall_seconds']:>6.1f}s {r['files']:>6} {r['files_per_sec']:>8.2f} "
+              f"{r['downloaded_mb']:>8.1f} {r['mb_per_sec']:>7.2f} {r['requests']:>8} "
+              f"{r['peak_rss_mb']:>7.1f} {r['worker_rss_mb']:>8.1f}{flag}")
+
+    print("\n=== Time per Stage (busy seconds, summed over workers) ===")
+    for r in results:
+        stages = r["stages"]
+        if stages:
+            print(f"  {r['source']:<10} " + "  ".join(
+                f"{name}={s['busy_seconds']:.1f}s" for name, s in stages.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the crawlers end to end against a local fixture server.")
+    parser.add_argument("crawlers", nargs="*", help="sources to run (default: all)")
+    parser.add_argument("--child", nargs=2, metavar=("MODULE", "STATS"), help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help="keep fixtures and results in this directory instead of a temp dir")
+    parser.add_argument("--json", help="write the results to this file (for comparing runs)")
+    parser.add_argument("--throttled", action="store_true",
+                        help="keep the per-host rate limits from config.yaml")
+    parser.add_argument("--no-token", action="store_true", help="run GitHub without a token (REST only)")
+    parser.add_argument("--verbose", action="store_true", help="show crawler output")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    selected = [(source, module) for source, module in CRAWLERS
+                if not args.crawlers or source in args.crawlers]
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="pe-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    settings = load_settings()
+    print("=== Crawler Benchmark ===")
+    print(f"[*] Preparing fixtures in {workdir / 'fixtures'} ...")
+    server = FixtureServer(workdir / "fixtures", settings).start()
+    print(f"[*] Fixture server on {server.origin}")
+    try:
+        config = build_config(server.overrides(), not args.throttled)
+        with open(workdir / "config.yaml", "w") as f:
+            yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+        results = []
+        for source, module in selected:
+            print(f"[*] Running {source} ...")
+            results.append(run_crawler(source, module, workdir, server, not args.no_token, args.verbose))
+    finally:
+        server.stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+        print(f"\n[*] Results written to {args.json}")
+
+    # 有爬蟲失敗時保留工作目錄，方便查看 log
+    if args.workdir is None and all(r["exit_code"] == 0 for r in results):
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+import yaml
+
+# 掃描結果
+CLEAN = "clean"
+INFECTED = "infected"
+ERROR = "error"
+
+DEFAULT_SOCKET = "/var/run/clamav/clamd.ctl"
+CHUNK_SIZE = 256 * 1024
+
+
+class ClamdScanner:
+    """
+    透過常駐的 clamd 進行掃描。
+    病毒庫只在 clamd 啟動時載入一次，之後每個檔案以 INSTREAM 串流送出，
+    同時最多保持 max_connections 條連線進行掃描。
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, host=None, port=3310,
+                 max_connections=4, timeout=120):
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, max_connections))
+
+    def _connect(self):
+        if self.host:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        return sock
+
+    def _recv_reply(self, sock):
+        data = b""
+        while not data.endswith(b"\0"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data.rstrip(b"\0").decode("utf-8", "replace").strip()
+
+    def _command(self, command):
+        with self._slots:
+            sock = self._connect()
+            try:
+                sock.sendall(b"z" + command.encode() + b"\0")
+                return self._recv_reply(sock)
+            finally:
+                sock.close()
+
+    def ping(self):
+        try:
+            return self._command("PING") == "PONG"
+        except OSError:
+            return False
+
+    def version(self):
+        """
+        回傳 clamd 的版本字串，例如 "ClamAV 1.0.3/27100/Mon Oct 16 08:00:00 2026"。
+        """
+        return self._command("VERSION")
+
+    def scan_stream(self, fileobj):
+        """
+        以 INSTREAM 掃描一個可讀取的串流。
+        回傳 (verdict, detail)，verdict 為 CLEAN / INFECTED / ERROR。
+        """
+        try:
+            with self._slots:
+                sock = self._connect()
+                try:
+                    sock.sendall(b"zINSTREAM\0")
+                    while True:
+                        chunk = fileobj.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        sock.sendall(struct.pack("!L", len(chunk)) + chunk)
+                    sock.sendall(struct.pack("!L", 0))
+                    reply = self._recv_reply(sock)
+                finally:
+                    sock.close()
+        except OSError as e:
+            return ERROR, str(e)
+
+        # 回應格式: "stream: OK" / "stream: <signature> FOUND" / "... ERROR"
+        if reply.endswith("FOUND"):
+            return INFECTED, reply.split(":", 1)[-1].rsplit(" ", 1)[0].strip()
+        if reply.endswith("OK"):
+            return CLEAN, ""
+        return ERROR, reply
+
+    def scan_file(self, file_path):
+        try:
+            with open(file_path, "rb") as f:
+                return self.scan_stream(f)
+        except OSError as e:
+            return ERROR, str(e)
+
+    def scan_bytes(self, data):
+        import io
+        return self.scan_stream(io.BytesIO(data))
+
+
+def start_clamd(scanner, startup_timeout=120):
+    """
+    如果 clamd 尚未執行則啟動它，並等待病毒庫載入完成。
+    clamd 會自行轉入背景，之後所有爬蟲共用這一個常駐行程。
+    """
+    if scanner.ping():
+        return True
+    if scanner.host:
+        return False
+
+    print("[*] clamd is not running. Starting clamd (loading signature database)...")
+    try:
+        subprocess.Popen(["clamd"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        print(f" [!] Failed to start clamd: {e}")
+        return False
+
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if scanner.ping():
+            print("[*] clamd is ready.")
+            return True
+        time.sleep(1)
+    print(f" [!] clamd did not become ready within {startup_timeout}s.")
+    return False
+
+
+_default_scanner = None
+_default_lock = threading.Lock()
+_default_resolved = False
+
+
+def get_default_scanner():
+    """
+    依照 config.yaml 的 CLAMAV_SETTINGS 取得共用的 ClamdScanner。
+    BACKEND 為 clamscan 或 clamd 無法使用時回傳 None，呼叫端應改用 clamscan。
+    """
+    global _default_scanner, _default_resolved
+    with _default_lock:
+        if _default_resolved:
+            return _default_scanner
+        _default_resolved = True
+
+        try:
+            with open("config.yaml", "r") as f:
+                settings = (yaml.safe_load(f) or {}).get("CLAMAV_SETTINGS", {})
+        except Exception:
+            settings = {}
+
+        if settings.get("BACKEND", "clamd") != "clamd":
+            return None
+
+        scanner = ClamdScanner(
+            socket_path=os.environ.get("CLAMD_SOCKET", settings.get("SOCKET", DEFAULT_SOCKET)),
+            host=settings.get("HOST") or None,
+            port=settings.get("PORT", 3310),
+            max_connections=settings.get("MAX_CONNECTIONS", 4),
+        )
+        ready = scanner.ping()
+        if not ready and settings.get("AUTOSTART", True):
+            ready = start_clamd(scanner, settings.get("STARTUP_TIMEOUT", 120))
+        if not ready:
+            print(" [!] clamd unavailable, falling back to clamscan.")
+            return None
+
+        _default_scanner = scanner
+        return _default_scanner
+
+
+def get_clamav_db_version():
+    """
+    取得目前病毒庫的版本 (例如 "27100/Mon Oct 16 08:00:00 2026")。
+    freshclam 更新病毒庫後這個值就會改變；clamd 與 clamscan 都無法使用時回傳 None。
+    """
+    version = None
+    scanner = get_default_scanner()
+    if scanner is not None:
+        try:
+            version = scanner.version()
+        except OSError:
+            version = None
+    if not version:
+        try:
+            version = subprocess.run(["clamscan", "--version"], capture_output=True,
+                                     text=True, timeout=30).stdout.strip()
+        except Exception:
+            return None
+    # "ClamAV 1.0.3/27100/Mon Oct 16 08:00:00 2026" -> 只保留病毒庫部分
+    _, _, db_version = version.partition("/")
+    return db_version or None
@@ -0,0 +1,603 @@
+import re
+import threading
+import time
+import zipfile
+from urllib.parse import parse_qs, urlparse
+
+from admission import AdmissionControl
+from authenticode import get_signature_info
+from downloader import spool_response, iter_zip_members, iter_fileobj, iter_response, get_download_settings
+from fetch_engine import get_engine
+from fingerprint import fingerprint_pe, get_index
+from metrics import get_metrics
+from pe_sniff import sniff_stream, sniff_pe_header, OK, NEED_MORE
+from pipeline import build_pipeline, get_pipeline_settings
+from rate_limit import RateLimited, parse_retry_after, parse_rate_limit, DEFAULT_MAX_BACKOFF
+from remote_zip import RemoteZip, RangeNotSupported
+from resumable import ResumableDownload, PART_DIR, DEFAULT_PART_MAX_AGE_DAYS, cleanup_parts
+from sample_store import NEW, DUPLICATE, NEAR_DUPLICATE, NOT_PE, INFECTED
+from shard_store import load_pe
+from similarity import get_similarity, similarity_pe
+from stats_manifest import get_stats
+from utils import close_pe, is_pe_file, scan_with_clamav
+
+# FetchJob 的種類
+ARCHIVE = "archive"
+FILE = "file"
+
+ERROR = "error"
+
+DEFAULT_MAX_SPOOLED_ARCHIVES = 4
+
+# 因速率限制沒有完成的下載，留到 retry_at 之後由同一個來源的下一輪重新排入
+DEFERRED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deferred_jobs (
+    source TEXT NOT NULL,
+    url TEXT NOT NULL,
+    kind TEXT,
+    size INTEGER,
+    name TEXT,
+    remote_zip INTEGER,
+    timeout INTEGER,
+    retry_at REAL,
+    deferred_at REAL,
+    PRIMARY KEY (source, url)
+) WITHOUT ROWID;
+"""
+
+# 常駐的 orchestrator 收到 SIGTERM 時設定：所有管線不再開始新的下載，已經在進行的工作照常完成
+SHUTDOWN = threading.Event()
+
+STAGES = [
+    # (階段名稱, 預設 worker 數)
+    ("admit", 4),
+    ("fetch", 8),
+    ("unpack", 2),
+    ("validate", 2),
+    ("sign", 2),
+    ("scan", 4),
+    ("commit", 1),
+]
+
+
+def inspect_pe(path, full_check):
+    """
+    在行程池中執行：需要時以 pefile 完整驗證 PE，並解析 Authenticode 簽章。
+    回傳 (is_pe, signature_info)。
+    """
+    if full_check and not is_pe_file(path):
+        return False, None
+    return True, get_signature_info(file_path=path)
+
+
+def inspect_sample(path, full_check, similarity=True):
+    """
+    在行程池中執行：inspect_pe 之外再做編譯器 / 語言分類與近似重複用的模糊雜湊。
+    回傳 (is_pe, signature_info, fingerprint, (minhash, imphash))。
+    """
+    is_pe, info = inspect_pe(path, full_check)
+    if not is_pe:
+        return is_pe, info, None, None
+    try:
+        pe = load_pe(path)
+    except Exception:
+        return is_pe, info, None, None
+    # 兩種分析共用同一個 pefile.PE
+    try:
+        return is_pe, info, _analyze(fingerprint_pe, pe), _analyze(similarity_pe, pe) if similarity else None
+    finally:
+        close_pe(pe)
+
+
+def _analyze(fn, pe):
+    try:
+        return fn(pe)
+    except Exception:
+        return None
+
+
+def guess_file_name(url, response):
+    """
+    從網址、PortableApps 的 f= 參數或 Content-Disposition 推測下載檔名。
+    """
+    file_name = url.split("?")[0].split("/")[-1]
+
+    if "f=" in url:
+        params = parse_qs(urlparse(url).query)
+        if 'f' in params:
+            file_name = params['f'][0]
+
+    if not file_name or file_name == "redir2":
+        cd = response.headers.get("content-disposition")
+        if cd:
+            fname_match = re.findall("filename=(.+)", cd)
+            if fname_match:
+                file_name = fname_match[0].strip(' "')
+
+    return file_name or "downloaded_app.exe"
+
+
+class FetchJob:
+    """
+    一個下載網址。網址內所有成員都走完管線後才算完成，
+    只要有一個成員被收進樣本庫 (NEW / DUPLICATE / NEAR_DUPLICATE) 就寫入下載紀錄。
+    """
+
+    def __init__(self, source, url, kind=FILE, size=None, name=None, remote_zip=False, timeout=60):
+        self.source = source
+        self.url = url
+        self.kind = kind
+        self.size = size
+        self.name = name
+        self.remote_zip = remote_zip
+        self.timeout = timeout
+        self.accepted = False
+        self.rate_limited = False
+        self.reserved = 0
+        self.results = []
+        self.done = threading.Event()
+        self._pending = 0
+        self._enumerated = False
+        self._lock = threading.Lock()
+
+    def add_member(self):
+        with self._lock:
+            self._pending += 1
+
+    def member_done(self, result):
+        with self._lock:
+            self._pending -= 1
+            self.results.append(result)
+            if result in (NEW, DUPLICATE, NEAR_DUPLICATE):
+                self.accepted = True
+            return self._enumerated and self._pending == 0
+
+    def enumerated(self):
+        with self._lock:
+            self._enumerated = True
+            return self._pending == 0
+
+
+class Download:
+    """
+    已下載的壓縮檔：整包暫存的 spool，或只讀了中央目錄的 RemoteZip。
+    """
+
+    def __init__(self, job, spool=None, remote=None, entries=None):
+        self.job = job
+        self.spool = spool
+        self.remote = remote
+        self.entries = entries
+
+
+class Candidate:
+    """
+    一個已計算 SHA256 的候選樣本 (單一下載檔或壓縮檔成員)，在 validate 之後的階段間傳遞。
+    """
+
+    def __init__(self, job, member_path, staged, verdict):
+        self.job = job
+        self.member_path = member_path
+        self.staged = staged
+        self.verdict = verdict
+        self.signed = False
+        self.fingerprint = None
+        self.similarity = None
+
+
+class CollectPipeline:
+    """
+    爬蟲共用的收集管線：admit → fetch → unpack → validate → sign → scan → commit。
+    各階段之間是有上限的佇列；整包下載的壓縮檔在 unpack 完成前佔用一個 spool 名額，
+    名額用完時 fetch 會停下來等待，暫存檔不會無限制地堆積在磁碟上。
+    """
+
+    def __init__(self, store, enable_download, engine=None, stop_on_rate_limit=False, settings=None):
+        self.store = store
+        self.db = store.db
+        self.fingerprints = get_index(store.db)
+        self.similarity = get_similarity(store.db)
+        self.stats = get_stats(store.db)
+        self.enable_download = enable_download
+        self.engine = engine or get_engine()
+        self.stop_on_rate_limit = stop_on_rate_limit
+        self.stop = threading.Event()
+        self.jobs = []
+        self.db.ensure_schema(DEFERRED_SCHEMA)
+
+        settings = get_pipeline_settings() if settings is None else settings
+        self.spool_slots = threading.BoundedSemaphore(
+            settings.get("MAX_SPOOLED_ARCHIVES", DEFAULT_MAX_SPOOLED_ARCHIVES))
+        self.admission = AdmissionControl()
+        fns = {
+            "admit": self._admit,
+            "fetch": self._fetch,
+            "unpack": self._unpack,
+            "validate": self._validate,
+            "sign": self._sign,
+            "scan": self._scan,
+            "commit": self._commit,
+        }
+        self.pipeline = build_pipeline([(name, fns[name], workers) for name, workers in STAGES],
+                                       settings, self._on_error)
+        # 統計、去重與近似重複上限都假設只有一個寫入者，commit 固定單一 worker
+        self.pipeline.stages[-1].workers = 1
+
+    def start(self):
+        cleanup_parts(self.store.incoming / PART_DIR,
+                      get_download_settings().get("PART_MAX_AGE_DAYS", DEFAULT_PART_MAX_AGE_DAYS))
+        self.pipeline.start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, job):
+        """
+        排入一個 FetchJob (fetch 佇列滿時會阻塞)。
+        """
+        self.jobs.append(job)
+        self.pipeline.put(job)
+        return job
+
+    def requeue_deferred(self, source):
+        """
+        重新排入這個來源先前因速率限制延後、且已經到了 retry_at 的下載。回傳排入的數量。
+        """
+        rows = self.db.query(
+            "SELECT url, kind, size, name, remote_zip, timeout FROM deferred_jobs "
+            "WHERE source = ? AND retry_at <= ? ORDER BY deferred_at", (source, time.time()))
+        for url, kind, size, name, remote_zip, timeout in rows:
+            self.db.execute("DELETE FROM deferred_jobs WHERE source = ? AND url = ?", (source, url))
+            self.submit(FetchJob(source, url, kind, size, name, bool(remote_zip), timeout))
+        if rows:
+            print(f"[*] Requeued {len(rows)} deferred downloads for {source}.")
+        return len(rows)
+
+    def close(self):
+        self.pipeline.close()
+        self.db.commit()
+
+    def report(self):
+        self.pipeline.report()
+        if self.admission.counts:
+            print(f"  Admitted downloads by size: {self.admission.summary()}")
+
+    # --- 工作完成 ---
+
+    def _complete(self, job):
+        self.admission.release(job.reserved)
+        job.reserved = 0
+        if job.accepted:
+            self.db.add_history(job.source, job.url)
+        job.done.set()
+
+    def _finish(self, candidate, result):
+        candidate.staged.close()
+        get_metrics().inc("files_total", result=result)
+        if candidate.job.member_done(result):
+            self._complete(candidate.job)
+
+    def _reject(self, job, reason):
+        job.results.append(NOT_PE)
+        get_metrics().inc("files_total", result=NOT_PE)
+        get_metrics().inc("rejected_total", reason=reason)
+
+    def _enumerated(self, job):
+        if job.enumerated():
+            self._complete(job)
+
+    def _on_error(self, stage, item, e):
+        if isinstance(item, Candidate):
+            print(f"   [!] {stage} failed for {item.member_path}: {e}")
+            self._finish(item, ERROR)
+        elif isinstance(item, Download):
+            print(f"  Error during extract: {e}")
+            if item.spool is not None:
+                item.spool.close()
+                self.spool_slots.release()
+            self._enumerated(item.job)
+        elif isinstance(e, RateLimited):
+            print(f"  [DEFER] {item.url}: {e}")
+            item.rate_limited = True
+            self._defer(item, e.retry_at)
+            self._enumerated(item)
+        else:
+            print(f"  Error during download: {e}")
+            get_metrics().inc("download_failures_total", status="error")
+            self._enumerated(item)
+
+    # --- 各階段 ---
+
+    def _stage_candidate(self, job, chunks, member_path, size_hint=None):
+        """
+        先看前 4KB，不是 PE 的內容不會進入暫存區；通過的內容計算 SHA256 後成為 Candidate。
+        """
+        verdict, detail, chunks = sniff_stream(chunks)
+        if verdict not in (OK, NEED_MORE):
+            print(f"   [REJECT] Not a valid PE: {member_path} ({detail})")
+            self._reject(job, verdict)
+            return None
+        staged = self.store.stage(chunks, size_hint)
+        job.add_member()
+        return Candidate(job, member_path, staged, verdict)
+
+    def _admit(self, job):
+        """
+        下載前的准入檢查：已下載過、模擬模式、大小桶配額與磁碟預算。
+        大小優先使用來源提供的資訊 (GitHub asset size、catalog packageSize)，沒有時送出 HEAD 取得 Content-Length。
+        """
+        if self.stop.is_set() or SHUTDOWN.is_set():
+            self._enumerated(job)
+            return None
+        if self.db.seen(job.source, job.url):
+            print(f"  [SKIP] Already downloaded: {job.url}")
+            self._enumerated(job)
+            return None
+        if not self.enable_download:
+            print(f"  [DRY RUN] Would download: {job.url}")
+            self._enumerated(job)
+            return None
+
+        size = job.size
+        if size is None and self.admission.head_requests:
+            try:
+                res = self.engine.head(job.url, timeout=15, allow_redirects=True)
+                length = res.headers.get("Content-Length")
+                if res.status_code == 200 and length and length.isdigit():
+                    size = job.size = int(length)
+                res.close()
+            except Exception as e:
+                print(f"  [!] HEAD request failed for {job.url}: {e}")
+
+        admitted, detail = self.admission.admit(size)
+        if not admitted:
+            print(f"  [ADMISSION] Skipped {job.url}: {detail}")
+            self._enumerated(job)
+            return None
+        job.reserved = size or 0
+        return [job]
+
+    def _fetch(self, job):
+        if self.stop.is_set() or SHUTDOWN.is_set():
+            self._enumerated(job)
+            return None
+
+        print(f"  Downloading: {job.url}")
+        if job.kind == ARCHIVE:
+            download = self._fetch_archive(job)
+            if download is None:
+                self._enumerated(job)
+                return None
+            return [download]
+
+        resumable_min = get_download_settings().get("RESUMABLE_MIN_MB", 16) * 1024 * 1024
+        if job.size and job.size >= resumable_min:
+            candidate = self._fetch_resumable(job)
+            if candidate is None:
+                self._enumerated(job)
+                return None
+            return [candidate]
+
+        with self.engine.slot(job.url):
+            response = self.engine.get(job.url, stream=True, timeout=job.timeout, allow_redirects=True)
+            if not self._check_status(job, response):
+                self._enumerated(job)
+                return None
+            size_hint = job.size or int(response.headers.get("Content-Length", 0) or 0)
+            name = job.name or guess_file_name(job.url, response)
+            try:
+                candidate = self._stage_candidate(job, iter_response(response), name, size_hint)
+            finally:
+                response.close()
+        # 單一檔案不需要解壓，unpack 階段會直接轉交
+        if candidate is None:
+            self._enumerated(job)
+            return None
+        return [candidate]
+
+    def _fetch_resumable(self, job):
+        """
+        大檔 (例如 PortableApps / SourceForge 的 .paf.exe) 寫到 .incoming/parts 的 .part 檔，
+        斷線時以 Range 續傳，上一輪沒下載完的部分也會接著下載。
+        """
+        sniffed = {}
+
+        def check_head(head):
+            verdict, detail = sniff_pe_header(head)
+            sniffed["verdict"] = verdict
+            if verdict not in (OK, NEED_MORE):
+                print(f"   [REJECT] Not a valid PE: {job.name or job.url} ({detail})")
+                self._reject(job, verdict)
+                return False
+            return True
+
+        download = ResumableDownload(self.engine, job.url, self.store.incoming / PART_DIR,
+                                     job.size, job.timeout, check_head)
+        with self.engine.slot(job.url):
+            path = download.run()
+        if path is None:
+            if download.status_code not in (200, 206):
+                self._http_failed(job, download.status_code, download.headers)
+            return None
+
+        name = job.name or guess_file_name(job.url, download)
+        staged = self.store.stage_file(path)
+        job.add_member()
+        return Candidate(job, name, staged, sniffed["verdict"])
+
+    def _fetch_archive(self, job):
+        settings = get_download_settings()
+        # 大型 zip 優先以 Range 只抓需要的成員
+        min_remote = settings.get("REMOTE_ZIP_MIN_MB", 8) * 1024 * 1024
+        if job.remote_zip and settings.get("REMOTE_ZIP", True) and (job.size is None or job.size >= min_remote):
+            try:
+                with self.engine.slot(job.url):
+                    rz = RemoteZip(self.engine, job.url)
+                    entries = list(iter_zip_members(rz.entries()))
+                print(f"   [RANGE] {len(entries)} matching members in central directory ({len(rz.entries())} total)")
+                return Download(job, remote=rz, entries=entries)
+            except RangeNotSupported as e:
+                print(f"   [*] Range requests not supported ({e}), downloading whole archive.")
+            except ValueError as e:
+                print(f"   [*] Could not read remote central directory ({e}), downloading whole archive.")
+
+        # 先以區塊方式寫入暫存區 (大檔會落到磁碟)；名額用完時在這裡等 unpack 消化
+        self.spool_slots.acquire()
+        try:
+            with self.engine.slot(job.url):
+                response = self.engine.get(job.url, stream=True, timeout=job.timeout)
+                if not self._check_status(job, response):
+                    self.spool_slots.release()
+                    return None
+                spool = spool_response(response)
+        except Exception:
+            self.spool_slots.release()
+            raise
+        return Download(job, spool=spool)
+
+    def _check_status(self, job, response):
+        if response.status_code == 200:
+            return True
+        response.close()
+        self._http_failed(job, response.status_code, response.headers)
+        return False
+
+    def _http_failed(self, job, status_code, headers=None):
+        print(f"  Failed to download {job.url} (HTTP {status_code})")
+        get_metrics().inc("download_failures_total", status=status_code)
+        if status_code in (403, 429):
+            job.rate_limited = True
+            # 退避重試後仍被限流：記下來，下一輪再試，而不是直接丟掉
+            # (403 只有在帶著 Retry-After 或額度歸零時才確定是限流，其他 403 重試也沒用)
+            headers = headers or {}
+            retry_at = parse_retry_after(headers)
+            remaining, _, reset = parse_rate_limit(headers)
+            if remaining == 0 and reset is not None:
+                retry_at = max(retry_at or 0, reset)
+            if status_code == 429 or retry_at is not None:
+                self._defer(job, retry_at or time.time() + DEFAULT_MAX_BACKOFF)
+            if self.stop_on_rate_limit:
+                self.stop.set()
+
+    def _defer(self, job, retry_at):
+        get_metrics().inc("deferred_total")
+        self.db.execute(
+            "INSERT OR REPLACE INTO deferred_jobs "
+            "(source, url, kind, size, name, remote_zip, timeout, retry_at, deferred_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.source, job.url, job.kind, job.size, job.name, int(job.remote_zip), job.timeout,
+             retry_at, time.time()))
+
+    def _unpack(self, item):
+        if isinstance(item, Candidate):
+            item.job.enumerated()
+            yield item
+            return
+
+        job = item.job
+        try:
+            if item.remote is not None:
+                for entry in item.entries:
+                    try:
+                        with self.engine.slot(job.url):
+                            candidate = self._stage_candidate(job, item.remote.iter_member(entry), entry.filename)
+                    except ValueError as e:
+                        print(f"   [SKIP] {entry.filename}: {e}")
+                        continue
+                    if candidate is not None:
+                        yield candidate
+            else:
+                with zipfile.ZipFile(item.spool) as z:
+                    for file_info in iter_zip_members(z.infolist()):
+                        with z.open(file_info) as member:
+                            candidate = self._stage_candidate(job, iter_fileobj(member), file_info.filename)
+                        if candidate is not None:
+                            yield candidate
+        finally:
+            if item.spool is not None:
+                item.spool.close()
+                item.spool = None
+                self.spool_slots.release()
+        self._enumerated(job)
+
+    def _validate(self, c):
+        store = self.store
+        if store.contains(c.staged.sha256):
+            store.add_manifest(c.job.source, c.job.url, c.member_path, c.staged.sha256)
+            print(f"   [DEDUP] Already in store: {c.member_path} ({c.staged.sha256[:12]})")
+            self._finish(c, DUPLICATE)
+            return None
+
+        if store.known_infected(c.staged.sha256):
+            print(f"   [SKIP] Previously flagged by ClamAV: {c.member_path}")
+            self._finish(c, INFECTED)
+            return None
+
+        store.materialize(c.staged)
+        return [c]
+
+    def _sign(self, c):
+        # 檔頭超過 4KB 才有 PE 簽章的少數情況，改用完整檔案再驗證一次
+        is_pe, info, c.fingerprint, c.similarity = self.pipeline.run_cpu(
+            inspect_sample, str(c.staged.path), c.verdict == NEED_MORE, self.similarity.enabled)
+        if not is_pe:
+            print(f"   [DELETE] Not a valid PE: {c.member_path}")
+            get_metrics().inc("rejected_total", reason="full_parse")
+            self._finish(c, NOT_PE)
+            return None
+        c.signed = info is not None
+
+        # 群集的變體數已達上限就不必再掃描 (最後由 commit 階段再確認一次)
+        if self._near_duplicate(c):
+            return None
+        return [c]
+
+    def _near_duplicate(self, c):
+        """
+        群集的變體數已達 MAX_VARIANTS 時，以 NEAR_DUPLICATE 結束這個候選並回傳 True。
+        """
+        if not c.similarity:
+            return False
+        cluster, variants, score = self.similarity.check(*c.similarity, exclude=c.staged.sha256)
+        if not self.similarity.over_cap(variants):
+            return False
+        print(f"   [SKIP] Near-duplicate ({score:.0%}) of a cluster with {variants} variants: {c.member_path}")
+        self._finish(c, NEAR_DUPLICATE)
+        return True
+
+    def _scan(self, c):
+        if not scan_with_clamav(c.staged.path):
+            print(f"   [DELETE] ClamAV detected threat: {c.member_path}")
+            self.db.record_file(c.staged.sha256, c.job.source, c.job.url, None, c.staged.size, c.signed, "infected")
+            self._finish(c, INFECTED)
+            return None
+        return [c]
+
+    def _commit(self, c):
+        store = self.store
+        staged = c.staged
+        # 同一內容的兩個候選可能同時通過 validate，統計只算先存入的那一份
+        existed = store.contains(staged.sha256)
+        # 同一群集的多個變體可能同時通過 sign 階段的檢查；commit 只有一個 worker，
+        # 依已經存入的樣本再檢查一次，MAX_VARIANTS 才是真正的上限
+        if not existed and self._near_duplicate(c):
+            return None
+        dest = store.commit(staged)
+        self.db.record_file(staged.sha256, c.job.source, c.job.url, dest, staged.size, c.signed, "clean")
+        store.add_manifest(c.job.source, c.job.url, c.member_path, staged.sha256)
+        kind = ""
+        if c.fingerprint:
+            self.fingerprints.record(staged.sha256, *c.fingerprint)
+            kind = f" [{c.fingerprint[0]}]"
+        if c.similarity:
+            self.similarity.record(staged.sha256, *c.similarity)
+        if not existed:
+            self.stats.add(c.job.source, c.fingerprint[0] if c.fingerprint else None, staged.size, c.signed)
+        signed = " (Signed)" if c.signed else " (Unsigned)"
+        print(f"   Stored and verified: {c.member_path}{signed}{kind} (Clean)")
+        self._finish(c, NEW)
+        return None
@@ -1,121 +1,28 @@
-import os
-import requests
 import yaml
-import zipfile
-import io
-import json
-import time
-from pathlib import Path
-from utils import check_disk_usage, get_threshold_from_config, is_pe_file, remove_empty_dirs, verify_signature, scan_with_clamav
+import datetime
+from utils import check_disk_usage, get_threshold_from_config
+from state_db import get_db
+from fetch_engine import get_engine
+from sample_store import get_store
+from collect_pipeline import CollectPipeline, FetchJob, ARCHIVE, SHUTDOWN
+from nuget_catalog import get_catalog_packages, parse_timestamp
+from fingerprint import get_index
+from metrics import instrumented, timed
 
-HISTORY_FILE = Path("benign_pe/metadata/history_choco.json")
-STATE_FILE = Path("benign_pe/metadata/discovery_state.json")
+SOURCE = "choco"
 
 def load_config():
     with open("config.yaml", "r") as f:
         return yaml.safe_load(f)
 
-def load_history():
-    if HISTORY_FILE.exists():
-        try:
-            with open(HISTORY_FILE, "r") as f:
-                return set(json.load(f))
-        except Exception as e:
-            print(f"Error loading history: {e}")
-    return set()
-
-def save_history(history):
-    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-    try:
-        with open(HISTORY_FILE, "w") as f:
-            json.dump(list(history), f, indent=2)
-    except Exception as e:
-        print(f"Error saving history: {e}")
-
-def load_discovery_state():
-    if STATE_FILE.exists():
-        try:
-            with open(STATE_FILE, "r") as f:
-                return json.load(f)
-        except:
-            pass
-    return {}
-
-def save_discovery_state(state):
-    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f, indent=2)
-    except:
-        pass
-
-def download_and_extract_nupkg(url, target_dir, enable_download, history):
-    if url in history:
-        print(f"  [SKIP] Already processed: {url}")
-        return False
-
-    if not enable_download:
-        print(f"  [DRY RUN] Would download nupkg: {url}")
-        return False
-
-    print(f"  Downloading nupkg: {url}")
-    try:
-        response = requests.get(url, timeout=60)
-        if response.status_code != 200:
-            print(f"  Failed to download {url} (HTTP {response.status_code})")
-            if response.status_code in [403, 429]:
-                return "RATE_LIMIT"
-            return False
-
-        # nupkg 是一個 zip 檔案
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            extracted_any = False
-            for file_info in z.infolist():
-                # 排除 macOS 系統垃圾檔案
-                if "__MACOSX" in file_info.filename or os.path.basename(file_info.filename).startswith("._"):
-                    continue
-                    
-                # 只有副檔名在允許清單內的才解壓
-                if any(file_info.filename.lower().endswith(ext) for ext in [".exe", ".dll", ".sys"]):
-                    # 避免解壓到外部
-                    # The original code used os.path.basename, but z.extract handles paths within the zip.
-                    # We need to ensure the full path is used for extraction and subsequent PE check.
-                    if not file_info.is_dir(): # Only process files, not directories
-                        if not target_dir.exists():
-                            target_dir.mkdir(parents=True, exist_ok=True)
-                        z.extract(file_info, target_dir)
-                        extracted_path = target_dir / file_info.filename
-                        
-                        if is_pe_file(extracted_path):
-                            signed = " (Signed)" if verify_signature(extracted_path) else " (Unsigned)"
-                            
-                            # ClamAV 掃描
-                            if scan_with_clamav(extracted_path):
-                                print(f"   Extracted and verified: {file_info.filename}{signed} (Clean)")
-                                extracted_any = True # Only count as extracted if it's a valid PE and clean
-                            else:
-                                print(f"   [DELETE] ClamAV detected threat: {file_info.filename}")
-                                os.remove(extracted_path)
-                        else:
-                            print(f"   [DELETE] Not a valid PE: {file_info.filename}")
-                            os.remove(extracted_path)
-            
-            if extracted_any:
-                history.add(url)
-                save_history(history)
-                return True
-    except Exception as e:
-        print(f"  Error processing nupkg: {e}")
-    return False
-
+@timed("discovery")
 def get_choco_packages(config):
     choco_conf = config.get("CHOCO_SETTINGS", {})
     query = choco_conf.get("QUERY", "")
     max_pkgs = choco_conf.get("MAX_PACKAGES_PER_RUN", 5)
     
-    state = load_discovery_state()
-    choco_state = state.get("choco", {})
-    current_skip = choco_state.get("skip", 0)
+    db = get_db()
+    current_skip = db.get_cursor(SOURCE, "skip", 0)
     
     # 使用 NuGet V3 API 搜尋
     search_url = f"https://azuresearch-usnc.nuget.org/query?q={query}&take={max_pkgs}&skip={current_skip}&prerelease=false"
@@ -124,13 +31,13 @@ def get_choco_packages(config):
     packages = []
     
     try:
-        res = requests.get(search_url, timeout=15)
+        res = get_engine().get(search_url, timeout=15, use_cache=True)
         if res.status_code == 200:
             data = res.json()
             items = data.get("data", [])
             if not items:
                 # 沒東西了就從頭開始
-                choco_state["skip"] = 0
+                db.set_cursor(SOURCE, "skip", 0)
             else:
                 for item in items:
                     pkg_id = item.get("id")
@@ -138,7 +45,7 @@ def get_choco_packages(config):
                     download_url = f"https://www.nuget.org/api/v2/package/{pkg_id}/{version}"
                     packages.append({"id": pkg_id, "url": download_url})
                 # 下一輪繼續往下跳
-                choco_state["skip"] = current_skip + max_pkgs
+                db.set_cursor(SOURCE, "skip", current_skip + max_pkgs)
         else:
             print(f" [!] Chocolatey Search API Error: HTTP {res.status_code}")
             if res.status_code in [403, 429]:
@@ -147,39 +54,107 @@ def get_choco_packages(config):
     except Exception as e:
         print(f"Error fetching choco packages: {e}")
         
-    state["choco"] = choco_state
-    save_discovery_state(state)
+    db.commit()
     return packages
 
+@timed("discovery")
+def get_catalog_mode_packages(config):
+    """
+    依 NuGet V3 catalog 的 commit 游標，只取上次之後發布、且檔案清單中含有 PE 的套件。
+    回傳 (packages, catalog_cursor, deferred)；deferred 是分類超過配額、留到之後再處理的套件。
+    """
+    choco_conf = config.get("CHOCO_SETTINGS", {})
+    max_pkgs = choco_conf.get("MAX_PACKAGES_PER_RUN", 5)
+    db = get_db()
+    over_quota = get_index(db).over_quota()
+
+    # 之前因分類超過配額而延後的套件：配額空出來就優先處理，否則繼續等待
+    saved = db.get_cursor(SOURCE, "catalog_deferred", [])
+    resumed = [pkg for pkg in saved if pkg.get("category") not in over_quota]
+    waiting = [pkg for pkg in saved if pkg.get("category") in over_quota]
+    if resumed:
+        print(f"[*] Resuming {len(resumed)} packages deferred while their category was over quota.")
+    packages = resumed[:max_pkgs]
+
+    saved = db.get_cursor(SOURCE, "catalog_commit")
+    if saved:
+        cursor = parse_timestamp(saved)
+    else:
+        # 第一次執行：不從 2015 年開始，只回溯設定的天數
+        days = choco_conf.get("CATALOG_START_DAYS", 30)
+        cursor = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+    print(f"Reading NuGet catalog since {cursor.isoformat()}Z (Max: {max_pkgs})")
+    try:
+        found, catalog_cursor, deferred = get_catalog_packages(
+            get_engine(), cursor, max_pkgs - len(packages), choco_conf.get("INCLUDE_PRERELEASE", False),
+            skip_categories=over_quota)
+    except Exception as e:
+        print(f"Error reading NuGet catalog: {e}")
+        return packages, None, None
+    packages += found
+
+    # 與 GitHub 探索相同：超過配額的套件排在最後，這一輪名額有剩才處理，其餘留到之後
+    deferred = resumed[max_pkgs:] + waiting + deferred
+    spare = max(0, max_pkgs - len(packages))
+    packages += deferred[:spare]
+    return packages, catalog_cursor, deferred[spare:][-choco_conf.get("MAX_DEFERRED", 5000):]
+
+@instrumented(SOURCE)
 def main():
     config = load_config()
     enable_download = config.get("ENABLE_DOWNLOAD", False)
     threshold = get_threshold_from_config()
-    history = load_history()
+    db = get_db()
+    store = get_store(db)
     
     if enable_download and not check_disk_usage(threshold):
-        return
+        return None
 
-    packages = get_choco_packages(config)
+    choco_conf = config.get("CHOCO_SETTINGS", {})
+    catalog_cursor = deferred = None
+    if choco_conf.get("MODE", "catalog") == "catalog":
+        packages, catalog_cursor, deferred = get_catalog_mode_packages(config)
+    else:
+        packages = get_choco_packages(config)
     print(f"\nFound {len(packages)} Chocolatey packages to process.")
-    
-    base_dir = Path("benign_pe/chocolatey")
-    base_dir.mkdir(parents=True, exist_ok=True)
 
-    for pkg in packages:
-        print(f"\n--- Processing Package: {pkg['id']} ---")
-        target_dir = base_dir / pkg['id']
-        # target_dir.mkdir(parents=True, exist_ok=True) # <-- 改為延遲建立
-        
-        result = download_and_extract_nupkg(pkg['url'], target_dir, enable_download, history)
-        if result == "RATE_LIMIT":
-            print(" [!] Rate Limit hit during download. Stopping Choco cycle.")
-            break
-        
-        time.sleep(1)
+    # nupkg 是一個 zip 檔案；遇到 403/429 時管線會略過尚未開始的下載
+    collector = CollectPipeline(store, enable_download, get_engine(), stop_on_rate_limit=True)
+    collector.start()
+    # collector.jobs 也包含 requeue_deferred 重新排入的下載，套件的統計只看這一輪列出的套件
+    package_jobs = []
+    # 爬蟲中途丟出例外時也要關閉管線 (等待進行中的工作、停止執行緒)
+    try:
+        collector.requeue_deferred(SOURCE)
+        for pkg in packages:
+            if SHUTDOWN.is_set():
+                break
+            # catalog 模式的 leaf 帶有 packageSize，search 模式則由管線以 HEAD 取得大小
+            job = FetchJob(SOURCE, pkg['url'], ARCHIVE, size=pkg.get('size'), name=pkg['id'])
+            package_jobs.append(job)
+            collector.submit(job)
+    finally:
+        collector.close()
+    collector.report()
+
+    rate_limited = any(job.rate_limited for job in collector.jobs)
+    if rate_limited:
+        print(" [!] Rate Limit hit while downloading nupkgs. Stopped Choco cycle.")
+    accepted = sum(1 for job in collector.jobs if job.accepted)
+    packages_accepted = sum(1 for job in package_jobs if job.accepted)
+    print(f"\nChocolatey cycle finished: {packages_accepted}/{len(package_jobs)} packages accepted.")
+
+    # 全部處理完才推進 catalog 游標，被中斷的這一批下一輪會重新列出 (已下載的由 history 略過)
+    if catalog_cursor is not None and not rate_limited and not SHUTDOWN.is_set() and enable_download:
+        db.set_cursor(SOURCE, "catalog_commit", catalog_cursor.isoformat())
+        db.set_cursor(SOURCE, "catalog_deferred", deferred)
         
-    # 執行完畢後清理空資料夾
-    remove_empty_dirs(base_dir)
+    db.commit()
+    # 拿滿了這一輪的上限，代表 catalog / 搜尋結果還有沒處理完的套件
+    max_pkgs = choco_conf.get("MAX_PACKAGES_PER_RUN", 5)
+    return {"jobs": len(collector.jobs), "accepted": accepted, "backlog": len(packages) >= max_pkgs,
+            "rate_limited": rate_limited, "retry_at": None, "stages": collector.pipeline.stats()}
 
 if __name__ == "__main__":
     main()
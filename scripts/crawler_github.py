@@ -1,157 +1,53 @@
 import os
-import requests
 import yaml
-import zipfile
-import io
-import time
-import json
-from pathlib import Path
-from utils import check_disk_usage, get_threshold_from_config, is_pe_file, remove_empty_dirs, verify_signature, scan_with_clamav
-
-HISTORY_FILE = Path("benign_pe/metadata/history_github.json")
-STATE_FILE = Path("benign_pe/metadata/discovery_state.json")
+from utils import check_disk_usage, get_threshold_from_config
+from state_db import get_db
+from fetch_engine import get_engine
+from github_graphql import fetch_latest_releases, GraphQLUnavailable, MAX_BATCH
+from sample_store import get_store
+from rate_limit import RateLimited
+from fingerprint import get_index, category_for_language
+from collect_pipeline import CollectPipeline, FetchJob, ARCHIVE, FILE, SHUTDOWN
+from metrics import instrumented, timed
+
+SOURCE = "github"
 
 def load_config():
     with open("config.yaml", "r") as f:
         return yaml.safe_load(f)
 
-def load_history():
-    if HISTORY_FILE.exists():
-        try:
-            with open(HISTORY_FILE, "r") as f:
-                return set(json.load(f))
-        except Exception as e:
-            print(f"Error loading history: {e}")
-    return set()
-
-def save_history(history):
-    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-    try:
-        with open(HISTORY_FILE, "w") as f:
-            json.dump(list(history), f, indent=2)
-    except Exception as e:
-        print(f"Error saving history: {e}")
-
-def load_discovery_state():
-    if STATE_FILE.exists():
-        try:
-            with open(STATE_FILE, "r") as f:
-                return json.load(f)
-        except:
-            pass
-    return {}
-
-def save_discovery_state(state):
-    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f, indent=2)
-    except:
-        pass
-
-def download_and_extract(url, target_dir, enable_download, history):
-    if url in history:
-        print(f"  [SKIP] Already downloaded: {url}")
-        return False
-
-    if not enable_download:
-        print(f"  [DRY RUN] Would download: {url}")
-        return False
-
-    print(f"  Downloading: {url}")
-    try:
-        response = requests.get(url, stream=True, timeout=30)
-        if response.status_code != 200:
-            print(f"  Failed to download {url}")
-            return False
-
-        success = False
-        # 檢查是否為 zip
-        if url.lower().endswith(".zip"):
-            with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-                extracted_any = False
-                for file_info in z.infolist():
-                    # 排除 macOS 系統垃圾檔案
-                    if "__MACOSX" in file_info.filename or os.path.basename(file_info.filename).startswith("._"):
-                        continue
-                        
-                    if any(file_info.filename.lower().endswith(ext) for ext in [".exe", ".dll", ".sys"]):
-                        if not target_dir.exists():
-                            target_dir.mkdir(parents=True, exist_ok=True)
-                            
-                        z.extract(file_info, target_dir)
-                        
-                        extracted_path = target_dir / file_info.filename
-                        
-                        # 嚴格驗證 PE 簽章
-                        if is_pe_file(extracted_path):
-                            signed = " (Signed)" if verify_signature(extracted_path) else " (Unsigned)"
-                            
-                            # ClamAV 掃描
-                            if scan_with_clamav(extracted_path):
-                                print(f"   Extracted and verified: {file_info.filename}{signed} (Clean)")
-                                extracted_any = True
-                            else:
-                                print(f"   [DELETE] ClamAV detected threat: {file_info.filename}")
-                                os.remove(extracted_path)
-                        else:
-                            print(f"   [DELETE] Not a valid PE: {file_info.filename}")
-                            os.remove(extracted_path)
-                success = extracted_any
-        else:
-            # 單一檔案直接存
-            file_name = url.split("/")[-1]
-            dest_path = target_dir / file_name
-            content = response.content
-
-            if not target_dir.exists():
-                target_dir.mkdir(parents=True, exist_ok=True)
-                
-            with open(dest_path, 'wb') as f:
-                f.write(content)
-            
-            # 嚴格驗證 PE 簽章
-            if is_pe_file(dest_path):
-                signed = " (Signed)" if verify_signature(dest_path) else " (Unsigned)"
-                
-                # ClamAV 掃描
-                if scan_with_clamav(dest_path):
-                    print(f"   Saved and verified: {file_name}{signed} (Clean)")
-                    success = True
-                else:
-                    print(f"   [DELETE] ClamAV detected threat: {file_name}")
-                    os.remove(dest_path)
-                    success = False
-            else:
-                print(f"   [DELETE] Not a valid PE: {file_name}")
-                os.remove(dest_path)
-                success = False
-        
-        if success:
-            history.add(url)
-            save_history(history)
-            return True
-            
-    except Exception as e:
-        print(f"  Error during download/extract: {e}")
-    return False
+def get_reset_time(res):
+    reset_time = res.headers.get('X-RateLimit-Reset')
+    return int(reset_time) if reset_time and reset_time.isdigit() else None
 
-def get_automated_repos(config):
+@timed("discovery")
+def get_automated_repos(config, status=None):
     discovery = config.get("DISCOVERY_SETTINGS", {})
     min_stars = discovery.get("MIN_STARS", 500)
     queries = discovery.get("QUERIES", ["topic:windows"])
     max_repos = discovery.get("MAX_REPOS_PER_RUN", 10)
     
-    state = load_discovery_state()
-    github_state = state.get("github", {})
+    db = get_db()
+    github_state = db.get_cursors(SOURCE)
     
-    found_repos = []
+    over_quota = get_index(db).over_quota()
+    if over_quota:
+        print(f"[*] Over quota, deprioritized: {', '.join(sorted(over_quota))}")
+
+    # 上一輪因速率限制 (或停止) 沒有查完的 Repo 優先處理
+    found_repos = list(db.get_cursor(SOURCE, "deferred_repos", []))
+    db.set_cursor(SOURCE, "deferred_repos", [])
+    if found_repos:
+        print(f"[*] Resuming {len(found_repos)} repos deferred from the previous cycle.")
+    deferred = []
     headers = {"Accept": "application/vnd.github.v3+json"}
     token = os.environ.get("GITHUB_TOKEN")
     if token:
         headers["Authorization"] = f"token {token}"
     
     for query in queries:
+        if len(found_repos) >= max_repos:
+            break
         # 取得該查詢上次讀到的頁碼，預設為 1
         current_page = github_state.get(query, 1)
         
@@ -159,21 +55,26 @@ def get_automated_repos(config):
         print(f"Searching for repos with query: {query} (Page: {current_page})")
         
         try:
-            res = requests.get(search_url, headers=headers, timeout=15)
+            res = get_engine().get(search_url, headers=headers, timeout=15, use_cache=True)
             if res.status_code == 200:
                 items = res.json().get("items", [])
                 if not items:
                     # 如果沒東西了，就把頁碼重置回 1 重新循環
-                    github_state[query] = 1
+                    db.set_cursor(SOURCE, query, 1)
                 else:
                     for item in items:
                         repo_full_name = item.get("full_name")
-                        if repo_full_name not in found_repos:
-                            found_repos.append(repo_full_name)
-                            if len(found_repos) >= max_repos:
-                                break
+                        if repo_full_name in found_repos or repo_full_name in deferred:
+                            continue
+                        # 主要語言所屬的分類已經超過配額，先放到後面，名額有剩才處理
+                        if category_for_language(item.get("language")) in over_quota:
+                            deferred.append(repo_full_name)
+                            continue
+                        found_repos.append(repo_full_name)
+                        if len(found_repos) >= max_repos:
+                            break
                     # 下一輪從下一頁開始
-                    github_state[query] = current_page + 1
+                    db.set_cursor(SOURCE, query, current_page + 1)
                 if res.status_code == 403:
                     reset_time = res.headers.get('X-RateLimit-Reset')
                     if reset_time:
@@ -185,84 +86,140 @@ def get_automated_repos(config):
                 print(f" [!] GitHub Search API: HTTP {res.status_code}")
                 if res.status_code == 403:
                     print("  [!] Rate Limit hit during discovery.")
-                    return []
+                    if status is not None:
+                        status["rate_limited"] = True
+                        status["retry_at"] = get_reset_time(res)
+                    break # 已經找到的 Repo 照常處理
+        except RateLimited as e:
+            # 搜尋額度要等一段時間才重置：這個查詢的頁碼不前進，下一輪再從這裡繼續
+            print(f"  [!] {e}")
+            if status is not None:
+                status["rate_limited"] = True
+                status["retry_at"] = e.retry_at
+            break
         except Exception as e:
             print(f" Error during discovery: {e}")
         
         if len(found_repos) >= max_repos:
             break
-            
-    state["github"] = github_state
-    save_discovery_state(state)
+
+    found_repos += deferred[:max(0, max_repos - len(found_repos))]
+    db.commit()
     return found_repos
 
+@instrumented(SOURCE)
 def main():
     config = load_config()
     enable_download = config.get("ENABLE_DOWNLOAD", False)
     threshold = get_threshold_from_config()
-    history = load_history()
+    db = get_db()
+    store = get_store(db)
     
     if enable_download and not check_disk_usage(threshold):
-        return
+        return None
 
     # 1. 全自動發現 Repo
-    repos = get_automated_repos(config)
+    status = {"rate_limited": False, "retry_at": None}
+    repos = get_automated_repos(config, status)
     print(f"\nDiscovered {len(repos)} repositories to process.")
     
-    base_dir = Path("benign_pe/github_release")
     headers = {"Accept": "application/vnd.github.v3+json"}
     token = os.environ.get("GITHUB_TOKEN")
     if token:
         headers["Authorization"] = f"token {token}"
 
-    download_total = 0
-
-    # 2. 遍歷每一個發現的 Repo
-    for repo in repos:
-        print(f"\n--- Checking Repo: {repo} ---")
-        api_url = f"https://api.github.com/repos/{repo}/releases/latest"
+    engine = get_engine()
+    collector = CollectPipeline(store, enable_download, engine)
+    collector.start()
+    # 爬蟲中途丟出例外時也要關閉管線 (等待進行中的工作、停止執行緒)
+    try:
+        collector.requeue_deferred(SOURCE)
+
+        def queue_assets(assets):
+            found_assets = False
+            for asset in assets:
+                asset_url = asset.get("browser_download_url")
+                if any(asset_url.lower().endswith(ext) for ext in [".exe", ".dll", ".zip", ".msi"]):
+                    # 下載與檢查交給收集管線，不阻塞下一個 Repo 的查詢
+                    is_zip = asset_url.lower().endswith(".zip")
+                    collector.submit(FetchJob(SOURCE, asset_url, ARCHIVE if is_zip else FILE,
+                                              size=asset.get("size"), name=asset_url.split("/")[-1],
+                                              remote_zip=is_zip, timeout=30))
+                    found_assets = True
+            if not found_assets:
+                print(f"  [SKIP] No PE-related files (exe/dll/zip/msi) found in assets.")
+
+        # 2. 先以 GraphQL 一次查詢最多 100 個 Repo 的 latest release
+        pending = list(repos)
+        discovery = config.get("DISCOVERY_SETTINGS", {})
+        if discovery.get("USE_GRAPHQL", True) and token and pending:
+            try:
+                releases = fetch_latest_releases(engine, pending, token, discovery.get("GRAPHQL_BATCH_SIZE", MAX_BATCH))
+                for repo, assets in releases.items():
+                    print(f"\n--- Checking Repo: {repo} ---")
+                    if assets is None:
+                        print(f" No releases found for {repo}.")
+                    else:
+                        queue_assets(assets)
+                pending = [repo for repo in pending if repo not in releases]
+            except GraphQLUnavailable as e:
+                print(f" [!] GitHub GraphQL unavailable ({e}), falling back to REST.")
+
+        # 3. GraphQL 沒處理到的 Repo 改用 REST 逐一查詢 (由 api.github.com 的速率限制控制節奏)
+        deferred = []
+        for index, repo in enumerate(pending):
+            if SHUTDOWN.is_set():
+                deferred = pending[index:]
+                break
+            print(f"\n--- Checking Repo: {repo} ---")
+            api_url = f"https://api.github.com/repos/{repo}/releases/latest"
         
-        try:
-            res = requests.get(api_url, headers=headers, timeout=15)
-            if res.status_code == 200:
-                release_data = res.json()
-                assets = release_data.get("assets", [])
-                
-                repo_name = repo.split("/")[-1]
-                target_dir = base_dir / repo_name
-                # target_dir.mkdir(parents=True, exist_ok=True)  # <-- 改為延遲建立
-
-                found_assets = False
-                for asset in assets:
-                    asset_url = asset.get("browser_download_url")
-                    if any(asset_url.lower().endswith(ext) for ext in [".exe", ".dll", ".zip", ".msi"]):
-                        if download_and_extract(asset_url, target_dir, enable_download, history):
-                            download_total += 1
-                            found_assets = True
-                
-                if not found_assets:
-                    print(f"  [SKIP] No PE-related files (exe/dll/zip/msi) found in assets.")
+            try:
+                res = engine.get(api_url, headers=headers, timeout=15, use_cache=True)
+                if res.status_code == 200:
+                    release_data = res.json()
+                    queue_assets(release_data.get("assets", []))
             
-            elif res.status_code == 404:
-                print(f" No releases found for {repo}.")
-            elif res.status_code == 403:
-                print(f" [!] Rate Limit: GitHub API blocked access for {repo}.")
-                reset_time = res.headers.get('X-RateLimit-Reset')
-                if reset_time:
-                    import datetime
-                    wait_time = datetime.datetime.fromtimestamp(int(reset_time))
-                    print(f"     API will reset at: {wait_time}")
-                print(" [!] Stopping GitHub crawler cycle to allow other crawlers to run.")
-                return # Early exit on Rate Limit
-            else:
-                print(f" [!] GitHub API Error: HTTP {res.status_code}")
-        except Exception as e:
-            print(f" Error processing {repo}: {e}")
-        
-        time.sleep(1)
-
-    # 執行完畢後清理空資料夾
-    remove_empty_dirs(base_dir)
+                elif res.status_code == 404:
+                    print(f" No releases found for {repo}.")
+                elif res.status_code == 403:
+                    print(f" [!] Rate Limit: GitHub API blocked access for {repo}.")
+                    status["rate_limited"] = True
+                    status["retry_at"] = get_reset_time(res)
+                    if status["retry_at"]:
+                        import datetime
+                        wait_time = datetime.datetime.fromtimestamp(status["retry_at"])
+                        print(f"     API will reset at: {wait_time}")
+                    print(" [!] Stopping GitHub crawler cycle to allow other crawlers to run.")
+                    deferred = pending[index:]
+                    break # Rate Limit: 停止查詢，但等待已排入的下載完成
+                else:
+                    print(f" [!] GitHub API Error: HTTP {res.status_code}")
+            except RateLimited as e:
+                print(f" [!] {e}")
+                status["rate_limited"] = True
+                status["retry_at"] = e.retry_at
+                deferred = pending[index:]
+                break
+            except Exception as e:
+                print(f" Error processing {repo}: {e}")
+
+        # 沒查到的 Repo 留給下一輪，而不是等搜尋結果再次出現
+        if deferred:
+            print(f"[*] Deferred {len(deferred)} repos to the next cycle.")
+            db.set_cursor(SOURCE, "deferred_repos", deferred)
+
+    finally:
+        collector.close()
+    collector.report()
+    download_total = sum(1 for job in collector.jobs if job.accepted)
+    print(f"\nGitHub cycle finished: {download_total}/{len(collector.jobs)} assets accepted.")
+
+    db.commit()
+    # 搜尋結果填滿了這一輪的上限，代表還有下一頁可以處理
+    max_repos = config.get("DISCOVERY_SETTINGS", {}).get("MAX_REPOS_PER_RUN", 10)
+    return dict(status, jobs=len(collector.jobs), accepted=download_total,
+                backlog=len(repos) >= max_repos or bool(deferred), stages=collector.pipeline.stats())
 
 if __name__ == "__main__":
     main()
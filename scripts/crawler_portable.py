@@ -1,106 +1,21 @@
-import os
-import requests
 import yaml
-import json
-import time
-from pathlib import Path
 from bs4 import BeautifulSoup
 import re
-from utils import check_disk_usage, get_threshold_from_config, is_pe_file, remove_empty_dirs, verify_signature, scan_with_clamav
+from utils import check_disk_usage, get_threshold_from_config
+from state_db import get_db
+from fetch_engine import get_engine
+from concurrent.futures import as_completed
+from sample_store import get_store
+from collect_pipeline import CollectPipeline, FetchJob, FILE, SHUTDOWN
+from metrics import instrumented, timed
 
-HISTORY_FILE = Path("benign_pe/metadata/history_portable.json")
+SOURCE = "portable"
 
 def load_config():
     with open("config.yaml", "r") as f:
         return yaml.safe_load(f)
 
-def load_history():
-    if HISTORY_FILE.exists():
-        try:
-            with open(HISTORY_FILE, "r") as f:
-                return set(json.load(f))
-        except Exception as e:
-            print(f"Error loading history: {e}")
-    return set()
-
-def save_history(history):
-    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-    try:
-        with open(HISTORY_FILE, "w") as f:
-            json.dump(list(history), f, indent=2)
-    except Exception as e:
-        print(f"Error saving history: {e}")
-
-def download_file(url, target_dir, enable_download, history):
-    if url in history:
-        print(f"  [SKIP] Already downloaded: {url}")
-        return False
-
-    if not enable_download:
-        print(f"  [DRY RUN] Would download: {url}")
-        return False
-
-    print(f"  Downloading: {url}")
-    try:
-        # PortableApps 通常會跳轉到 SourceForge
-        response = requests.get(url, stream=True, timeout=60, allow_redirects=True)
-        if response.status_code != 200:
-            print(f"  Failed to download {url} (Status: {response.status_code})")
-            return False
-
-        # 從 Header 或 URL 取得檔名
-        url_path = url.split("?")[0]
-        file_name = url_path.split("/")[-1]
-        
-        # 針對 PortableApps 的參數做解析
-        if "f=" in url:
-            from urllib.parse import parse_qs, urlparse
-            params = parse_qs(urlparse(url).query)
-            if 'f' in params:
-                file_name = params['f'][0]
-
-        if not file_name or file_name == "" or file_name == "redir2":
-             # 嘗試從 content-disposition 抓
-             cd = response.headers.get("content-disposition")
-             if cd:
-                 fname_match = re.findall("filename=(.+)", cd)
-                 if fname_match:
-                     file_name = fname_match[0].strip(' "')
-
-        if not file_name:
-            file_name = "downloaded_app.exe"
-
-        dest_path = target_dir / file_name
-        
-        if not target_dir.exists():
-            target_dir.mkdir(parents=True, exist_ok=True)
-            
-        with open(dest_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        # 嚴格驗證 PE 簽章
-        if is_pe_file(dest_path):
-            signed = " (Signed)" if verify_signature(dest_path) else " (Unsigned)"
-            
-            # ClamAV 掃描
-            if scan_with_clamav(dest_path):
-                print(f"   Saved and verified: {file_name}{signed} (Clean)")
-                history.add(url)
-                save_history(history)
-                return True
-            else:
-                print(f"   [DELETE] ClamAV detected threat: {file_name}")
-                os.remove(dest_path)
-                return False
-        else:
-            print(f"   [DELETE] Not a valid PE: {file_name}")
-            os.remove(dest_path)
-            return False
-    except Exception as e:
-        print(f"  Error during download: {e}")
-    return False
-
+@timed("discovery")
 def get_portable_apps(config):
     p_conf = config.get("PORTABLEAPPS_SETTINGS", {})
     base_url = p_conf.get("BASE_URL", "https://portableapps.com/apps")
@@ -109,7 +24,7 @@ def get_portable_apps(config):
     
     apps = []
     try:
-        res = requests.get(base_url, timeout=20)
+        res = get_engine().get(base_url, timeout=20, use_cache=True)
         if res.status_code == 200:
             soup = BeautifulSoup(res.text, 'html.parser')
             # 遍歷所有的 h2 分類標題
@@ -158,7 +73,7 @@ def get_portable_apps(config):
 
 def get_download_url(app_page_url):
     try:
-        res = requests.get(app_page_url, timeout=15)
+        res = get_engine().get(app_page_url, timeout=15, use_cache=True)
         if res.status_code == 200:
             soup = BeautifulSoup(res.text, 'html.parser')
             
@@ -175,7 +90,7 @@ def get_download_url(app_page_url):
                     # 進入中間跳轉頁面尋找真正的下載點 (SourceForge 或官網)
                     print(f"  Found redirect page: {downloading_url}")
                     try:
-                        res_redirect = requests.get(downloading_url, timeout=15)
+                        res_redirect = get_engine().get(downloading_url, timeout=15, use_cache=True)
                         if res_redirect.status_code == 200:
                             soup_inner = BeautifulSoup(res_redirect.text, 'html.parser')
                             # 尋找 "click here" 或是直接的跳轉連結
@@ -198,37 +113,53 @@ def get_download_url(app_page_url):
         print(f" Error fetching download page for {app_page_url}: {e}")
     return None
 
+@timed("resolve")
+def resolve_app(app):
+    print(f"\n--- Processing App: {app['name']} ---")
+    # 進入 App 頁面找下載連結
+    real_download_url = get_download_url(app['url'])
+    if not real_download_url:
+        print(f"  Could not find download URL for {app['name']}.")
+    return real_download_url
+
+@instrumented(SOURCE)
 def main():
     config = load_config()
     enable_download = config.get("ENABLE_DOWNLOAD", False)
     threshold = get_threshold_from_config()
-    history = load_history()
+    db = get_db()
+    store = get_store(db)
     
     if enable_download and not check_disk_usage(threshold):
-        return
+        return None
 
     apps = get_portable_apps(config)
     print(f"\nDiscovered {len(apps)} PortableApps to process.")
-    
-    base_dir = Path("benign_pe/portableapps")
-    base_dir.mkdir(parents=True, exist_ok=True)
-
-    for app in apps:
-        print(f"\n--- Processing App: {app['name']} ---")
-        # 進入 App 頁面找下載連結
-        real_download_url = get_download_url(app['url'])
-        
-        if real_download_url:
-            target_dir = base_dir / app['name'].replace(" ", "_").replace("/", "_")
-            # target_dir.mkdir(parents=True, exist_ok=True) # <-- 改為延遲建立
-            download_file(real_download_url, target_dir, enable_download, history)
-        else:
-            print("  Could not find download URL.")
-        
-        time.sleep(2)
 
-    # 執行完畢後清理空資料夾
-    remove_empty_dirs(base_dir)
+    # App 頁面由 portableapps.com 的工作執行緒解析，找到下載連結就交給收集管線
+    # (PortableApps 通常會跳轉到 SourceForge)
+    engine = get_engine()
+    collector = CollectPipeline(store, enable_download, engine)
+    collector.start()
+    # 爬蟲中途丟出例外時也要關閉管線 (等待進行中的工作、停止執行緒)
+    try:
+        collector.requeue_deferred(SOURCE)
+        lookups = [engine.submit(app['url'], resolve_app, app) for app in apps]
+        for lookup in as_completed(lookups):
+            url = lookup.result()
+            if url and not SHUTDOWN.is_set():
+                collector.submit(FetchJob(SOURCE, url, FILE))
+    finally:
+        collector.close()
+    collector.report()
+
+    accepted = sum(1 for job in collector.jobs if job.accepted)
+    print(f"\nPortableApps cycle finished: {accepted}/{len(apps)} apps accepted.")
+
+    db.commit()
+    # 每一輪都會掃過整個 App 列表，不會留下待處理的部分
+    return {"jobs": len(collector.jobs), "accepted": accepted, "backlog": False,
+            "rate_limited": False, "retry_at": None, "stages": collector.pipeline.stats()}
 
 if __name__ == "__main__":
     main()
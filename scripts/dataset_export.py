@@ -0,0 +1,371 @@
+import argparse
+import csv
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import pefile
+import yaml
+
+from feature_extractor import NUMERIC_COLUMNS, iter_store_samples, pe_features
+from fingerprint import FINGERPRINT_SCHEMA
+from sample_store import MANIFEST_SCHEMA
+from shard_store import Member, read_member
+from utils import close_pe
+
+DATASET_DIR = Path("benign_pe/metadata/dataset")
+VT_RESULTS = Path("benign_pe/metadata/vt_result.jsonl")
+PART_PREFIX = "part-"
+MANIFEST_NAME = "dataset.json"
+
+# 特徵欄位的排列方式改變時要遞增 (既有的分塊不能再追加)
+FORMAT_VERSION = 1
+
+DEFAULT_PART_ROWS = 20000
+DEFAULT_IMPORT_BINS = 1024
+DEFAULT_MALICIOUS_MIN = 5
+DEFAULT_SPLITS = {"train": 0.8, "val": 0.1, "test": 0.1}
+
+# 標籤：沒有 VT 結果或 0 偵測視為良性；偵測數介於中間的是灰色樣本，訓練時通常排除
+BENIGN = 0
+MALICIOUS = 1
+GREY = -1
+
+# 標籤 / 來源表 (每個分塊一個 CSV，列的順序與矩陣相同)
+LABEL_COLUMNS = [
+    "row", "sha256", "label", "vt_positives", "split",
+    "source", "origin_url", "member_path", "signed", "category", "size",
+]
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("DATASET_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+def feature_columns(import_bins):
+    """
+    固定寬度的特徵向量：header / section 數值欄位、位元組直方圖 (256)、import hashing (import_bins)。
+    """
+    return (list(NUMERIC_COLUMNS)
+            + [f"byte_{value:02x}" for value in range(256)]
+            + [f"import_{index}" for index in range(import_bins)])
+
+
+def import_tokens(pe):
+    """
+    import 的 DLL 名稱與 "dll:函式" (以序號匯入時為 "dll:#序號")，一律小寫。
+    """
+    for entry in getattr(pe, "DIRECTORY_ENTRY_IMPORT", []):
+        dll = (entry.dll or b"").lower()
+        yield dll
+        for imp in entry.imports:
+            name = imp.name if imp.name else b"#%d" % (imp.ordinal or 0)
+            yield dll + b":" + name.lower()
+
+
+def vectorize(item, import_bins):
+    """
+    在行程池中執行：讀取一個樣本 (檔案路徑或分片中的 Member) 並算出特徵向量 (float32)。
+    回傳 (sha256, 向量, 檔案大小)；無法解析時回傳 None。
+    """
+    import numpy as np
+
+    sha256, sample = item
+    try:
+        data = read_member(sample) if isinstance(sample, Member) else Path(sample).read_bytes()
+        pe = pefile.PE(data=data, fast_load=True)
+    except Exception:
+        return None
+
+    try:
+        row = pe_features(pe, sha256, len(data))
+        numeric = len(NUMERIC_COLUMNS)
+        vector = np.zeros(numeric + 256 + import_bins, dtype=np.float32)
+        vector[:numeric] = [row[column] for column in NUMERIC_COLUMNS]
+        histogram = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+        vector[numeric:numeric + 256] = histogram / max(len(data), 1)
+        # zlib.crc32 在每個行程 / 每次執行都一樣 (內建 hash() 有隨機種子)
+        offset = numeric + 256
+        for token in import_tokens(pe):
+            vector[offset + zlib.crc32(token) % import_bins] += 1
+        return sha256, vector, len(data)
+    except Exception:
+        return None
+    finally:
+        close_pe(pe)
+
+
+def vt_positives(record):
+    """
+    支援 VT v2 (positives) 與 v3 (last_analysis_stats.malicious，可能包在 data.attributes 裡) 的格式。
+    """
+    data = record.get("data") if isinstance(record.get("data"), dict) else {}
+    for source in (record, record.get("attributes"), data.get("attributes")):
+        if not isinstance(source, dict):
+            continue
+        if source.get("positives") is not None:
+            return int(source["positives"])
+        stats = source.get("last_analysis_stats")
+        if isinstance(stats, dict):
+            return int(stats.get("malicious", 0))
+    return None
+
+
+def load_vt_results(path):
+    """
+    讀取 vt_result.jsonl：{sha256: 偵測數}。檔案不存在時回傳空 dict，格式不對的行略過。
+    """
+    results = {}
+    if not Path(path).exists():
+        return results
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                data = record.get("data") if isinstance(record.get("data"), dict) else {}
+                sha256 = (record.get("sha256") or data.get("id") or record.get("id") or "").lower()
+                positives = vt_positives(record)
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if sha256 and positives is not None:
+                results[sha256] = positives
+    return results
+
+
+def label_of(positives, malicious_min):
+    if not positives:
+        return BENIGN
+    return MALICIOUS if positives >= malicious_min else GREY
+
+
+def split_of(sha256, splits):
+    """
+    由 SHA256 決定 train / val / test：同一個樣本不論何時匯出都落在同一個 split。
+    """
+    point = int(sha256[:16], 16) / float(1 << 64)
+    cumulative = 0.0
+    for name, ratio in splits:
+        cumulative += ratio
+        if point < cumulative:
+            return name
+    return splits[-1][0]
+
+
+def load_provenance(db):
+    """
+    {sha256: 來源資訊}；同一內容有多個來源時取最早收下的那一筆。
+    """
+    db.ensure_schema(MANIFEST_SCHEMA)
+    db.ensure_schema(FINGERPRINT_SCHEMA)
+    provenance = {}
+    for sha256, source, origin_url, signed in db.query(
+            "SELECT sha256, source, origin_url, signed FROM files "
+            "WHERE scan_result = 'clean' ORDER BY added_at DESC"):
+        provenance[sha256] = {"source": source or "", "origin_url": origin_url or "", "member_path": "",
+                              "signed": "" if signed is None else int(signed), "category": ""}
+    empty = {"source": "", "origin_url": "", "member_path": "", "signed": "", "category": ""}
+    for sha256, source, origin_url, member_path in db.query(
+            "SELECT sha256, source, origin_url, member_path FROM manifest ORDER BY added_at DESC"):
+        provenance.setdefault(sha256, dict(empty)).update(
+            source=source, origin_url=origin_url, member_path=member_path)
+    for sha256, category in db.query("SELECT sha256, category FROM fingerprints"):
+        if sha256 in provenance:
+            provenance[sha256]["category"] = category
+    return provenance
+
+
+def part_paths(dataset_dir):
+    return sorted(Path(dataset_dir).glob(f"{PART_PREFIX}*.csv"))
+
+
+def read_parts(dataset_dir):
+    """
+    已完成的分塊：[(名稱, 列數)] 與已匯出的 sha256 集合 (CSV 是判斷「已完成」的依據)。
+    """
+    parts = []
+    done = set()
+    for path in part_paths(dataset_dir):
+        rows = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                done.add(row["sha256"])
+                rows += 1
+        parts.append((path.stem, rows))
+    return parts, done
+
+
+def write_part(dataset_dir, name, vectors, labels, split_names):
+    """
+    寫入一個分塊：<name>.X.npy (float32 特徵矩陣)、<name>.y.npy (int8 標籤)、
+    <name>.split.npy (uint8，split_names 的索引) 與 <name>.csv (標籤 / 來源表)。
+    每個檔案先寫暫存檔再改名，CSV 最後才改名，中斷時不會留下寫到一半的分塊。
+    """
+    import numpy as np
+
+    base = Path(dataset_dir) / name
+    arrays = {
+        "X": np.stack(vectors).astype(np.float32, copy=False),
+        "y": np.array([row["label"] for row in labels], dtype=np.int8),
+        "split": np.array([split_names.index(row["split"]) for row in labels], dtype=np.uint8),
+    }
+    for suffix, array in arrays.items():
+        path = base.with_name(f"{name}.{suffix}.npy")
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    tmp_csv = base.with_name(f"{name}.csv.tmp")
+    with open(tmp_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=LABEL_COLUMNS)
+        writer.writeheader()
+        writer.writerows(labels)
+    os.replace(tmp_csv, base.with_name(f"{name}.csv"))
+
+
+def write_manifest(dataset_dir, layout, parts):
+    """
+    dataset.json：欄位名稱、split 設定與各分塊的列數，訓練端依此以 mmap 開啟所有分塊。
+    """
+    manifest = dict(layout, parts=[{"name": name, "rows": rows} for name, rows in parts],
+                    rows=sum(rows for _, rows in parts), updated_at=time.time())
+    path = Path(dataset_dir) / MANIFEST_NAME
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def open_parts(dataset_dir=DATASET_DIR):
+    """
+    訓練端使用：依序回傳每個分塊的 (名稱, X, y, split)，X 以 mmap 開啟，不會整個讀進記憶體。
+    """
+    import numpy as np
+
+    with open(Path(dataset_dir) / MANIFEST_NAME, encoding="utf-8") as f:
+        manifest = json.load(f)
+    for part in manifest["parts"]:
+        base = Path(dataset_dir) / part["name"]
+        yield (part["name"],
+               np.load(base.with_name(f"{part['name']}.X.npy"), mmap_mode="r"),
+               np.load(base.with_name(f"{part['name']}.y.npy")),
+               np.load(base.with_name(f"{part['name']}.split.npy")))
+
+
+def clear_dataset(dataset_dir):
+    for path in Path(dataset_dir).glob(f"{PART_PREFIX}*"):
+        os.remove(path)
+    manifest = Path(dataset_dir) / MANIFEST_NAME
+    if manifest.exists():
+        os.remove(manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the collected samples as a training-ready dataset.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="discard the existing parts and export every sample again")
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print(" [!] numpy is not installed, the dataset export needs it (pip install numpy).")
+        return
+
+    settings = load_settings()
+    dataset_dir = Path(settings.get("DIR") or DATASET_DIR)
+    vt_path = Path(settings.get("VT_RESULTS") or VT_RESULTS)
+    part_rows = settings.get("PART_ROWS", DEFAULT_PART_ROWS)
+    import_bins = settings.get("IMPORT_BINS", DEFAULT_IMPORT_BINS)
+    malicious_min = settings.get("MALICIOUS_MIN", DEFAULT_MALICIOUS_MIN)
+    splits = list((settings.get("SPLITS") or DEFAULT_SPLITS).items())
+    processes = settings.get("PROCESS_WORKERS") or os.cpu_count() or 2
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+
+    print("=== Dataset Export Starting ===")
+    layout = {
+        "format_version": FORMAT_VERSION,
+        "dtype": "float32",
+        "columns": feature_columns(import_bins),
+        "splits": dict(splits),
+        "labels": {"benign": BENIGN, "malicious": MALICIOUS, "grey": GREY},
+        "malicious_min": malicious_min,
+    }
+    manifest_path = dataset_dir / MANIFEST_NAME
+    if args.rebuild:
+        clear_dataset(dataset_dir)
+    elif manifest_path.exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            existing = json.load(f)
+        changed = [key for key in layout if existing.get(key) != layout[key]]
+        if changed:
+            print(f" [!] Dataset layout changed ({', '.join(changed)}); re-export everything with --rebuild.")
+            return
+
+    from state_db import get_db
+    db = get_db()
+    parts, done = read_parts(dataset_dir)
+    # 依 SHA256 排序，重新匯出時每一列的位置都一樣
+    pending = sorted(((sha256, sample) for sha256, sample in iter_store_samples(db) if sha256 not in done),
+                     key=lambda item: item[0])
+    print(f"[*] {len(done)} samples already exported, {len(pending)} to go ({processes} processes).")
+    if not pending:
+        write_manifest(dataset_dir, layout, parts)
+        return
+
+    vt_results = load_vt_results(vt_path)
+    provenance = load_provenance(db)
+    print(f"[*] {len(vt_results)} VirusTotal results loaded from {vt_path}.")
+
+    split_names = [name for name, _ in splits]
+    index = int(parts[-1][0][len(PART_PREFIX):]) + 1 if parts else 1
+    vectors, labels = [], []
+    exported = failed = 0
+
+    def flush():
+        nonlocal index, exported, vectors, labels
+        name = f"{PART_PREFIX}{index:05d}"
+        write_part(dataset_dir, name, vectors, labels, split_names)
+        parts.append((name, len(labels)))
+        write_manifest(dataset_dir, layout, parts)
+        exported += len(labels)
+        print(f"  [PART] {name}: {len(labels)} rows ({exported}/{len(pending)})")
+        index += 1
+        vectors, labels = [], []
+
+    empty = {"source": "", "origin_url": "", "member_path": "", "signed": "", "category": ""}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for result in executor.map(partial(vectorize, import_bins=import_bins), pending, chunksize=8):
+            if result is None:
+                failed += 1
+                continue
+            sha256, vector, size = result
+            positives = vt_results.get(sha256)
+            vectors.append(vector)
+            labels.append(dict(provenance.get(sha256, empty),
+                               row=len(labels), sha256=sha256,
+                               label=label_of(positives, malicious_min),
+                               vt_positives="" if positives is None else positives,
+                               split=split_of(sha256, splits),
+                               size=size))
+            if len(labels) >= part_rows:
+                flush()
+    if labels:
+        flush()
+
+    print("\n=== Dataset Export Complete ===")
+    print(f"Exported:       {exported}")
+    print(f"Unparseable:    {failed}")
+    print(f"Total rows:     {sum(rows for _, rows in parts)} in {len(parts)} parts ({dataset_dir})")
+
+
+if __name__ == "__main__":
+    main()
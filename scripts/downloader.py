@@ -0,0 +1,158 @@
+import os
+import tempfile
+import time
+
+import yaml
+
+from pe_sniff import SNIFF_SIZE
+
+# 預設值：小於 16MB 的下載留在記憶體，其餘寫入暫存檔
+DEFAULT_SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+PE_EXTENSIONS = [".exe", ".dll", ".sys"]
+
+_settings = None
+
+
+def get_download_settings():
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r") as f:
+                _settings = (yaml.safe_load(f) or {}).get("DOWNLOAD_SETTINGS", {})
+        except Exception:
+            _settings = {}
+    return _settings
+
+
+def get_spool_max_memory():
+    settings = get_download_settings()
+    return int(settings.get("SPOOL_MAX_MEMORY_MB", DEFAULT_SPOOL_MAX_MEMORY // (1024 * 1024))) * 1024 * 1024
+
+
+class Spool(tempfile.SpooledTemporaryFile):
+    """
+    Python 3.10 的 SpooledTemporaryFile 沒有 readable()/seekable()/writable() (3.11 才補上)，
+    zipfile.ZipFile 讀取成員時會因此丟出 AttributeError；這裡轉給底層檔案物件。
+    """
+
+    def readable(self):
+        return self._file.readable()
+
+    def seekable(self):
+        return self._file.seekable()
+
+    def writable(self):
+        return self._file.writable()
+
+
+def open_spool():
+    """
+    建立一個下載暫存區：小檔留在記憶體，超過 SPOOL_MAX_MEMORY_MB 後自動轉存到磁碟暫存檔。
+    """
+    spool_dir = get_download_settings().get("SPOOL_DIR") or None
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+    return Spool(max_size=get_spool_max_memory(), dir=spool_dir)
+
+
+def get_chunk_size():
+    return int(get_download_settings().get("CHUNK_SIZE_KB", DEFAULT_CHUNK_SIZE // 1024)) * 1024
+
+
+def spool_response(response):
+    """
+    以固定大小的區塊讀取 HTTP 回應 (需以 stream=True 發出請求)，寫入暫存區。
+    回傳已經 seek 回開頭的暫存區，記憶體用量不會隨檔案大小增加。
+    """
+    spool = open_spool()
+    try:
+        for chunk in response.iter_content(chunk_size=get_chunk_size()):
+            if chunk:
+                spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    finally:
+        response.close()
+    spool.seek(0)
+    return spool
+
+
+def save_response(response, dest_path):
+    """
+    將 HTTP 回應以區塊方式直接寫入目的檔案，回傳寫入的位元組數。
+    """
+    written = 0
+    try:
+        with open(dest_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=get_chunk_size()):
+                if chunk:
+                    f.write(chunk)
+                    written += len(chunk)
+    finally:
+        response.close()
+    return written
+
+
+def iter_response(response, first_chunk=SNIFF_SIZE):
+    """
+    逐塊讀取 HTTP 回應。第一塊只讀 first_chunk 位元組，
+    檔頭檢查不通過時呼叫端可以立即關閉連線，不必先收下 1MB 的區塊。
+    """
+    head = response.raw.read(first_chunk, decode_content=True)
+    if head:
+        yield head
+    yield from response.iter_content(chunk_size=get_chunk_size())
+
+
+def iter_fileobj(fileobj, first_chunk=SNIFF_SIZE):
+    """
+    逐塊讀取檔案物件 (例如 zip 成員)，第一塊只讀 first_chunk 位元組。
+    """
+    head = fileobj.read(first_chunk)
+    if head:
+        yield head
+    chunk_size = get_chunk_size()
+    yield from iter(lambda: fileobj.read(chunk_size), b"")
+
+
+def iter_zip_members(entries, extensions=PE_EXTENSIONS):
+    """
+    從 zip 成員清單 (ZipInfo 或 RemoteZipEntry) 挑出副檔名符合的檔案，
+    排除資料夾與 macOS 系統垃圾檔案。
+    """
+    for file_info in entries:
+        if file_info.is_dir():
+            continue
+        if "__MACOSX" in file_info.filename or os.path.basename(file_info.filename).startswith("._"):
+            continue
+        if any(file_info.filename.lower().endswith(ext) for ext in extensions):
+            yield file_info
+
+
+
+def get_max_chunk_size():
+    return int(get_download_settings().get("MAX_CHUNK_SIZE_KB", 8192)) * 1024
+
+
+def iter_adaptive(response, chunk_size=None, max_chunk_size=None):
+    """
+    依實際讀取速度調整區塊大小：讀得快就加倍 (最多 max_chunk_size)，
+    單一區塊讀太久就減半，慢速鏡像站不會因為一個大區塊卡住太久。
+    """
+    min_size = chunk_size or get_chunk_size()
+    max_size = max(min_size, max_chunk_size or get_max_chunk_size())
+    size = min_size
+    while True:
+        started = time.monotonic()
+        data = response.raw.read(size, decode_content=True)
+        if not data:
+            return
+        yield data
+        elapsed = time.monotonic() - started
+        if elapsed < 0.25 and size < max_size:
+            size = min(size * 2, max_size)
+        elif elapsed > 2.0 and size > min_size:
+            size = max(size // 2, min_size)
@@ -0,0 +1,308 @@
+import csv
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pefile
+import yaml
+
+from sample_store import STORE_ROOT, INCOMING_DIR
+from shard_store import Member, load_pe
+from utils import close_pe
+
+FEATURE_DIR = Path("benign_pe/metadata/file_info")
+CHUNK_PREFIX = "file_info-"
+DEFAULT_CHUNK_ROWS = 5000
+
+# 只解析需要的 data directory (fast_load 之後再個別載入)
+PARSED_DIRECTORIES = [
+    pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_IMPORT"],
+    pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_EXPORT"],
+    pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_RESOURCE"],
+    pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_COM_DESCRIPTOR"],
+]
+
+# 數值欄位 (同時寫入 CSV 與 NumPy 矩陣)
+NUMERIC_COLUMNS = [
+    "size", "machine", "timestamp", "characteristics", "is_dll", "magic",
+    "subsystem", "dll_characteristics", "linker_major", "linker_minor",
+    "os_major", "os_minor", "image_base", "entry_point", "size_of_code",
+    "size_of_image", "size_of_headers", "checksum",
+    "num_sections", "entropy_mean", "entropy_min", "entropy_max", "num_exec_sections",
+    "num_import_dlls", "num_imports", "num_exports",
+    "has_clr", "has_rich", "num_rich_entries", "num_resources", "has_version_info",
+    "overlay_size", "has_signature",
+]
+
+# 文字欄位 (只寫入 CSV)
+TEXT_COLUMNS = [
+    "sha256", "imphash", "rich_hash", "clr_runtime", "section_names",
+    "resource_languages", "company_name", "product_name", "file_description",
+    "original_filename", "file_version",
+]
+
+COLUMNS = TEXT_COLUMNS[:1] + NUMERIC_COLUMNS + TEXT_COLUMNS[1:]
+
+VERSION_FIELDS = {
+    b"CompanyName": "company_name",
+    b"ProductName": "product_name",
+    b"FileDescription": "file_description",
+    b"OriginalFilename": "original_filename",
+    b"FileVersion": "file_version",
+}
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("FEATURE_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+def _version_info(pe, row):
+    for file_info in getattr(pe, "FileInfo", None) or []:
+        for entry in file_info:
+            for table in getattr(entry, "StringTable", []):
+                for key, value in table.entries.items():
+                    column = VERSION_FIELDS.get(key)
+                    if column and not row[column]:
+                        row[column] = value.decode("utf-8", "replace").strip()
+                        row["has_version_info"] = 1
+
+
+def _resources(pe, row):
+    languages = set()
+    count = 0
+
+    def walk(directory):
+        nonlocal count
+        for entry in directory.entries:
+            if hasattr(entry, "directory"):
+                walk(entry.directory)
+            elif hasattr(entry, "data"):
+                count += 1
+                languages.add(pefile.LANG.get(entry.data.lang, str(entry.data.lang)))
+
+    if hasattr(pe, "DIRECTORY_ENTRY_RESOURCE"):
+        walk(pe.DIRECTORY_ENTRY_RESOURCE)
+    row["num_resources"] = count
+    row["resource_languages"] = ";".join(sorted(languages))
+
+
+def pe_features(pe, sha256, size):
+    """
+    由已經載入 (fast_load) 的 pefile.PE 算出一列特徵 (dict)，無法解析時丟出例外。
+    會順便解析 PARSED_DIRECTORIES (之後可以直接讀 pe.DIRECTORY_ENTRY_IMPORT 等屬性)。
+    """
+    row = dict.fromkeys(TEXT_COLUMNS, "")
+    row.update(dict.fromkeys(NUMERIC_COLUMNS, 0))
+    row["sha256"], row["size"] = sha256, size
+
+    fh, oh = pe.FILE_HEADER, pe.OPTIONAL_HEADER
+    row.update(
+        machine=fh.Machine,
+        timestamp=fh.TimeDateStamp,
+        characteristics=fh.Characteristics,
+        is_dll=int(pe.is_dll()),
+        magic=oh.Magic,
+        subsystem=oh.Subsystem,
+        dll_characteristics=oh.DllCharacteristics,
+        linker_major=oh.MajorLinkerVersion,
+        linker_minor=oh.MinorLinkerVersion,
+        os_major=oh.MajorOperatingSystemVersion,
+        os_minor=oh.MinorOperatingSystemVersion,
+        image_base=oh.ImageBase,
+        entry_point=oh.AddressOfEntryPoint,
+        size_of_code=oh.SizeOfCode,
+        size_of_image=oh.SizeOfImage,
+        size_of_headers=oh.SizeOfHeaders,
+        checksum=oh.CheckSum,
+    )
+
+    # Section
+    entropies = [section.get_entropy() for section in pe.sections]
+    row["num_sections"] = len(pe.sections)
+    if entropies:
+        row["entropy_mean"] = round(sum(entropies) / len(entropies), 4)
+        row["entropy_min"] = round(min(entropies), 4)
+        row["entropy_max"] = round(max(entropies), 4)
+    row["num_exec_sections"] = sum(
+        1 for section in pe.sections
+        if section.Characteristics & pefile.SECTION_CHARACTERISTICS["IMAGE_SCN_MEM_EXECUTE"])
+    row["section_names"] = ";".join(
+        section.Name.rstrip(b"\x00").decode("latin-1") for section in pe.sections)
+
+    # Rich header (不需要解析 data directory)
+    rich = pe.parse_rich_header()
+    if rich:
+        row["has_rich"] = 1
+        row["num_rich_entries"] = len(rich["values"]) // 2
+        row["rich_hash"] = hashlib.md5(rich["clear_data"]).hexdigest()
+
+    security = oh.DATA_DIRECTORY[pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_SECURITY"]]
+    row["has_signature"] = int(security.VirtualAddress != 0 and security.Size > 0)
+    overlay_start = pe.get_overlay_data_start_offset()
+    if overlay_start is not None:
+        row["overlay_size"] = max(0, row["size"] - overlay_start)
+
+    pe.parse_data_directories(directories=PARSED_DIRECTORIES)
+
+    # Import / Export
+    imports = getattr(pe, "DIRECTORY_ENTRY_IMPORT", [])
+    row["num_import_dlls"] = len(imports)
+    row["num_imports"] = sum(len(entry.imports) for entry in imports)
+    row["imphash"] = pe.get_imphash() if imports else ""
+    if hasattr(pe, "DIRECTORY_ENTRY_EXPORT"):
+        row["num_exports"] = len(pe.DIRECTORY_ENTRY_EXPORT.symbols)
+
+    # .NET CLR header
+    if hasattr(pe, "DIRECTORY_ENTRY_COM_DESCRIPTOR"):
+        clr = pe.DIRECTORY_ENTRY_COM_DESCRIPTOR.struct
+        row["has_clr"] = 1
+        row["clr_runtime"] = f"{clr.MajorRuntimeVersion}.{clr.MinorRuntimeVersion}"
+
+    _resources(pe, row)
+    _version_info(pe, row)
+    return row
+
+
+def extract_features(sample):
+    """
+    在行程池中執行：以 pefile (fast_load) 讀取一個樣本 (檔案路徑或分片中的 Member)，
+    回傳一列特徵 (dict)；無法解析時回傳 None。樣本庫的檔名就是 SHA256，不需要重新計算。
+    """
+    try:
+        pe = load_pe(sample)
+    except Exception:
+        return None
+
+    try:
+        if isinstance(sample, Member):
+            return pe_features(pe, sample.sha256, sample.size)
+        return pe_features(pe, os.path.basename(sample), os.path.getsize(sample))
+    except Exception:
+        return None
+    finally:
+        close_pe(pe)
+
+
+def chunk_paths(feature_dir=FEATURE_DIR):
+    return sorted(Path(feature_dir).glob(f"{CHUNK_PREFIX}*.csv"))
+
+
+def load_extracted(feature_dir=FEATURE_DIR):
+    """
+    讀取已完成的 chunk 裡的 sha256 欄位，中斷後重跑時只處理還沒萃取的檔案。
+    """
+    done = set()
+    for path in chunk_paths(feature_dir):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                done.add(row["sha256"])
+    return done
+
+
+def iter_store_objects(root=STORE_ROOT):
+    for dirpath, dirnames, filenames in os.walk(root):
+        if INCOMING_DIR in dirnames:
+            dirnames.remove(INCOMING_DIR)
+        for name in filenames:
+            yield Path(dirpath) / name
+
+
+def iter_store_samples(db=None):
+    """
+    樣本庫中的所有樣本：(sha256, 樣本)，樣本是 objects/ 的檔案路徑或分片中的 Member。
+    同時存在兩邊的樣本只回傳散檔。
+    """
+    seen = set()
+    for path in iter_store_objects():
+        seen.add(path.name)
+        yield path.name, str(path)
+    if db is None:
+        from state_db import get_db
+        db = get_db()
+    from shard_store import get_shards
+    for member in get_shards(db).members():
+        if member.sha256 not in seen:
+            yield member.sha256, member
+
+
+def write_chunk(rows, feature_dir, index, write_numpy):
+    """
+    寫入一個 chunk：CSV 含所有欄位；write_numpy 時另存數值欄位的 .npz (X 矩陣 + sha256)。
+    先寫到暫存檔再改名，中斷時不會留下寫到一半的 chunk。
+    """
+    base = Path(feature_dir) / f"{CHUNK_PREFIX}{index:05d}"
+    tmp_csv = base.with_suffix(".csv.tmp")
+    with open(tmp_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    if write_numpy:
+        try:
+            import numpy as np
+        except ImportError:
+            print(" [!] numpy is not installed, skipping the binary chunk.")
+        else:
+            tmp_npz = base.with_suffix(".tmp.npz")
+            np.savez(tmp_npz,
+                     X=np.array([[row[c] for c in NUMERIC_COLUMNS] for row in rows], dtype=np.float64),
+                     sha256=np.array([row["sha256"] for row in rows]),
+                     columns=np.array(NUMERIC_COLUMNS))
+            os.replace(tmp_npz, base.with_suffix(".npz"))
+
+    # CSV 最後才改名：它是判斷「已完成」的依據
+    os.replace(tmp_csv, base.with_suffix(".csv"))
+
+
+def main():
+    settings = load_settings()
+    feature_dir = Path(settings.get("DIR") or FEATURE_DIR)
+    chunk_rows = settings.get("CHUNK_ROWS", DEFAULT_CHUNK_ROWS)
+    write_numpy = settings.get("NUMPY", True)
+    processes = settings.get("PROCESS_WORKERS") or os.cpu_count() or 2
+
+    if not STORE_ROOT.exists():
+        print(f"Sample store '{STORE_ROOT}' does not exist.")
+        return
+    feature_dir.mkdir(parents=True, exist_ok=True)
+
+    print("=== PE Feature Extraction Starting ===")
+    done = load_extracted(feature_dir)
+    pending = [sample for sha256, sample in iter_store_samples() if sha256 not in done]
+    print(f"[*] {len(done)} samples already extracted, {len(pending)} to go ({processes} processes).")
+    if not pending:
+        return
+
+    existing = chunk_paths(feature_dir)
+    index = int(existing[-1].stem[len(CHUNK_PREFIX):]) + 1 if existing else 1
+    rows = []
+    extracted = failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for row in executor.map(extract_features, pending, chunksize=32):
+            if row is None:
+                failed += 1
+                continue
+            rows.append(row)
+            if len(rows) >= chunk_rows:
+                write_chunk(rows, feature_dir, index, write_numpy)
+                extracted += len(rows)
+                print(f"  [CHUNK] {CHUNK_PREFIX}{index:05d}: {len(rows)} rows ({extracted}/{len(pending)})")
+                index += 1
+                rows = []
+    if rows:
+        write_chunk(rows, feature_dir, index, write_numpy)
+        extracted += len(rows)
+        print(f"  [CHUNK] {CHUNK_PREFIX}{index:05d}: {len(rows)} rows ({extracted}/{len(pending)})")
+
+    print("\n=== Feature Extraction Complete ===")
+    print(f"Extracted:      {extracted}")
+    print(f"Unparseable:    {failed}")
+
+
+if __name__ == "__main__":
+    main()
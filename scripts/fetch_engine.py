@@ -0,0 +1,215 @@
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+from metrics import get_metrics
+from rate_limit import RateLimitPacer
+
+DEFAULT_WORKERS = 2
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 2
+
+USER_AGENT = "benign-pe-collector/1.0"
+
+
+class TokenBucket:
+    """
+    簡單的 token bucket：平均每秒 rate 個請求，最多累積 capacity 個。
+    rate <= 0 表示不限速率 (例如設定 RATE_PER_SEC: 0)。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostPool:
+    """
+    單一主機的共用資源：一個保持連線的 Session、固定數量的工作執行緒、一個速率限制器。
+    """
+
+    def __init__(self, host, workers, rate, burst):
+        self.host = host
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 4))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=host)
+        self.bucket = TokenBucket(rate, burst)
+        # 管線的下載階段在讀取內容期間佔用一個名額，讓同一主機的並行下載數不超過 workers
+        self.slots = threading.BoundedSemaphore(workers)
+
+
+class FetchEngine:
+    """
+    所有爬蟲共用的下載引擎。依主機分開連線池、並行數與速率，
+    API 查詢透過 get() 發出，下載工作透過 submit() 丟進對應主機的工作佇列。
+    """
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        default = settings.get("DEFAULT", {})
+        self.default_workers = default.get("WORKERS", DEFAULT_WORKERS)
+        self.default_rate = default.get("RATE_PER_SEC", DEFAULT_RATE)
+        self.default_burst = default.get("BURST", DEFAULT_BURST)
+        self.host_settings = settings.get("HOSTS", {}) or {}
+        self.pacer = RateLimitPacer(settings.get("RATE_LIMITS", {}))
+        # 網址前綴改寫 (例如 benchmark 把各來源指到本機的 fixture server)；主機設定與 API 額度仍依原本的網址
+        self.overrides = settings.get("URL_OVERRIDES", {}) or {}
+        self.cache = None
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _host_key(self, host):
+        # 完全相符優先，其次是子網域 (例如 downloads.sourceforge.net -> sourceforge.net)
+        if host in self.host_settings:
+            return host
+        for key in self.host_settings:
+            if host.endswith("." + key):
+                return key
+        return host
+
+    def pool_for(self, url):
+        key = self._host_key(urlparse(url).hostname or "")
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                conf = self.host_settings.get(key, {}) or {}
+                pool = HostPool(
+                    key,
+                    conf.get("WORKERS", self.default_workers),
+                    conf.get("RATE_PER_SEC", self.default_rate),
+                    conf.get("BURST", self.default_burst),
+                )
+                self._pools[key] = pool
+            return pool
+
+    def resolve(self, url):
+        for prefix, target in self.overrides.items():
+            if url.startswith(prefix):
+                return target + url[len(prefix):]
+        return url
+
+    def request(self, method, url, **kwargs):
+        """
+        經過該主機的速率限制與 API 額度分配後，以共用 Session 發出請求 (會重複使用 TCP/TLS 連線)。
+        429 / 5xx 會退避後重試；額度要等超過 MAX_WAIT 秒才重置時丟出 RateLimited。
+        """
+        pool = self.pool_for(url)
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            pool.bucket.acquire()
+            family = self.pacer.acquire(url)
+            started = time.monotonic()
+            try:
+                res = pool.session.request(method, self.resolve(url), **kwargs)
+            except requests.RequestException:
+                metrics.inc("http_requests_total", host=pool.host, status="error")
+                raise
+            metrics.observe("http_request_seconds", time.monotonic() - started, host=pool.host)
+            metrics.inc("http_requests_total", host=pool.host, status=res.status_code)
+            if kwargs.get("stream"):
+                metrics.count_reads(res, host=pool.host)
+            elif method != "HEAD":
+                metrics.inc("download_bytes_total", len(res.content), host=pool.host)
+            if family is not None:
+                family.update(res)
+            wait = self.pacer.retry_delay(res, attempt)
+            if wait is None:
+                return res
+            res.close()
+            metrics.inc("http_retries_total", host=pool.host, status=res.status_code)
+            attempt += 1
+            print(f"   [BACKOFF] HTTP {res.status_code} from {pool.host}, retry {attempt} in {wait:.1f}s")
+            time.sleep(wait)
+
+    def get(self, url, use_cache=False, **kwargs):
+        """
+        use_cache=True 時經過 HTTP 條件式快取 (適用於 API 與 HTML 頁面，不適用於大檔下載)。
+        """
+        if use_cache and self.cache is not None:
+            return self.cache.get(self.request, url, **kwargs)
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def submit(self, url, fn, *args, **kwargs):
+        """
+        把一個下載工作交給 url 所屬主機的工作執行緒，回傳 Future。
+        """
+        return self.pool_for(url).executor.submit(fn, *args, **kwargs)
+
+    @contextmanager
+    def slot(self, url):
+        """
+        佔用 url 所屬主機的一個下載名額，直到離開 with 區塊。
+        """
+        pool = self.pool_for(url)
+        pool.slots.acquire()
+        try:
+            yield
+        finally:
+            pool.slots.release()
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.executor.shutdown(wait=True)
+                pool.session.close()
+            self._pools.clear()
+
+
+_default_engine = None
+_default_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    依照 config.yaml 的 FETCH_SETTINGS / HTTP_CACHE 建立這個行程共用的 FetchEngine。
+    """
+    global _default_engine
+    with _default_lock:
+        if _default_engine is None:
+            try:
+                with open("config.yaml", "r") as f:
+                    config = yaml.safe_load(f) or {}
+            except Exception:
+                config = {}
+            _default_engine = FetchEngine(config.get("FETCH_SETTINGS", {}))
+
+            cache_conf = config.get("HTTP_CACHE", {})
+            if cache_conf.get("ENABLED", True):
+                from http_cache import HttpCache, CACHE_DIR
+                from state_db import get_db
+                _default_engine.cache = HttpCache(
+                    get_db(),
+                    cache_conf.get("DIR") or CACHE_DIR,
+                    int(cache_conf.get("MAX_SIZE_MB", 256)) * 1024 * 1024,
+                )
+        return _default_engine
@@ -0,0 +1,214 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pefile
+import yaml
+
+from shard_store import load_pe
+from utils import close_pe
+
+# 分類 (依判斷順序：加殼/打包工具優先於編譯器)
+UPX = "upx"
+PYINSTALLER = "pyinstaller"
+DOTNET = "dotnet"
+GO = "go"
+RUST = "rust"
+DELPHI = "delphi"
+MSVC = "msvc"
+OTHER = "other"
+
+CATEGORIES = [UPX, PYINSTALLER, DOTNET, GO, RUST, DELPHI, MSVC, OTHER]
+
+GO_BUILDINFO_MAGIC = b"\xff Go buildinf:"
+PYINSTALLER_COOKIE = b"MEI\x0c\x0b\x0a\x0b\x0e"
+RUST_MARKERS = (b"/rustc/", b"RUST_BACKTRACE", b"rust_panic")
+DELPHI_MARKERS = (b"Embarcadero", b"SOFTWARE\\Borland\\Delphi", b"Borland\\Delphi\\RTL")
+DELPHI_SECTIONS = {"CODE", "DATA", "BSS", ".itext"}
+UPX_SECTIONS = {"UPX0", "UPX1", "UPX2", ".UPX0", ".UPX1"}
+
+# GitHub 搜尋結果的 language 欄位對應到預期的分類 (下載前用來排優先順序)
+LANGUAGE_CATEGORIES = {
+    "c#": DOTNET,
+    "f#": DOTNET,
+    "visual basic .net": DOTNET,
+    "go": GO,
+    "rust": RUST,
+    "pascal": DELPHI,
+    "delphi": DELPHI,
+    "python": PYINSTALLER,
+    "c++": MSVC,
+    "c": MSVC,
+}
+
+FINGERPRINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    sha256 TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    tags TEXT,
+    indexed_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fingerprints_category ON fingerprints(category);
+"""
+
+DEFAULT_MIN_SAMPLES = 500
+
+
+def fingerprint_pe(pe):
+    """
+    以便宜的訊號判斷 PE 的編譯器 / 語言 / 打包工具：
+    Section 名稱、CLR header、Rich header 以及少數固定字串 (Go buildinfo、Rust panic、PyInstaller cookie)。
+    回傳 (category, tags)，tags 是所有命中的分類。
+    """
+    data = pe.__data__
+    names = {section.Name.rstrip(b"\x00").decode("latin-1") for section in pe.sections}
+    tags = []
+
+    if names & UPX_SECTIONS:
+        tags.append(UPX)
+
+    overlay = pe.get_overlay_data_start_offset()
+    if overlay is not None and data.rfind(PYINSTALLER_COOKIE, overlay) != -1:
+        tags.append(PYINSTALLER)
+
+    clr = pe.OPTIONAL_HEADER.DATA_DIRECTORY[pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_COM_DESCRIPTOR"]]
+    if clr.VirtualAddress and clr.Size:
+        tags.append(DOTNET)
+
+    if data.find(GO_BUILDINFO_MAGIC) != -1 or (".symtab" in names and data.find(b"Go build ID:") != -1):
+        tags.append(GO)
+
+    if any(data.find(marker) != -1 for marker in RUST_MARKERS):
+        tags.append(RUST)
+
+    if len(names & DELPHI_SECTIONS) >= 2 or any(data.find(marker) != -1 for marker in DELPHI_MARKERS):
+        tags.append(DELPHI)
+
+    if pe.parse_rich_header():
+        tags.append(MSVC)
+
+    category = next((c for c in CATEGORIES if c in tags), OTHER)
+    return category, tags
+
+
+def fingerprint_file(sample):
+    """
+    在行程池中執行 (sample 是檔案路徑或分片中的 Member)：回傳 (category, tags)；無法解析的檔案回傳 None。
+    """
+    try:
+        pe = load_pe(sample)
+    except Exception:
+        return None
+    try:
+        return fingerprint_pe(pe)
+    except Exception:
+        return None
+    finally:
+        close_pe(pe)
+
+
+def category_for_language(language):
+    if not language:
+        return None
+    return LANGUAGE_CATEGORIES.get(language.lower())
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("FINGERPRINT_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+class FingerprintIndex:
+    """
+    sha256 → 分類的索引 (存在 state DB)，提供各分類的數量與是否超過配額。
+    QUOTAS 是每個分類在整個樣本庫中的最大比例，樣本數少於 MIN_SAMPLES 時不限制。
+    """
+
+    def __init__(self, db, settings=None):
+        self.db = db
+        settings = load_settings() if settings is None else settings
+        self.quotas = settings.get("QUOTAS", {}) or {}
+        self.min_samples = settings.get("MIN_SAMPLES", DEFAULT_MIN_SAMPLES)
+        db.ensure_schema(FINGERPRINT_SCHEMA)
+
+    def record(self, sha256, category, tags):
+        self.db.execute(
+            "INSERT OR REPLACE INTO fingerprints (sha256, category, tags, indexed_at) VALUES (?, ?, ?, ?)",
+            (sha256, category, ",".join(tags), time.time()))
+
+    def remove(self, sha256):
+        self.db.execute("DELETE FROM fingerprints WHERE sha256 = ?", (sha256,))
+
+    def lookup(self, sha256):
+        rows = self.db.query("SELECT category FROM fingerprints WHERE sha256 = ?", (sha256,))
+        return rows[0][0] if rows else None
+
+    def indexed(self):
+        return {row[0] for row in self.db.query("SELECT sha256 FROM fingerprints")}
+
+    def counts(self):
+        return dict(self.db.query("SELECT category, COUNT(*) FROM fingerprints GROUP BY category"))
+
+    def over_quota(self):
+        """
+        回傳目前已經超過配額的分類集合。
+        """
+        counts = self.counts()
+        total = sum(counts.values())
+        if total < self.min_samples:
+            return set()
+        return {category for category, quota in self.quotas.items()
+                if counts.get(category, 0) / total > quota}
+
+
+_default_index = None
+
+
+def get_index(db):
+    global _default_index
+    if _default_index is None:
+        _default_index = FingerprintIndex(db)
+    return _default_index
+
+
+def main():
+    from state_db import get_db
+    from feature_extractor import iter_store_samples
+
+    db = get_db()
+    index = get_index(db)
+
+    # 補齊還沒有分類的樣本 (例如在這個功能加入之前收集的檔案)
+    done = index.indexed()
+    pending = [(sha256, sample) for sha256, sample in iter_store_samples(db) if sha256 not in done]
+    if pending:
+        print(f"[*] Fingerprinting {len(pending)} samples...")
+        samples = [sample for _, sample in pending]
+        with ProcessPoolExecutor(max_workers=os.cpu_count() or 2) as executor:
+            for (sha256, _), result in zip(pending, executor.map(fingerprint_file, samples, chunksize=32)):
+                if result is not None:
+                    index.record(sha256, *result)
+        db.commit()
+        # 補上的分類要反映到 stats manifest 的分類統計
+        from stats_manifest import get_stats
+        get_stats(db).rebuild()
+
+    counts = index.counts()
+    total = sum(counts.values())
+    over = index.over_quota()
+    print("\n=== Compiler / Language Distribution ===")
+    for category in CATEGORIES:
+        count = counts.get(category, 0)
+        share = count / total if total else 0
+        quota = index.quotas.get(category)
+        quota_text = f"quota {quota:.0%}" if quota is not None else "no quota"
+        flag = " [OVER QUOTA]" if category in over else ""
+        print(f"  {category:<12} {count:>8}  {share:6.1%}  ({quota_text}){flag}")
+    print(f"  {'total':<12} {total:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+import datetime
+import io
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+import yaml
+
+# 本機 fixture server 代替的主機；網址改寫成 http://127.0.0.1:<port>/<host>/...
+HOSTS = [
+    "api.github.com",
+    "github.com",
+    "azuresearch-usnc.nuget.org",
+    "api.nuget.org",
+    "www.nuget.org",
+    "portableapps.com",
+]
+
+GITHUB_ORG = "bench-org"
+LANGUAGES = ["C++", "C#", "Go", "Rust", "Pascal", "Python", "C"]
+# 讓指紋分類也有不同的結果 (見 fingerprint.py)
+MARKERS = [b"", b"\xff Go buildinf:", b"/rustc/0123456789abcdef/library", b"Embarcadero Delphi"]
+
+DEFAULT_SETTINGS = {
+    "GITHUB_REPOS": 40,
+    "ASSETS_PER_RELEASE": 2,
+    "ZIP_MEMBERS": 4,
+    "CHOCO_PACKAGES": 40,
+    "PORTABLE_APPS": 5,
+    "EXE_KB": 512,
+    "ZIP_MEMBER_KB": 256,
+    "PAF_MB": 20,
+    "LATENCY_MS": 0,
+    "ERROR_RATE": 0.0,
+    "RATE_LIMIT": {"LIMIT": 0, "WINDOW": 60},
+}
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            settings = (yaml.safe_load(f) or {}).get("BENCHMARK_SETTINGS", {}) or {}
+    except Exception:
+        settings = {}
+    return dict(DEFAULT_SETTINGS, **settings)
+
+
+def build_pe(seed, size, marker=b""):
+    """
+    產生一個可以通過 pe_sniff 與 pefile 的最小 PE32 (一個 .text section)，內容是以 seed 決定的亂數。
+    """
+    file_alignment, section_alignment = 0x200, 0x1000
+    headers = 0x400
+    raw = max(file_alignment, (size - headers) // file_alignment * file_alignment)
+    virtual = -(-raw // section_alignment) * section_alignment
+
+    dos = bytearray(0x80)
+    dos[0:2] = b"MZ"
+    struct.pack_into("<I", dos, 0x3C, 0x80)
+    file_header = struct.pack("<4sHHIIIHH", b"PE\0\0", 0x014C, 1, 0x5F000000 + seed, 0, 0, 0xE0, 0x0102)
+    optional = struct.pack(
+        "<HBBIIIIIIIIIHHHHHHIIIIHHIIIIII",
+        0x10B, 14, 0, raw, 0, 0, section_alignment, section_alignment, 0, 0x400000,
+        section_alignment, file_alignment, 6, 0, 0, 0, 6, 0, 0,
+        section_alignment + virtual, headers, 0, 2, 0x8140,
+        0x100000, 0x1000, 0x100000, 0x1000, 0, 16) + bytes(16 * 8)
+    section = struct.pack("<8sIIIIIIHHI", b".text", raw, section_alignment, raw, headers, 0, 0, 0, 0, 0x60000020)
+    header = (bytes(dos) + file_header + optional + section).ljust(headers, b"\0")
+
+    body = bytearray(random.Random(seed).randbytes(raw))
+    body[16:16 + len(marker)] = marker
+    return header + bytes(body)
+
+
+def build_zip(seed, members, member_size, names=None):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(members):
+            name = names[i] if names else f"bin/tool{i}.exe"
+            z.writestr(name, build_pe(seed * 100 + i, member_size, MARKERS[(seed + i) % len(MARKERS)]))
+        z.writestr("README.txt", f"fixture {seed}\n")
+    return buffer.getvalue()
+
+
+def nupkg_entries(k):
+    # 一半的套件只有 lib/ 底下的 DLL (nuget_catalog 會推測為 .NET)
+    if k % 2:
+        return [f"lib/net48/Bench.Pkg{k}.dll"]
+    return [f"tools/pkg{k}.exe", f"lib/net48/Bench.Pkg{k}.dll"]
+
+
+def iso(ts):
+    return datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class Fixtures:
+    """
+    預先產生所有合成檔案 (寫在 root 底下)，計時開始前就準備好，伺服器只負責讀檔回應。
+    """
+
+    def __init__(self, root, settings):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.settings = settings
+        self.blobs = {}
+        self.assets = {}
+        self.packages = []
+        self.apps = []
+        self.committed = time.time() - 3600
+
+    def _write(self, name, data):
+        path = self.root / name
+        if not path.exists() or path.stat().st_size != len(data):
+            path.write_bytes(data)
+        self.blobs[name] = path
+        return len(data)
+
+    def prepare(self):
+        s = self.settings
+        exe_size = s["EXE_KB"] * 1024
+        member_size = s["ZIP_MEMBER_KB"] * 1024
+        for i in range(s["GITHUB_REPOS"]):
+            repo = f"{GITHUB_ORG}/app-{i}"
+            assets = []
+            for j in range(s["ASSETS_PER_RELEASE"]):
+                seed = 10000 + i * 10 + j
+                if j % 2:
+                    name = f"app-{i}-{j}.zip"
+                    size = self._write(name, build_zip(seed, s["ZIP_MEMBERS"], member_size))
+                else:
+                    name = f"app-{i}-{j}.exe"
+                    size = self._write(name, build_pe(seed, exe_size, MARKERS[i % len(MARKERS)]))
+                assets.append({"name": name, "size": size,
+                               "browser_download_url": f"https://github.com/{repo}/releases/download/v1.0/{name}"})
+            self.assets[repo] = assets
+
+        for k in range(s["CHOCO_PACKAGES"]):
+            pkg_id = f"Bench.Pkg{k}"
+            entries = nupkg_entries(k)
+            name = f"bench.pkg{k}.1.0.0.nupkg"
+            size = self._write(name, build_zip(20000 + k, len(entries), member_size, entries))
+            self.packages.append({"id": pkg_id, "version": "1.0.0", "name": name, "size": size,
+                                  "entries": entries, "committed": self.committed + k})
+
+        for a in range(s["PORTABLE_APPS"]):
+            name = f"App{a}Portable_1.0.paf.exe"
+            self._write(name, build_pe(30000 + a, s["PAF_MB"] * 1024 * 1024))
+            self.apps.append({"slug": f"app-{a}-portable", "title": f"App {a} Portable", "file": name})
+        return self
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def server_state(self):
+        return self.server.fixture_server
+
+    # --- 回應 ---
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+            self.server_state.count(len(body))
+
+    def _send_blob(self, name, disposition=False):
+        state = self.server_state
+        path = state.fixtures.blobs.get(name)
+        if path is None:
+            return self._send(404, {"message": "Not Found"})
+        if state.inject_error():
+            return self._send(503, "Service Unavailable", "text/plain")
+
+        total = path.stat().st_size
+        start, end = 0, total - 1
+        status = 200
+        etag = f'"{name}"'
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        match = re.match(r"bytes=(\d*)-(\d*)$", range_header or "")
+        if match and (if_range is None or if_range == etag):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), total - 1) if last else total - 1
+            else:
+                start, end = max(0, total - int(last)), total - 1
+            if start > end:
+                return self._send(416, b"", "text/plain", {"Content-Range": f"bytes */{total}"})
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+        if disposition:
+            self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                state.count(len(chunk))
+                remaining -= len(chunk)
+
+    # --- 路由 ---
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_POST(self):
+        self.do_GET()
+
+    def do_GET(self):
+        state = self.server_state
+        state.requests_total += 1
+        if state.latency:
+            time.sleep(state.latency)
+        parsed = urlparse(self.path)
+        host, _, path = parsed.path.lstrip("/").partition("/")
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        handler = {
+            "api.github.com": self.github_api,
+            "github.com": self.github_download,
+            "azuresearch-usnc.nuget.org": self.nuget_search,
+            "api.nuget.org": self.nuget_api,
+            "www.nuget.org": self.nuget_v2,
+            "portableapps.com": self.portableapps,
+        }.get(host)
+        if handler is None:
+            return self._send(404, {"message": "Unknown host"})
+        return handler("/" + path, query)
+
+    # GitHub
+
+    def github_api(self, path, query):
+        state = self.server_state
+        resource = "search" if path.startswith("/search/") else "graphql" if path == "/graphql" else "core"
+        allowed, headers = state.rate_limit(resource)
+        if not allowed:
+            return self._send(403, {"message": "API rate limit exceeded"}, headers=headers)
+
+        fixtures = state.fixtures
+        repos = list(fixtures.assets)
+        if path == "/search/repositories":
+            page, per_page = int(query.get("page", 1)), int(query.get("per_page", 30))
+            items = [{"full_name": repo, "language": LANGUAGES[i % len(LANGUAGES)]}
+                     for i, repo in enumerate(repos)][(page - 1) * per_page:page * per_page]
+            return self._send(200, {"total_count": len(repos), "items": items}, headers=headers)
+
+        match = re.match(r"/repos/([^/]+/[^/]+)/releases/latest$", path)
+        if match:
+            assets = fixtures.assets.get(match.group(1))
+            if assets is None:
+                return self._send(404, {"message": "Not Found"}, headers=headers)
+            return self._send(200, {"tag_name": "v1.0", "assets": assets}, headers=headers)
+
+        if path == "/graphql":
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+            graphql = json.loads(body or b"{}").get("query", "")
+            data = {}
+            for alias, owner, name in re.findall(r'(r\d+): repository\(owner: "([^"]+)", name: "([^"]+)"\)', graphql):
+                assets = fixtures.assets.get(f"{owner}/{name}")
+                release = None if assets is None else {"tagName": "v1.0", "releaseAssets": {"nodes": [
+                    {"name": a["name"], "size": a["size"], "downloadUrl": a["browser_download_url"]}
+                    for a in assets]}}
+                data[alias] = {"nameWithOwner": f"{owner}/{name}", "latestRelease": release}
+            data["rateLimit"] = {"cost": 1, "remaining": headers.get("X-RateLimit-Remaining"), "resetAt": None}
+            return self._send(200, {"data": data}, headers=headers)
+
+        return self._send(404, {"message": "Not Found"}, headers=headers)
+
+    def github_download(self, path, query):
+        match = re.match(r"/[^/]+/[^/]+/releases/download/[^/]+/(.+)$", path)
+        return self._send_blob(match.group(1) if match else "")
+
+    # NuGet
+
+    def nuget_search(self, path, query):
+        packages = self.server_state.fixtures.packages
+        skip, take = int(query.get("skip", 0)), int(query.get("take", 20))
+        data = [{"id": p["id"], "version": p["version"]} for p in packages[skip:skip + take]]
+        return self._send(200, {"totalHits": len(packages), "data": data})
+
+    def nuget_api(self, path, query):
+        fixtures = self.server_state.fixtures
+        base = "https://api.nuget.org/v3/catalog0"
+        if path == "/v3/catalog0/index.json":
+            last = max((p["committed"] for p in fixtures.packages), default=fixtures.committed)
+            return self._send(200, {"items": [{"@id": f"{base}/page0.json", "commitTimeStamp": iso(last)}]})
+        if path == "/v3/catalog0/page0.json":
+            items = [{"@id": f"{base}/data/{p['id'].lower()}.{p['version']}.json", "@type": "nuget:PackageDetails",
+                      "commitTimeStamp": iso(p["committed"]), "nuget:id": p["id"], "nuget:version": p["version"]}
+                     for p in fixtures.packages]
+            return self._send(200, {"items": items})
+        match = re.match(r"/v3/catalog0/data/(.+)\.json$", path)
+        if match:
+            for p in fixtures.packages:
+                if f"{p['id'].lower()}.{p['version']}" == match.group(1):
+                    return self._send(200, {"packageEntries": [{"fullName": e} for e in p["entries"]],
+                                            "packageSize": p["size"]})
+            return self._send(404, {})
+        match = re.match(r"/v3-flatcontainer/[^/]+/[^/]+/(.+\.nupkg)$", path)
+        return self._send_blob(match.group(1) if match else "")
+
+    def nuget_v2(self, path, query):
+        match = re.match(r"/api/v2/package/([^/]+)/([^/]+)$", path)
+        if not match:
+            return self._send(404, {})
+        return self._send_blob(f"{match.group(1).lower()}.{match.group(2).lower()}.nupkg")
+
+    # PortableApps
+
+    def portableapps(self, path, query):
+        apps = self.server_state.fixtures.apps
+        if path.rstrip("/") == "/apps":
+            links = "".join(f'<li><a href="/apps/utilities/{a["slug"]}">{a["title"]}</a></li>' for a in apps)
+            html = f'<html><body><div class="view-grouping"><h2>Utilities</h2><ul>{links}</ul></div></body></html>'
+            return self._send(200, html, "text/html")
+        match = re.match(r"/apps/[^/]+/([^/]+)$", path)
+        if match:
+            for a in apps:
+                if a["slug"] == match.group(1):
+                    html = (f'<html><body><a href="/downloading/?a={a["slug"]}&f={a["file"]}">'
+                            f'Download from PortableApps.com</a></body></html>')
+                    return self._send(200, html, "text/html")
+            return self._send(404, "", "text/html")
+        if path.startswith("/downloading"):
+            html = f'<html><body><a href="/redir2/?a={query.get("a")}&f={query.get("f")}">click here</a></body></html>'
+            return self._send(200, html, "text/html")
+        if path.startswith("/redir2"):
+            return self._send_blob(query.get("f", ""), disposition=True)
+        return self._send(404, "", "text/html")
+
+
+class FixtureServer:
+    """
+    在背景執行緒中提供假的 GitHub / NuGet / PortableApps 端點，並統計送出的位元組與請求數。
+    可選擇注入延遲 (LATENCY_MS)、下載錯誤 (ERROR_RATE 比例的 503) 與 API 額度 (RATE_LIMIT)。
+    """
+
+    def __init__(self, root, settings=None, port=0):
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.fixtures = Fixtures(root, self.settings)
+        self.latency = self.settings.get("LATENCY_MS", 0) / 1000
+        self.error_rate = self.settings.get("ERROR_RATE", 0.0)
+        limit = self.settings.get("RATE_LIMIT") or {}
+        self.limit = limit.get("LIMIT", 0)
+        self.window = limit.get("WINDOW", 60)
+        self.bytes_sent = 0
+        self.requests_total = 0
+        self._windows = {}
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fixture_server = self
+        self._thread = None
+
+    @property
+    def origin(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def overrides(self):
+        """
+        給 FETCH_SETTINGS.URL_OVERRIDES 使用的網址改寫表。
+        """
+        return {f"https://{host}": f"{self.origin}/{host}" for host in HOSTS}
+
+    def count(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+    def reset_counters(self):
+        with self._lock:
+            self.bytes_sent = 0
+            self.requests_total = 0
+
+    def inject_error(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def rate_limit(self, resource):
+        """
+        模擬 GitHub 的額度 (search / core / graphql 各自計算)。回傳 (是否允許, X-RateLimit headers)。
+        """
+        if not self.limit:
+            return True, {}
+        with self._lock:
+            now = time.time()
+            reset, used = self._windows.get(resource, (0, 0))
+            if now >= reset:
+                reset, used = int(now) + self.window, 0
+            allowed = used < self.limit
+            if allowed:
+                used += 1
+            self._windows[resource] = (reset, used)
+        return allowed, {"X-RateLimit-Limit": str(self.limit),
+                         "X-RateLimit-Remaining": str(self.limit - used),
+                         "X-RateLimit-Reset": str(reset),
+                         "X-RateLimit-Resource": resource}
+
+    def start(self):
+        self.fixtures.prepare()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the crawler endpoints.")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--dir", default="benign_pe/metadata/fixtures", help="where synthetic files are written")
+    args = parser.parse_args()
+
+    server = FixtureServer(args.dir, load_settings(), args.port).start()
+    print(f"[*] Fixture server listening on {server.origin}")
+    print("    FETCH_SETTINGS.URL_OVERRIDES:")
+    for prefix, target in server.overrides().items():
+        print(f"      {prefix}: {target}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import json
+
+from metrics import timed
+from rate_limit import RateLimited
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+# GraphQL 單次查詢最多 100 個 repository 別名
+MAX_BATCH = 100
+
+REPO_FRAGMENT = """
+  r%d: repository(owner: %s, name: %s) {
+    nameWithOwner
+    latestRelease {
+      tagName
+      releaseAssets(first: 100) {
+        nodes { name size downloadUrl }
+      }
+    }
+  }"""
+
+
+class GraphQLUnavailable(Exception):
+    """
+    GraphQL 無法使用 (沒有 token、HTTP 錯誤或被限流)，呼叫端應改用 REST。
+    """
+
+
+def build_query(repos):
+    parts = []
+    for i, repo in enumerate(repos):
+        owner, name = repo.split("/", 1)
+        parts.append(REPO_FRAGMENT % (i, json.dumps(owner), json.dumps(name)))
+    return "query {" + "".join(parts) + "\n  rateLimit { cost remaining resetAt }\n}"
+
+
+@timed("graphql")
+def fetch_latest_releases(engine, repos, token, batch_size=MAX_BATCH, timeout=30):
+    """
+    以 GraphQL 批次查詢每個 repo 的 latest release 與其資產。
+    回傳 {repo: assets}，assets 為與 REST API 相同欄位的 list
+    (name, size, browser_download_url)；沒有 release 的 repo 對應到 None。
+    """
+    if not token:
+        raise GraphQLUnavailable("GraphQL API requires GITHUB_TOKEN")
+
+    headers = {"Authorization": f"bearer {token}"}
+    releases = {}
+    batch_size = max(1, min(batch_size, MAX_BATCH))
+
+    for start in range(0, len(repos), batch_size):
+        batch = repos[start:start + batch_size]
+        try:
+            res = engine.request("POST", GRAPHQL_URL, json={"query": build_query(batch)},
+                                 headers=headers, timeout=timeout)
+        except RateLimited as e:
+            if releases:
+                print(f" [!] GitHub GraphQL: {e}, resolved {len(releases)} repos before pausing.")
+                break
+            raise GraphQLUnavailable(str(e))
+        if res.status_code != 200:
+            if releases:
+                # 已經解析出來的部分照常使用，剩下的交給 REST
+                print(f" [!] GitHub GraphQL: HTTP {res.status_code}, resolved {len(releases)} repos before failing.")
+                break
+            raise GraphQLUnavailable(f"HTTP {res.status_code}")
+
+        payload = res.json()
+        data = payload.get("data") or {}
+        if not data and payload.get("errors"):
+            raise GraphQLUnavailable(payload["errors"][0].get("message", "unknown error"))
+
+        for i, repo in enumerate(batch):
+            node = data.get(f"r{i}")
+            release = (node or {}).get("latestRelease")
+            if not release:
+                releases[repo] = None
+                continue
+            releases[repo] = [
+                {"name": asset["name"], "size": asset["size"], "browser_download_url": asset["downloadUrl"]}
+                for asset in release["releaseAssets"]["nodes"]
+            ]
+
+        rate = data.get("rateLimit") or {}
+        print(f"  [GraphQL] Resolved {len(batch)} repos (cost: {rate.get('cost')}, remaining: {rate.get('remaining')})")
+
+    return releases
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR = Path("benign_pe/metadata/http_cache")
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# 會改變回應內容的請求 header：同一個 URL 帶不同的值時分開快取
+VARY_HEADERS = ("accept", "accept-encoding", "accept-language", "authorization")
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_cache (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    headers TEXT,
+    size INTEGER,
+    stored_at REAL,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS http_cache_last_used ON http_cache(last_used);
+"""
+
+
+class CachedResponse:
+    """
+    從快取還原的回應，提供爬蟲會用到的 requests.Response 介面。
+    """
+
+    def __init__(self, url, content, headers):
+        self.url = url
+        self.status_code = 200
+        self.content = content
+        self.headers = headers
+        self.from_cache = True
+        self.encoding = "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+
+class HttpCache:
+    """
+    以 URL 與 VARY_HEADERS 為鍵的 HTTP 條件式請求快取：保存回應內容與 ETag / Last-Modified，
+    下次請求帶上 If-None-Match / If-Modified-Since，收到 304 時直接使用快取內容。
+    總大小超過上限時，依最後使用時間 (LRU) 淘汰。
+    """
+
+    def __init__(self, db, cache_dir=CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.db = db
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        db.ensure_schema(CACHE_SCHEMA)
+
+    @staticmethod
+    def _key(url, headers=None):
+        # Authorization 等 header 只以雜湊的形式出現在鍵中，不會寫入資料庫
+        headers = CaseInsensitiveDict(headers or {})
+        parts = [url] + [f"{name}: {headers[name]}" for name in VARY_HEADERS if name in headers]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def _body_path(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def _lookup(self, key):
+        rows = self.db.query("SELECT etag, last_modified, headers FROM http_cache WHERE key = ?", (key,))
+        if not rows or not self._body_path(key).exists():
+            return None
+        return rows[0]
+
+    def get(self, session_request, url, headers=None, **kwargs):
+        """
+        透過 session_request (例如 FetchEngine.request) 發出帶有驗證資訊的 GET。
+        回傳 requests.Response 或 CachedResponse。
+        """
+        key = self._key(url, headers)
+        headers = dict(headers or {})
+        entry = self._lookup(key)
+        if entry:
+            etag, last_modified, _ = entry
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        res = session_request("GET", url, headers=headers, **kwargs)
+
+        if res.status_code == 304 and entry:
+            res.close()
+            try:
+                content = self._body_path(key).read_bytes()
+            except OSError:
+                # 內容被淘汰或刪除，重新請求完整內容
+                self.db.execute("DELETE FROM http_cache WHERE key = ?", (key,))
+                headers.pop("If-None-Match", None)
+                headers.pop("If-Modified-Since", None)
+                return session_request("GET", url, headers=headers, **kwargs)
+            self.db.execute("UPDATE http_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            cached_headers = CaseInsensitiveDict(json.loads(entry[2] or "{}"))
+            # 速率限制相關的 header 以最新的回應為準
+            cached_headers.update(res.headers)
+            return CachedResponse(url, content, cached_headers)
+
+        if res.status_code == 200 and (res.headers.get("ETag") or res.headers.get("Last-Modified")):
+            self._store(key, url, res)
+        return res
+
+    def _store(self, key, url, res):
+        content = res.content
+        path = self._body_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        kept_headers = {k: v for k, v in res.headers.items() if k.lower() in ("content-type", "link")}
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO http_cache (key, url, etag, last_modified, headers, size, stored_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, url, res.headers.get("ETag"), res.headers.get("Last-Modified"),
+             json.dumps(kept_headers), len(content), now, now))
+        self._evict()
+
+    def _evict(self):
+        total = self.db.query("SELECT COALESCE(SUM(size), 0) FROM http_cache")[0][0]
+        if total <= self.max_size:
+            return
+        for key, size in self.db.query("SELECT key, size FROM http_cache ORDER BY last_used ASC"):
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(self._body_path(key))
+            except OSError:
+                pass
+            self.db.execute("DELETE FROM http_cache WHERE key = ?", (key,))
+            total -= size or 0
@@ -0,0 +1,265 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import yaml
+
+METRICS_DIR = Path("benign_pe/metadata/metrics")
+RUNS_FILE = "runs.jsonl"
+PREFIX = "pe_collector_"
+
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+# 名稱 → (型別, 說明)；匯出時每個 series 都會加上 source 標籤
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests sent, by host and status code."),
+    "http_request_seconds": ("histogram", "Time until response headers (whole body for non-streamed requests), by host."),
+    "http_retries_total": ("counter", "Requests retried after 429/5xx or a rate-limit 403, by host and status code."),
+    "download_bytes_total": ("counter", "Response body bytes read, by host."),
+    "download_failures_total": ("counter", "Downloads that failed with an HTTP error, by status code."),
+    "ratelimit_remaining": ("gauge", "Last X-RateLimit-Remaining seen, by API family."),
+    "deferred_total": ("counter", "Downloads deferred to a later run after being rate limited."),
+    "files_total": ("counter", "Candidate files by outcome (new, duplicate, near_duplicate, not_pe, infected, error)."),
+    "rejected_total": ("counter", "Downloads rejected by the PE header sniff, by reason."),
+    "admission_total": ("counter", "Admission decisions, by size bucket and result."),
+    "stage_seconds": ("histogram", "Time spent per item in each pipeline stage."),
+    "stage_errors_total": ("counter", "Items that raised in a pipeline stage."),
+    "phase_seconds": ("histogram", "Time spent in crawler phases outside the pipeline (discovery, resolving pages)."),
+    "db_commit_seconds": ("histogram", "State DB batch commit time."),
+    "sanitizer_files_total": ("counter", "Sanitizer results by outcome."),
+    "run_duration_seconds": ("gauge", "Wall time of the last run."),
+    "run_timestamp_seconds": ("gauge", "Unix time the last run finished."),
+    "run_success": ("gauge", "1 if the last run finished without an exception."),
+}
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("METRICS_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+def _key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """
+    一次執行 (一個爬蟲或 sanitizer 的一輪) 的計數器、gauge 與直方圖。
+    執行緒安全；run 結束時由 export_run() 寫成 JSONL 與 Prometheus textfile。
+    """
+
+    def __init__(self, settings=None):
+        settings = load_settings() if settings is None else settings
+        self.enabled = settings.get("ENABLED", True)
+        self.dir = Path(settings.get("DIR") or METRICS_DIR)
+        self.textfile_dir = Path(settings.get("TEXTFILE_DIR") or self.dir)
+        self.buckets = sorted(settings.get("BUCKETS") or DEFAULT_BUCKETS)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[(name, _key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, _key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def count_reads(self, response, **labels):
+        """
+        串流下載：包裝 response.raw.read，讀到的每一塊都計入 download_bytes_total
+        (iter_content、iter_adaptive 與 RemoteZip 最後都是透過它讀取)。
+        """
+        if not self.enabled:
+            return
+        read = response.raw.read
+
+        def counted(*args, **kwargs):
+            data = read(*args, **kwargs)
+            if data:
+                self.inc("download_bytes_total", len(data), **labels)
+            return data
+
+        response.raw.read = counted
+
+    # --- 匯出 ---
+
+    def snapshot(self):
+        with self._lock:
+            return (dict(self.counters), dict(self.gauges),
+                    {key: (list(h.counts), h.count, h.sum) for key, h in self.histograms.items()})
+
+    def to_record(self, source, started, finished, status, summary=None):
+        counters, gauges, histograms = self.snapshot()
+        name_of = lambda key: key[0] + _format_labels(key[1])
+        record = {
+            "source": source,
+            "started": started,
+            "finished": finished,
+            "duration": round(finished - started, 3),
+            "status": status,
+            "counters": {name_of(key): value for key, value in sorted(counters.items())},
+            "gauges": {name_of(key): value for key, value in sorted(gauges.items())},
+            "histograms": {name_of(key): {"count": count, "sum": round(total, 6),
+                                          "buckets": dict(zip(map(str, self.buckets), counts))}
+                           for key, (counts, count, total) in sorted(histograms.items())},
+        }
+        if summary:
+            record["summary"] = summary
+        return record
+
+    def to_prometheus(self, source, started, finished, status):
+        counters, gauges, histograms = self.snapshot()
+        gauges[("run_duration_seconds", ())] = round(finished - started, 3)
+        gauges[("run_timestamp_seconds", ())] = round(finished, 3)
+        gauges[("run_success", ())] = 1 if status == "ok" else 0
+
+        series = {}
+        for (name, labels), value in sorted(counters.items()) + sorted(gauges.items()):
+            labels = (("source", source),) + labels
+            series.setdefault(name, []).append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+        for (name, labels), (counts, count, total) in sorted(histograms.items()):
+            labels = (("source", source),) + labels
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+
+        out = []
+        for name in sorted(series):
+            kind, help_text = METRICS.get(name, ("untyped", name))
+            out.append(f"# HELP {PREFIX}{name} {help_text}")
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+    def export_run(self, source, started, finished, status, summary=None):
+        """
+        追加一行到 runs.jsonl，並改寫 <source>.prom (先寫暫存檔再改名，node_exporter 不會讀到一半的檔案)。
+        """
+        if not self.enabled:
+            return
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            with open(self.dir / RUNS_FILE, "a") as f:
+                f.write(json.dumps(self.to_record(source, started, finished, status, summary)) + "\n")
+
+            self.textfile_dir.mkdir(parents=True, exist_ok=True)
+            prom = self.textfile_dir / f"{PREFIX}{source}.prom"
+            tmp = prom.with_name(f".{prom.name}.tmp")
+            with open(tmp, "w") as f:
+                f.write(self.to_prometheus(source, started, finished, status))
+            os.replace(tmp, prom)
+        except Exception as e:
+            print(f" [!] Failed to export metrics: {e}")
+
+
+_default_metrics = None
+_default_lock = threading.Lock()
+
+
+def get_metrics():
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
+
+
+def instrumented(source):
+    """
+    包裝爬蟲 / sanitizer 的 main()：開始時清空計數，結束時 (包含例外) 匯出這一輪的 metrics。
+    main() 回傳的摘要 (dict) 會一起寫進 JSONL。
+    """
+    def decorate(main):
+        @functools.wraps(main)
+        def run(*args, **kwargs):
+            metrics = get_metrics()
+            metrics.reset()
+            started = time.time()
+            status, result = "failed", None
+            try:
+                result = main(*args, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                metrics.export_run(source, started, time.time(), status,
+                                   result if isinstance(result, dict) else None)
+        return run
+    return decorate
+
+
+def timed(phase):
+    """
+    記錄函式的執行時間到 phase_seconds{phase=...}。
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with get_metrics().timer("phase_seconds", phase=phase):
+                return fn(*args, **kwargs)
+        return run
+    return decorate
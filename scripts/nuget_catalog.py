@@ -0,0 +1,148 @@
+import datetime
+
+from downloader import PE_EXTENSIONS
+from fingerprint import DOTNET
+
+CATALOG_INDEX_URL = "https://api.nuget.org/v3/catalog0/index.json"
+FLAT_CONTAINER_URL = "https://api.nuget.org/v3-flatcontainer"
+
+PACKAGE_DETAILS = "nuget:PackageDetails"
+
+
+def parse_timestamp(value):
+    """
+    將 catalog 的 commitTimeStamp (ISO 8601，可能帶 7 位小數) 轉成 datetime，以便比較先後。
+    """
+    value = value.rstrip("Z")
+    if "." in value:
+        head, frac = value.split(".", 1)
+        value = f"{head}.{frac[:6]}"
+    return datetime.datetime.fromisoformat(value)
+
+
+def package_url(pkg_id, version):
+    pkg_id, version = pkg_id.lower(), version.lower()
+    return f"{FLAT_CONTAINER_URL}/{pkg_id}/{version}/{pkg_id}.{version}.nupkg"
+
+
+def has_pe_entries(leaf):
+    """
+    依 catalog leaf 的 packageEntries 判斷 nupkg 裡有沒有 PE 檔，沒有的就不必下載。
+    """
+    return any(entry.get("fullName", "").lower().endswith(tuple(PE_EXTENSIONS))
+               for entry in leaf.get("packageEntries", []))
+
+
+def guess_category(leaf):
+    """
+    下載前推測套件內 PE 的分類：PE 檔全都在 lib/、ref/、runtimes/*/lib/ 底下的是 .NET 函式庫。
+    無法判斷時回傳 None。
+    """
+    names = [entry.get("fullName", "").lower().replace("\\", "/")
+             for entry in leaf.get("packageEntries", [])]
+    pe_names = [name for name in names if name.endswith(tuple(PE_EXTENSIONS))]
+    if pe_names and all(name.startswith(("lib/", "ref/")) or
+                        (name.startswith("runtimes/") and "/lib/" in name) for name in pe_names):
+        return DOTNET
+    return None
+
+
+def list_new_leaves(engine, cursor, timeout=30):
+    """
+    讀取 catalog 的 index 與 cursor 之後的每一頁，依 commitTimeStamp 排序回傳新的 PackageDetails leaf。
+    同一個套件版本只保留最新的一筆。
+    """
+    res = engine.get(CATALOG_INDEX_URL, timeout=timeout, use_cache=True)
+    res.raise_for_status()
+    pages = [page for page in res.json().get("items", [])
+             if parse_timestamp(page["commitTimeStamp"]) > cursor]
+    pages.sort(key=lambda page: parse_timestamp(page["commitTimeStamp"]))
+
+    latest = {}
+    for page in pages:
+        page_res = engine.get(page["@id"], timeout=timeout, use_cache=True)
+        page_res.raise_for_status()
+        for item in page_res.json().get("items", []):
+            if item.get("@type") != PACKAGE_DETAILS:
+                continue
+            committed = parse_timestamp(item["commitTimeStamp"])
+            if committed <= cursor:
+                continue
+            key = (item["nuget:id"].lower(), item["nuget:version"].lower())
+            if key not in latest or committed > latest[key][0]:
+                latest[key] = (committed, item)
+
+    return sorted((entry for entry in latest.values()), key=lambda entry: entry[0])
+
+
+def get_catalog_packages(engine, cursor, max_packages, include_prerelease=False, timeout=30,
+                         skip_categories=()):
+    """
+    從 NuGet V3 catalog 取得 cursor 之後發布、且含有 PE 檔的套件，回傳 (packages, new_cursor, deferred)。
+    new_cursor 只會停在某個 commit 的結尾，呼叫端在下載完成後再保存，下一輪就只會處理之後發布的套件。
+    有 leaf 讀取失敗時，new_cursor 停在該 leaf 所屬 commit 之前，下一輪會重新列出並重試。
+    推測分類屬於 skip_categories (已超過配額) 的套件不佔 max_packages 的名額，另外放在 deferred 回傳，
+    由呼叫端決定何時處理。
+    """
+    leaves = list_new_leaves(engine, cursor, timeout)
+    print(f"  [Catalog] {len(leaves)} package versions committed since {cursor.isoformat()}Z")
+
+    # 每個 leaf 都要一次請求，交給 api.nuget.org 的工作執行緒並行抓取
+    def fetch_leaf(item):
+        leaf_res = engine.get(item["@id"], timeout=timeout)
+        if leaf_res.status_code != 200:
+            return leaf_res.status_code, None
+        return leaf_res.status_code, leaf_res.json()
+
+    packages = []
+    # new_cursor: 已完整處理的最後一個 commit；current: 正在處理的 commit
+    new_cursor = current = cursor
+    window = 32
+    done = False
+    failed = False
+    deferred = []
+    for start in range(0, len(leaves), window):
+        batch = leaves[start:start + window]
+        futures = [engine.submit(item["@id"], fetch_leaf, item) for _, item in batch]
+        for (committed, item), future in zip(batch, futures):
+            if committed > current:
+                # 只在 commit 邊界停下，避免同一個 commit 的其他套件被跳過
+                if failed or len(packages) >= max_packages:
+                    done = True
+                    break
+                new_cursor, current = current, committed
+            try:
+                status, leaf = future.result()
+            except Exception as e:
+                status, leaf = e, None
+            if leaf is None:
+                if status == 404:
+                    # catalog 指向已不存在的 leaf，重試也不會成功
+                    print(f"  [!] Catalog leaf not found: {item['@id']}")
+                    continue
+                # 暫時性錯誤：游標不越過這個 commit，下一輪重新讀取
+                print(f"  [!] Could not fetch catalog leaf {item['@id']} ({status})")
+                failed = True
+                continue
+            pkg_id, version = item["nuget:id"], item["nuget:version"]
+            if "-" in version and not include_prerelease:
+                continue
+            if not has_pe_entries(leaf):
+                continue
+            category = guess_category(leaf)
+            package = {"id": pkg_id, "version": version, "url": package_url(pkg_id, version),
+                       "size": leaf.get("packageSize"), "category": category}
+            if category in skip_categories:
+                deferred.append(package)
+                continue
+            packages.append(package)
+        if done:
+            for future in futures:
+                future.cancel()
+            break
+    if not failed:
+        new_cursor = current
+
+    if deferred:
+        print(f"  [Catalog] Deferred {len(deferred)} packages in over-quota categories ({', '.join(sorted(skip_categories))})")
+    return packages, new_cursor, deferred
@@ -0,0 +1,196 @@
+import argparse
+import importlib
+import signal
+import threading
+import time
+import traceback
+
+import yaml
+
+from collect_pipeline import SHUTDOWN
+from fetch_engine import get_engine
+from state_db import get_db
+
+# 游標資料表中保存排程的 source 名稱 (重新啟動後沿用各來源的下次執行時間)
+CURSOR_SOURCE = "orchestrator"
+
+DEFAULT_SOURCES = {
+    "github": {"MODULE": "crawler_github", "PRIORITY": 3, "BACKLOG_INTERVAL": 60, "IDLE_INTERVAL": 1800},
+    "choco": {"MODULE": "crawler_choco", "PRIORITY": 3, "BACKLOG_INTERVAL": 60, "IDLE_INTERVAL": 900},
+    "portable": {"MODULE": "crawler_portable", "PRIORITY": 1, "BACKLOG_INTERVAL": 1500, "IDLE_INTERVAL": 21600},
+}
+
+DEFAULT_RATE_LIMIT_BACKOFF = 900
+DEFAULT_ERROR_BACKOFF = 300
+DEFAULT_AGING_SECONDS = 3600
+DEFAULT_MAX_SLEEP = 600
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("ORCHESTRATOR_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+class Source:
+    """
+    一個爬蟲來源。爬蟲模組的 main() 執行一輪並回傳摘要 (磁碟空間不足時回傳 None)：
+    {"jobs", "accepted", "backlog", "rate_limited", "retry_at", "stages"}。
+    """
+
+    def __init__(self, name, conf):
+        self.name = name
+        self.module_name = conf.get("MODULE", f"crawler_{name}")
+        self.priority = conf.get("PRIORITY", 1)
+        self.backlog_interval = conf.get("BACKLOG_INTERVAL", 60)
+        self.idle_interval = conf.get("IDLE_INTERVAL", 1800)
+        self.next_run = 0.0
+        self.runs = 0
+        self._module = None
+
+    @property
+    def module(self):
+        # 只在第一次執行時 import，之後沿用同一個模組 (以及它建立的 Session 與快取)
+        if self._module is None:
+            self._module = importlib.import_module(self.module_name)
+        return self._module
+
+    def score(self, now, aging_seconds):
+        """
+        排程分數：優先順序加上逾期時間 (每逾期 aging_seconds 秒加 1)，低優先的來源不會一直被擠掉。
+        """
+        return self.priority + max(0.0, now - self.next_run) / aging_seconds
+
+
+class Orchestrator:
+    """
+    常駐的排程器：在同一個行程中輪流執行各爬蟲，共用 FetchEngine (連線與 HTTP 快取)、
+    clamd 連線與 StateDB，不再為每一輪啟動新的容器。
+    每個來源依「還有待處理的工作 / 已經追上 / 遇到速率限制」決定下一次執行的時間，
+    同時到期的來源依優先順序執行。
+    """
+
+    def __init__(self, settings=None):
+        settings = load_settings() if settings is None else settings
+        sources = settings.get("SOURCES") or DEFAULT_SOURCES
+        self.sources = [Source(name, conf or {}) for name, conf in sources.items()
+                        if (conf or {}).get("ENABLED", True)]
+        self.rate_limit_backoff = settings.get("RATE_LIMIT_BACKOFF", DEFAULT_RATE_LIMIT_BACKOFF)
+        self.error_backoff = settings.get("ERROR_BACKOFF", DEFAULT_ERROR_BACKOFF)
+        self.aging_seconds = settings.get("AGING_SECONDS", DEFAULT_AGING_SECONDS)
+        self.max_sleep = settings.get("MAX_SLEEP", DEFAULT_MAX_SLEEP)
+        self.db = get_db()
+        self.stop = threading.Event()
+
+        for source in self.sources:
+            source.next_run = float(self.db.get_cursor(CURSOR_SOURCE, source.name, 0))
+
+    # --- 訊號 ---
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        if self.stop.is_set():
+            # 第二次收到訊號：不再等待進行中的下載
+            print(f"\n[!] Received signal {signum} again, exiting immediately.")
+            raise SystemExit(1)
+        print(f"\n[*] Received signal {signum}, finishing in-flight downloads before exiting...")
+        self.request_stop()
+
+    def request_stop(self):
+        self.stop.set()
+        SHUTDOWN.set()
+
+    # --- 排程 ---
+
+    def next_source(self, now):
+        due = [source for source in self.sources if source.next_run <= now]
+        if not due:
+            return None
+        return max(due, key=lambda source: source.score(now, self.aging_seconds))
+
+    def schedule(self, source, result, now):
+        if result is None:
+            # 磁碟空間不足 (爬蟲直接結束)，等到下一個閒置週期再試
+            delay = source.idle_interval
+            reason = "disk threshold reached"
+        elif result.get("rate_limited"):
+            retry_at = result.get("retry_at")
+            delay = retry_at - now if retry_at else self.rate_limit_backoff
+            reason = "rate limited"
+        elif result.get("backlog"):
+            delay = source.backlog_interval
+            reason = "backlog remaining"
+        else:
+            delay = source.idle_interval
+            reason = "caught up"
+        self.set_next_run(source, now + max(0, delay))
+        print(f"[*] {source.name}: {reason}, next run in {max(0, delay) / 60:.1f} min")
+
+    def set_next_run(self, source, next_run):
+        source.next_run = next_run
+        self.db.set_cursor(CURSOR_SOURCE, source.name, next_run)
+        self.db.commit()
+
+    def run_source(self, source):
+        print(f"\n=== [{source.name}] Cycle {source.runs + 1} starting: {time.ctime()} ===")
+        started = time.time()
+        # 先以錯誤退避時間排程並保存：爬蟲丟出例外、甚至行程被強制結束時，重新啟動後也不會馬上重跑
+        self.set_next_run(source, started + self.error_backoff)
+        try:
+            result = source.module.main()
+        except Exception:
+            traceback.print_exc()
+            print(f" [!] {source.name} crawler failed, retrying in {self.error_backoff}s.")
+            self.set_next_run(source, time.time() + self.error_backoff)
+            return
+        finally:
+            source.runs += 1
+        print(f"=== [{source.name}] Cycle finished in {time.time() - started:.0f}s ===")
+        self.schedule(source, result, time.time())
+
+    def run(self, once=False):
+        print(f"=== Orchestrator started: {', '.join(s.name for s in self.sources)} ===")
+        pending = {source.name for source in self.sources}
+        try:
+            while not self.stop.is_set():
+                now = time.time()
+                if once:
+                    # 每個來源各執行一次 (忽略排程時間)，依優先順序
+                    if not pending:
+                        break
+                    source = max((s for s in self.sources if s.name in pending),
+                                 key=lambda s: s.priority)
+                    pending.discard(source.name)
+                else:
+                    source = self.next_source(now)
+                if source is None:
+                    wake = min(s.next_run for s in self.sources)
+                    self.stop.wait(min(self.max_sleep, max(1.0, wake - now)))
+                    continue
+                self.run_source(source)
+        finally:
+            print("\n=== Orchestrator stopping ===")
+            get_engine().close()
+            self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run all crawlers in one long-lived scheduler process.")
+    parser.add_argument("--once", action="store_true", help="run every enabled source once and exit")
+    args = parser.parse_args()
+
+    orchestrator = Orchestrator()
+    if not orchestrator.sources:
+        print("No sources enabled in ORCHESTRATOR_SETTINGS.")
+        return
+    orchestrator.install_signal_handlers()
+    orchestrator.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
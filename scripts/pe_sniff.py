@@ -0,0 +1,104 @@
+import struct
+
+# 只需要檔案開頭這麼多位元組就能判斷絕大多數 PE (e_lfanew 通常小於 0x400)
+SNIFF_SIZE = 4096
+
+OPTIONAL_MAGIC_PE32 = 0x10B
+OPTIONAL_MAGIC_PE32_PLUS = 0x20B
+
+MAX_SECTIONS = 96
+
+# sniff_pe_header() 的結果
+OK = "ok"
+NEED_MORE = "need_more"
+
+
+def sniff_pe_header(data):
+    """
+    只看檔案開頭的位元組判斷是否為有效的 PE：
+    MZ、e_lfanew、PE 簽章、File Header 與 Optional Header 的基本合理性。
+    不檢查 Machine 欄位：ARM64EC、Thumb-2、WinCE 的 MIPS/SH 等合法 PE 的值很多，白名單容易誤判。
+    回傳 (verdict, detail)：verdict 為 OK、NEED_MORE (資料不足以判斷) 或失敗原因字串。
+    """
+    if len(data) >= 2 and data[:2] != b"MZ":
+        return "not_mz", "missing MZ signature"
+    if len(data) < 0x40:
+        return NEED_MORE, 0x40
+
+    e_lfanew = struct.unpack_from("<I", data, 0x3C)[0]
+    if e_lfanew < 4 or e_lfanew > 0x10000000:
+        return "bad_e_lfanew", f"e_lfanew out of range: {e_lfanew:#x}"
+
+    # PE 簽章 (4) + File Header (20) + Optional Header 的 Magic 與對齊欄位
+    needed = e_lfanew + 24 + 0x28
+    if len(data) < needed:
+        return NEED_MORE, needed
+
+    if data[e_lfanew:e_lfanew + 4] != b"PE\0\0":
+        return "no_pe_signature", "missing PE signature"
+
+    number_of_sections = struct.unpack_from("<H", data, e_lfanew + 6)[0]
+    size_of_optional_header = struct.unpack_from("<H", data, e_lfanew + 20)[0]
+    if number_of_sections == 0 or number_of_sections > MAX_SECTIONS:
+        return "bad_sections", f"NumberOfSections={number_of_sections}"
+    if size_of_optional_header < 0x40:
+        return "bad_optional_header", f"SizeOfOptionalHeader={size_of_optional_header}"
+
+    optional = e_lfanew + 24
+    magic = struct.unpack_from("<H", data, optional)[0]
+    if magic not in (OPTIONAL_MAGIC_PE32, OPTIONAL_MAGIC_PE32_PLUS):
+        return "bad_optional_magic", f"Magic={magic:#x}"
+
+    section_alignment, file_alignment = struct.unpack_from("<II", data, optional + 0x20)
+    if file_alignment == 0 or file_alignment & (file_alignment - 1):
+        return "bad_alignment", f"FileAlignment={file_alignment:#x}"
+    if section_alignment < file_alignment:
+        return "bad_alignment", f"SectionAlignment={section_alignment:#x} < FileAlignment={file_alignment:#x}"
+
+    return OK, None
+
+
+def is_pe_bytes(data):
+    """
+    記憶體中的資料是否為 PE。資料不足以判斷時視為通過，交由後續完整檢查。
+    """
+    verdict, _ = sniff_pe_header(data)
+    return verdict in (OK, NEED_MORE)
+
+
+def read_head(chunks, size=SNIFF_SIZE):
+    """
+    從資料區塊迭代器讀出至少 size 位元組作為檔頭，
+    回傳 (head, rest)，rest 會先產生 head 再接著產生剩下的區塊，可直接交給 SampleStore.stage()。
+    """
+    chunks = iter(chunks)
+    buffered = []
+    length = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffered.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            break
+    head = b"".join(buffered)
+
+    def rest():
+        if head:
+            yield head
+        yield from chunks
+
+    return head, rest()
+
+
+def sniff_stream(chunks, size=SNIFF_SIZE):
+    """
+    檢查串流開頭 (HTTP 回應或 zip 成員) 是否像 PE。
+    回傳 (verdict, detail, rest)，只有 verdict 為 OK 或 NEED_MORE 時才需要繼續讀取 rest。
+    """
+    head, rest = read_head(chunks, size)
+    verdict, detail = sniff_pe_header(head)
+    if verdict == NEED_MORE and len(head) < size:
+        # 整個內容都讀完了還是不夠長，不可能是 PE
+        verdict, detail = "truncated", f"only {len(head)} bytes"
+    return verdict, detail, rest
@@ -0,0 +1,211 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import yaml
+
+from metrics import get_metrics
+
+_STOP = object()
+
+DEFAULT_QUEUE_SIZE = 16
+
+_settings = None
+
+# 這個行程共用的行程池 (依 worker 數)，常駐排程器每一輪建立的管線都沿用同一組 worker 行程
+_process_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pipeline_settings():
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r") as f:
+                _settings = (yaml.safe_load(f) or {}).get("PIPELINE_SETTINGS", {}) or {}
+        except Exception:
+            _settings = {}
+    return _settings
+
+
+def get_process_pool(workers):
+    """
+    取得共用的行程池，第一次使用時才建立；行程結束時統一關閉。
+    """
+    with _pools_lock:
+        pool = _process_pools.get(workers)
+        if pool is None:
+            pool = _process_pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+
+def discard_process_pool(workers, pool):
+    """
+    worker 行程異常結束後整個行程池都不能再用：移除並關閉，下一次 get_process_pool 會建立新的。
+    """
+    with _pools_lock:
+        if _process_pools.get(workers) is pool:
+            del _process_pools[workers]
+    pool.shutdown(wait=False)
+
+
+@atexit.register
+def shutdown_process_pools():
+    with _pools_lock:
+        pools = list(_process_pools.values())
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+
+class Stage:
+    """
+    管線中的一個階段：workers 條執行緒從有上限的佇列取出工作，
+    fn(item) 回傳要交給下一個階段的項目 (可迭代物件或 None)。
+    下一個階段的佇列滿了時 put 會阻塞，形成背壓。
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=16):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.threads = []
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, error=False):
+        with self._lock:
+            self.processed += 1
+            self.busy_seconds += elapsed
+            if error:
+                self.errors += 1
+        get_metrics().observe("stage_seconds", elapsed, stage=self.name)
+        if error:
+            get_metrics().inc("stage_errors_total", stage=self.name)
+
+
+class Pipeline:
+    """
+    以有上限的佇列串接多個 Stage。I/O 階段用執行緒處理，
+    需要大量 CPU 的解析工作可以透過 run_cpu 交給這個行程共用的行程池。
+    可以當作 context manager 使用，離開時一定會停止所有執行緒。
+    """
+
+    def __init__(self, stages, process_workers=0, on_error=None):
+        self.stages = stages
+        self.on_error = on_error
+        self.process_workers = process_workers
+        self.started = None
+        self._closed = False
+
+    def start(self):
+        self.started = time.time()
+        for index, stage in enumerate(self.stages):
+            downstream = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for i in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(stage, downstream),
+                                     name=f"{stage.name}-{i}", daemon=True)
+                t.start()
+                stage.threads.append(t)
+        return self
+
+    def run_cpu(self, fn, *args):
+        """
+        在行程池執行 CPU 密集的解析 (沒有行程池時直接在目前的執行緒執行)。
+        fn 必須是模組層級的函式，參數要能被 pickle。
+        """
+        if not self.process_workers:
+            return fn(*args)
+        pool = get_process_pool(self.process_workers)
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            discard_process_pool(self.process_workers, pool)
+            raise
+
+    def put(self, item):
+        """
+        把工作放進第一個階段 (佇列滿時阻塞)。
+        """
+        self.stages[0].queue.put(item)
+
+    def _worker(self, stage, downstream):
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                break
+            started = time.time()
+            try:
+                outputs = stage.fn(item)
+                if outputs is not None and downstream is not None:
+                    for output in outputs:
+                        downstream.queue.put(output)
+                stage.record(time.time() - started)
+            except Exception as e:
+                stage.record(time.time() - started, error=True)
+                if self.on_error:
+                    self.on_error(stage.name, item, e)
+                else:
+                    print(f" [!] Pipeline stage '{stage.name}' failed: {e}")
+
+    def close(self):
+        """
+        不再放入新工作，依序等待每個階段處理完畢 (共用的行程池保留給下一個管線)。
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for t in stage.threads:
+                t.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        return {
+            stage.name: {
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "errors": stage.errors,
+                "busy_seconds": round(stage.busy_seconds, 3),
+            }
+            for stage in self.stages
+        }
+
+    def report(self):
+        elapsed = time.time() - (self.started or time.time())
+        stats = self.stats()
+        print(f"\n=== Pipeline Stages ({elapsed:.1f}s wall) ===")
+        for stage in self.stages:
+            s = stats[stage.name]
+            print(f"  {stage.name:<9} workers={s['workers']:<3} items={s['processed']:<6} "
+                  f"errors={s['errors']:<4} busy={s['busy_seconds']:.1f}s")
+
+
+def build_pipeline(specs, settings=None, on_error=None):
+    """
+    依 PIPELINE_SETTINGS 建立管線。specs 為 [(階段名稱, fn, 預設 worker 數), ...]，
+    WORKERS 可以逐一覆寫各階段的 worker 數；PROCESS_WORKERS 為 0 時使用 CPU 核心數 - 1。
+    """
+    settings = get_pipeline_settings() if settings is None else settings
+    workers = settings.get("WORKERS", {}) or {}
+    queue_size = settings.get("QUEUE_SIZE", DEFAULT_QUEUE_SIZE)
+    stages = [Stage(name, fn, workers.get(name, default), queue_size) for name, fn, default in specs]
+
+    process_workers = settings.get("PROCESS_WORKERS", 0)
+    if not process_workers:
+        process_workers = max(1, (os.cpu_count() or 2) - 1)
+    return Pipeline(stages, process_workers, on_error)
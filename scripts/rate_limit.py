@@ -0,0 +1,213 @@
+import email.utils
+import random
+import threading
+import time
+
+from metrics import get_metrics
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_MAX_WAIT = 120
+DEFAULT_BACKOFF = 2.0
+DEFAULT_MAX_BACKOFF = 60
+DEFAULT_RESERVE = 1
+
+# 可以重試的狀態碼 (403 只有在確定是速率限制時才算，見 RateLimitPacer.retry_delay)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# GitHub 的 X-RateLimit-Reset 是 epoch 秒；比這個小的值視為「幾秒後重置」(IETF RateLimit-Reset)
+EPOCH_THRESHOLD = 10 ** 9
+
+
+class RateLimited(Exception):
+    """
+    某個 API 的額度已經用完，而且要等超過 MAX_WAIT 秒才會重置。
+    呼叫端應把工作留到 retry_at 之後 (延後而不是丟棄)。
+    """
+
+    def __init__(self, family, retry_at):
+        super().__init__(f"{family} rate limit exhausted until {time.ctime(retry_at)}")
+        self.family = family
+        self.retry_at = retry_at
+
+
+def _header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def parse_retry_after(headers, now=None):
+    """
+    解析 Retry-After (秒數或 HTTP 日期)，回傳可以重試的 epoch 時間；沒有時回傳 None。
+    """
+    value = _header(headers, "Retry-After")
+    if not value:
+        return None
+    now = time.time() if now is None else now
+    value = value.strip()
+    if value.isdigit():
+        return now + int(value)
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rate_limit(headers, now=None):
+    """
+    回傳 (remaining, limit, reset_epoch)，沒有對應的 header 時為 None。
+    """
+    now = time.time() if now is None else now
+    values = []
+    for names in (("X-RateLimit-Remaining", "RateLimit-Remaining"),
+                  ("X-RateLimit-Limit", "RateLimit-Limit"),
+                  ("X-RateLimit-Reset", "RateLimit-Reset")):
+        value = _header(headers, *names)
+        try:
+            values.append(int(float(value)) if value is not None else None)
+        except ValueError:
+            values.append(None)
+    remaining, limit, reset = values
+    if reset is not None and reset < EPOCH_THRESHOLD:
+        reset = now + reset
+    return remaining, limit, reset
+
+
+class ApiFamily:
+    """
+    一組共用同一個額度的 API (例如 GitHub 的 search 與 core)。
+    依最近一次回應的 Remaining / Reset 把剩下的請求平均分散到重置前的時間，
+    額度用完或收到 Retry-After 時，在重置前暫停這一組的所有請求。
+    """
+
+    def __init__(self, name, prefix, limit=None, window=None, reserve=DEFAULT_RESERVE):
+        self.name = name
+        self.prefix = prefix
+        self.limit = limit
+        self.window = window
+        self.reserve = reserve
+        self.remaining = None
+        self.reset = None
+        self.blocked_until = 0.0
+        self.next_at = 0.0
+        self._lock = threading.Lock()
+
+    def _delay(self, now):
+        """
+        計算下一個請求要等多久，並預先扣掉一個額度 (回應還沒回來前，其他執行緒也會看到)。
+        """
+        if self.blocked_until > now:
+            return self.blocked_until - now
+
+        if self.reset is None or self.reset <= now:
+            # 還不知道額度或已經過了重置時間：依設定的 LIMIT / WINDOW 重新估計
+            if self.limit and self.window:
+                self.remaining = self.limit
+                self.reset = now + self.window
+            else:
+                self.remaining = None
+                self.reset = None
+                return 0.0
+
+        usable = self.remaining - self.reserve
+        if usable <= 0:
+            # 保留最後幾個額度，等重置 (多等 1 秒避免時鐘誤差)
+            return self.reset - now + 1
+        spacing = (self.reset - now) / usable
+        start = max(now, self.next_at)
+        self.next_at = start + spacing
+        self.remaining -= 1
+        return start - now
+
+    def acquire(self, max_wait):
+        with self._lock:
+            now = time.time()
+            wait = self._delay(now)
+            if wait > max_wait:
+                raise RateLimited(self.name, now + wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, response):
+        now = time.time()
+        remaining, limit, reset = parse_rate_limit(response.headers, now)
+        retry_at = parse_retry_after(response.headers, now)
+        with self._lock:
+            if remaining is not None and reset is not None:
+                if self.reset is None or reset != self.reset or remaining < self.remaining:
+                    self.remaining = remaining
+                self.reset = reset
+                if limit:
+                    self.limit = limit
+                get_metrics().set("ratelimit_remaining", self.remaining, family=self.name)
+            if retry_at is not None:
+                self.blocked_until = max(self.blocked_until, retry_at)
+            elif response.status_code in (403, 429) and remaining == 0 and reset is not None:
+                self.blocked_until = max(self.blocked_until, reset + 1)
+
+    def status(self):
+        with self._lock:
+            return {"remaining": self.remaining, "reset": self.reset, "blocked_until": self.blocked_until}
+
+
+class RateLimitPacer:
+    """
+    FetchEngine 共用的速率控制：依網址找到所屬的 ApiFamily 分配請求時間，
+    並在 429 / 5xx (以及明確的 403 限流) 時以帶隨機抖動的指數退避重試。
+    """
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.max_retries = settings.get("MAX_RETRIES", DEFAULT_MAX_RETRIES)
+        self.max_wait = settings.get("MAX_WAIT", DEFAULT_MAX_WAIT)
+        self.backoff = settings.get("BACKOFF", DEFAULT_BACKOFF)
+        self.max_backoff = settings.get("MAX_BACKOFF", DEFAULT_MAX_BACKOFF)
+        reserve = settings.get("RESERVE", DEFAULT_RESERVE)
+        # 依設定順序比對網址前綴，較具體的前綴要放在前面
+        self.families = [
+            ApiFamily(name, conf["URL"], conf.get("LIMIT"), conf.get("WINDOW"), conf.get("RESERVE", reserve))
+            for name, conf in (settings.get("FAMILIES") or {}).items()
+        ]
+
+    def family_for(self, url):
+        for family in self.families:
+            if url.startswith(family.prefix):
+                return family
+        return None
+
+    def acquire(self, url):
+        family = self.family_for(url)
+        if family is not None:
+            family.acquire(self.max_wait)
+        return family
+
+    def retry_delay(self, response, attempt):
+        """
+        回傳這個回應在重試前要等待的秒數；不需要 (或不值得) 重試時回傳 None。
+        """
+        status = response.status_code
+        retry_at = parse_retry_after(response.headers)
+        if status == 403:
+            remaining, _, reset = parse_rate_limit(response.headers)
+            if retry_at is None and remaining == 0 and reset is not None:
+                retry_at = reset + 1
+            if retry_at is None:
+                # 一般的 403 (權限不足) 不重試
+                return None
+        elif status not in RETRY_STATUS:
+            return None
+
+        if attempt >= self.max_retries:
+            return None
+        if retry_at is not None:
+            wait = max(0.0, retry_at - time.time())
+        else:
+            # equal jitter：一半固定、一半隨機，避免多個執行緒同時重試
+            step = min(self.max_backoff, self.backoff * 2 ** attempt)
+            wait = step / 2 + random.uniform(0, step / 2)
+        return wait if wait <= self.max_wait else None
+
+    def status(self):
+        return {family.name: family.status() for family in self.families}
@@ -0,0 +1,206 @@
+import itertools
+import struct
+import zlib
+
+from downloader import get_chunk_size
+
+EOCD_SIGNATURE = b"PK\x05\x06"
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+ZIP64_EOCD_SIGNATURE = b"PK\x06\x06"
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+LOCAL_SIGNATURE = b"PK\x03\x04"
+
+EOCD_SIZE = 22
+ZIP64_LOCATOR_SIZE = 20
+MAX_COMMENT = 0xFFFF
+LOCAL_HEADER_SIZE = 30
+
+STORED = 0
+DEFLATED = 8
+
+
+class RangeNotSupported(Exception):
+    """
+    伺服器不支援 Range 請求 (沒有回 206)，呼叫端應改為下載整個檔案。
+    """
+
+
+class RemoteZipEntry:
+    def __init__(self, filename, compress_type, flag_bits, crc, compress_size, file_size, header_offset):
+        self.filename = filename
+        self.compress_type = compress_type
+        self.flag_bits = flag_bits
+        self.CRC = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.header_offset = header_offset
+        # 下一個成員 (或中央目錄) 的起點，作為這個成員的讀取上界
+        self.end_offset = None
+
+    def is_dir(self):
+        return self.filename.endswith("/")
+
+
+class RemoteZip:
+    """
+    透過 HTTP Range 讀取遠端 zip：只抓結尾的 EOCD 與中央目錄，
+    再個別下載需要的成員並在串流中解壓，不必下載整個壓縮檔。
+    """
+
+    def __init__(self, engine, url, timeout=30):
+        self.engine = engine
+        self.url = url
+        self.timeout = timeout
+        self.size = None
+        self._entries = None
+
+    def _get_range(self, start, end=None, stream=False):
+        # end 為 None 時 start 視為「最後 N 位元組」
+        spec = f"bytes=-{start}" if end is None else f"bytes={start}-{end - 1}"
+        res = self.engine.get(self.url, headers={"Range": spec}, timeout=self.timeout, stream=stream)
+        if res.status_code != 206:
+            res.close()
+            raise RangeNotSupported(f"HTTP {res.status_code} for Range {spec}")
+        if self.size is None:
+            content_range = res.headers.get("Content-Range", "")
+            if "/" in content_range and not content_range.endswith("*"):
+                self.size = int(content_range.rsplit("/", 1)[1])
+        # 後續請求直接打到跳轉後的位址 (例如 objects.githubusercontent.com)
+        self.url = res.url
+        return res
+
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._read_central_directory()
+        return self._entries
+
+    def _read_central_directory(self):
+        tail = self._get_range(EOCD_SIZE + MAX_COMMENT + ZIP64_LOCATOR_SIZE).content
+        pos = tail.rfind(EOCD_SIGNATURE)
+        if pos < 0:
+            raise ValueError("End of central directory record not found")
+        if pos + EOCD_SIZE > len(tail):
+            raise ValueError("Truncated end of central directory record")
+
+        (_, _, _, _, total_entries, cd_size, cd_offset, _) = struct.unpack_from("<4sHHHHIIH", tail, pos)
+
+        if cd_offset == 0xFFFFFFFF or cd_size == 0xFFFFFFFF or total_entries == 0xFFFF:
+            loc = pos - ZIP64_LOCATOR_SIZE
+            if loc < 0 or tail[loc:loc + 4] != ZIP64_LOCATOR_SIGNATURE:
+                raise ValueError("ZIP64 locator not found")
+            zip64_eocd_offset = struct.unpack_from("<Q", tail, loc + 8)[0]
+            record = self._get_range(zip64_eocd_offset, zip64_eocd_offset + 56).content
+            if record[:4] != ZIP64_EOCD_SIGNATURE:
+                raise ValueError("ZIP64 end of central directory record not found")
+            if len(record) < 56:
+                raise ValueError("Truncated ZIP64 end of central directory record")
+            total_entries, cd_size, cd_offset = struct.unpack_from("<QQQ", record, 32)
+
+        directory = self._get_range(cd_offset, cd_offset + cd_size).content
+        entries = []
+        p = 0
+        while p + 46 <= len(directory) and directory[p:p + 4] == CENTRAL_SIGNATURE:
+            (flag_bits, compress_type, crc, compress_size, file_size,
+             name_len, extra_len, comment_len, header_offset) = struct.unpack_from(
+                "<8xHH4xIIIHHH8xI", directory, p)
+            name = directory[p + 46:p + 46 + name_len]
+            extra = directory[p + 46 + name_len:p + 46 + name_len + extra_len]
+            filename = name.decode("utf-8" if flag_bits & 0x800 else "cp437", "replace")
+
+            compress_size, file_size, header_offset = self._apply_zip64_extra(
+                extra, compress_size, file_size, header_offset)
+            entries.append(RemoteZipEntry(filename, compress_type, flag_bits, crc,
+                                          compress_size, file_size, header_offset))
+            p += 46 + name_len + extra_len + comment_len
+
+        # 用下一個成員的 local header 位置當作讀取上界
+        ordered = sorted(entries, key=lambda e: e.header_offset)
+        for current, following in zip(ordered, ordered[1:] + [None]):
+            current.end_offset = following.header_offset if following else cd_offset
+        return entries
+
+    @staticmethod
+    def _apply_zip64_extra(extra, compress_size, file_size, header_offset):
+        p = 0
+        while p + 4 <= len(extra):
+            tag, size = struct.unpack_from("<HH", extra, p)
+            if tag == 0x0001:
+                values = extra[p + 4:p + 4 + size]
+                q = 0
+                if file_size == 0xFFFFFFFF and q + 8 <= len(values):
+                    file_size = struct.unpack_from("<Q", values, q)[0]
+                    q += 8
+                if compress_size == 0xFFFFFFFF and q + 8 <= len(values):
+                    compress_size = struct.unpack_from("<Q", values, q)[0]
+                    q += 8
+                if header_offset == 0xFFFFFFFF and q + 8 <= len(values):
+                    header_offset = struct.unpack_from("<Q", values, q)[0]
+                break
+            p += 4 + size
+        return compress_size, file_size, header_offset
+
+    def iter_member(self, entry):
+        """
+        下載單一成員並以串流方式解壓，逐塊產生解壓後的資料 (最後檢查 CRC)。
+        """
+        if entry.flag_bits & 0x1:
+            raise ValueError(f"{entry.filename} is encrypted")
+        if entry.compress_type not in (STORED, DEFLATED):
+            raise ValueError(f"{entry.filename} uses unsupported compression method {entry.compress_type}")
+
+        res = self._get_range(entry.header_offset, entry.end_offset, stream=True)
+        try:
+            chunks = res.iter_content(chunk_size=get_chunk_size())
+            header = b""
+            for chunk in chunks:
+                header += chunk
+                if len(header) >= LOCAL_HEADER_SIZE:
+                    break
+            if len(header) < LOCAL_HEADER_SIZE:
+                raise ValueError(f"Truncated local file header for {entry.filename}")
+            if header[:4] != LOCAL_SIGNATURE:
+                raise ValueError(f"Bad local file header for {entry.filename}")
+            name_len, extra_len = struct.unpack_from("<HH", header, 26)
+
+            # 跳過 local header 的檔名與 extra 欄位 (可能橫跨多個區塊)
+            # 不能讓 next() 的 StopIteration 直接傳出：在產生器中會變成 RuntimeError (PEP 479)
+            skip = LOCAL_HEADER_SIZE + name_len + extra_len
+            while len(header) < skip:
+                try:
+                    header += next(chunks)
+                except StopIteration:
+                    raise ValueError(f"Truncated local file header for {entry.filename}") from None
+            pending = [header[skip:]]
+
+            remaining = entry.compress_size
+            decompressor = zlib.decompressobj(-15) if entry.compress_type == DEFLATED else None
+            crc = 0
+
+            def compressed():
+                nonlocal remaining
+                for data in itertools.chain(pending, chunks):
+                    if remaining <= 0:
+                        break
+                    data = data[:remaining]
+                    remaining -= len(data)
+                    yield data
+
+            for data in compressed():
+                if decompressor is not None:
+                    data = decompressor.decompress(data)
+                if data:
+                    crc = zlib.crc32(data, crc)
+                    yield data
+            if decompressor is not None:
+                tail = decompressor.flush()
+                if tail:
+                    crc = zlib.crc32(tail, crc)
+                    yield tail
+
+            if remaining > 0:
+                raise ValueError(f"Truncated data for {entry.filename}")
+            if crc != entry.CRC:
+                raise ValueError(f"CRC mismatch for {entry.filename}")
+        finally:
+            res.close()
+
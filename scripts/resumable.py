@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from downloader import iter_adaptive, get_download_settings
+from pe_sniff import SNIFF_SIZE
+
+PART_DIR = "parts"
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_PARALLEL_MIN_MB = 64
+DEFAULT_PART_MAX_AGE_DAYS = 7
+
+
+def cleanup_parts(part_dir, max_age_days=DEFAULT_PART_MAX_AGE_DAYS):
+    """
+    刪除太久沒有更新的 .part (來源已經不再出現的下載)，避免暫存檔一直累積。
+    """
+    cutoff = time.time() - max_age_days * 86400
+    for path in Path(part_dir).glob("*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def content_range_total(value):
+    """
+    取出 Content-Range ("bytes 0-4095/123456") 中的總長度；沒有這個標頭或總長度未知 ("*") 時回傳 None。
+    """
+    if not value or "/" not in value:
+        return None
+    total = value.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+class DownloadChanged(Exception):
+    """
+    續傳時伺服器回了完整內容 (200)，代表檔案已經變了，舊的 .part 不能再用。
+    """
+
+
+class ResumableDownload:
+    """
+    可續傳的下載：內容寫到 parts/<url 雜湊>.part.N (平行下載時每段一個檔案)，
+    中斷後下一次以 Range (配合 If-Range) 從已下載的位置繼續，完成後比對總長度。
+    伺服器不支援 Range 時改為一般下載 (斷線只能重來)。
+    """
+
+    def __init__(self, engine, url, part_dir, size=None, timeout=60, check_head=None):
+        self.engine = engine
+        self.url = url
+        self.part_dir = Path(part_dir)
+        self.part_dir.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self.timeout = (15, timeout)
+        self.check_head = check_head
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        self.base = self.part_dir / key
+        self.meta_path = self.base.with_suffix(".json")
+        self.status_code = None
+        self.headers = {}
+
+        settings = get_download_settings()
+        self.max_retries = settings.get("MAX_RETRIES", DEFAULT_MAX_RETRIES)
+        self.connections = max(1, settings.get("PARALLEL_RANGES", 1))
+        self.parallel_min = settings.get("PARALLEL_MIN_MB", DEFAULT_PARALLEL_MIN_MB) * 1024 * 1024
+
+    # --- .part 與 meta ---
+
+    def _segment_path(self, index):
+        return self.base.with_suffix(f".part.{index}")
+
+    def _load_meta(self):
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            return meta if meta.get("url") == self.url else None
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, meta):
+        with open(self.meta_path, "w") as f:
+            json.dump(meta, f)
+
+    def discard(self):
+        for path in self.part_dir.glob(self.base.name + ".*"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # --- 下載 ---
+
+    def run(self):
+        """
+        回傳完成的檔案路徑；HTTP 錯誤或 check_head 拒絕時回傳 None (status_code 可看原因)。
+        """
+        try:
+            return self._run()
+        except DownloadChanged:
+            print(f"   [*] Remote file changed, restarting download: {self.url}")
+            self.discard()
+            return self._run()
+
+    def _run(self):
+        meta = self._load_meta()
+        headers = {"Range": f"bytes=0-{SNIFF_SIZE - 1}"}
+        if meta and meta.get("validator"):
+            headers["If-Range"] = meta["validator"]
+
+        # 先抓開頭：順便確認是否支援 Range、取得總長度與 ETag，並檢查檔頭
+        probe = self.engine.get(self.url, headers=headers, stream=True, timeout=self.timeout,
+                                allow_redirects=True)
+        self.status_code = probe.status_code
+        self.headers = probe.headers
+        if probe.status_code == 200:
+            # 不支援 Range (或檔案已變更)：只能從頭下載
+            self.discard()
+            return self._download_whole(probe)
+        if probe.status_code != 206:
+            probe.close()
+            return None
+
+        head = probe.content
+        probe.close()
+        if self.check_head is not None and not self.check_head(head):
+            self.discard()
+            return None
+
+        # 後續請求直接打到跳轉後的位址 (例如 SourceForge 的鏡像站)
+        url = probe.url
+        total = content_range_total(probe.headers.get("Content-Range"))
+        if total is None:
+            # 伺服器沒有告知總長度，無法分段也無法確認續傳結果：改為一般下載
+            self.discard()
+            res = self.engine.get(url, stream=True, timeout=self.timeout)
+            self.status_code = res.status_code
+            self.headers = res.headers
+            if res.status_code != 200:
+                res.close()
+                return None
+            return self._download_whole(res)
+        validator = probe.headers.get("ETag") or probe.headers.get("Last-Modified")
+
+        if not meta or meta.get("total") != total or meta.get("validator") != validator:
+            self.discard()
+            connections = self.connections if total >= self.parallel_min else 1
+            meta = {"url": self.url, "total": total, "validator": validator, "segments": connections}
+            self._save_meta(meta)
+        elif any(self._segment_path(i).exists() for i in range(meta["segments"])):
+            print(f"   [RESUME] {self.url}")
+
+        segments = meta["segments"]
+        step = -(-total // segments)
+        ranges = [(i, i * step, min(total, (i + 1) * step)) for i in range(segments)]
+
+        if segments == 1:
+            self._download_segment(url, validator, *ranges[0])
+        else:
+            print(f"   [RANGE] Downloading {total / (1024 * 1024):.1f} MB over {segments} connections")
+            errors = []
+
+            def worker(index, start, end):
+                try:
+                    self._download_segment(url, validator, index, start, end)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=worker, args=r, daemon=True) for r in ranges]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if errors:
+                raise errors[0]
+
+        return self._assemble(segments, total)
+
+    def _download_segment(self, url, validator, index, start, end):
+        path = self._segment_path(index)
+        attempt = 0
+        while True:
+            done = path.stat().st_size if path.exists() else 0
+            if done >= end - start:
+                return
+            headers = {"Range": f"bytes={start + done}-{end - 1}"}
+            if validator:
+                headers["If-Range"] = validator
+            try:
+                res = self.engine.get(url, headers=headers, stream=True, timeout=self.timeout)
+                try:
+                    if res.status_code == 200:
+                        raise DownloadChanged(self.url)
+                    if res.status_code != 206:
+                        raise IOError(f"HTTP {res.status_code} for range {headers['Range']}")
+                    with open(path, "ab") as f:
+                        for chunk in iter_adaptive(res):
+                            f.write(chunk)
+                finally:
+                    res.close()
+            except DownloadChanged:
+                raise
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise IOError(f"giving up after {self.max_retries} retries: {e}")
+                wait = min(60, 2 ** attempt)
+                done = path.stat().st_size if path.exists() else 0
+                print(f"   [RETRY] {self.url} segment {index} at {done} bytes ({e}), retrying in {wait}s")
+                time.sleep(wait)
+
+    def _download_whole(self, res):
+        path = self._segment_path(0)
+        expected = int(res.headers.get("Content-Length", 0) or 0) or self.size
+        head = b""
+        checked = self.check_head is None
+        rejected = False
+        try:
+            with open(path, "wb") as f:
+                for chunk in iter_adaptive(res):
+                    f.write(chunk)
+                    if not checked:
+                        head += chunk[:SNIFF_SIZE - len(head)]
+                        if len(head) >= SNIFF_SIZE:
+                            checked = True
+                            rejected = not self.check_head(head)
+                            if rejected:
+                                break
+        finally:
+            res.close()
+        if not checked:
+            rejected = not self.check_head(head)
+        if rejected:
+            self.discard()
+            return None
+        return self._assemble(1, expected)
+
+    def _assemble(self, segments, total):
+        """
+        把各段接成一個檔案並檢查總長度，不符時刪除已接起來的內容並丟出 IOError。
+        """
+        first = self._segment_path(0)
+        with open(first, "ab") as out:
+            for index in range(1, segments):
+                with open(self._segment_path(index), "rb") as f:
+                    while True:
+                        block = f.read(8 * 1024 * 1024)
+                        if not block:
+                            break
+                        out.write(block)
+        for index in range(1, segments):
+            os.remove(self._segment_path(index))
+
+        actual = first.stat().st_size
+        if total and actual != total:
+            # 已經接起來的檔案不能再當成第一段續傳
+            self.discard()
+            raise IOError(f"length mismatch: got {actual} bytes, expected {total}")
+
+        done = self.base.with_suffix(".done")
+        os.replace(first, done)
+        try:
+            os.remove(self.meta_path)
+        except OSError:
+            pass
+        return done
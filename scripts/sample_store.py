@@ -0,0 +1,176 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from downloader import open_spool, get_chunk_size, get_spool_max_memory
+from shard_store import get_shards, sample_path, shards_enabled
+
+STORE_ROOT = Path("benign_pe/objects")
+INCOMING_DIR = ".incoming"
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest (
+    source TEXT NOT NULL,
+    origin_url TEXT NOT NULL,
+    member_path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    added_at REAL,
+    PRIMARY KEY (source, origin_url, member_path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS manifest_sha256 ON manifest(sha256);
+"""
+
+# 樣本進入樣本庫的結果 (收集管線的各階段回報)
+NEW = "new"
+DUPLICATE = "duplicate"
+NEAR_DUPLICATE = "near_duplicate"
+NOT_PE = "not_pe"
+INFECTED = "infected"
+
+
+class StagedSample:
+    """
+    已經計算好 SHA256、但還沒放進 objects/ 的樣本 (內容暫存在 spool 中)。
+    """
+
+    def __init__(self, spool, sha256, size):
+        self.spool = spool
+        self.sha256 = sha256
+        self.size = size
+        self.path = None
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+class SampleStore:
+    """
+    以 SHA256 定址的樣本庫：每個內容只存一份在 objects/ab/cd/<sha256>，
+    或是 (設定 shards 時) 壓縮後追加到分片檔 (見 shard_store.py)。
+    manifest 資料表記錄 (來源, 下載網址, 壓縮檔內路徑) 對應到哪個 SHA256。
+    """
+
+    def __init__(self, db, root=STORE_ROOT, shards=None):
+        self.db = db
+        self.root = Path(root)
+        self.incoming = self.root / INCOMING_DIR
+        self.incoming.mkdir(parents=True, exist_ok=True)
+        self.shards = shards
+        db.ensure_schema(MANIFEST_SCHEMA)
+
+    def object_path(self, sha256):
+        return self.root / sha256[0:2] / sha256[2:4] / sha256
+
+    def contains(self, sha256):
+        if self.object_path(sha256).exists():
+            return True
+        return self.shards is not None and self.shards.contains(sha256)
+
+    def stage(self, chunks, size_hint=None):
+        """
+        一邊讀取資料區塊一邊計算 SHA256，內容暫存在 spool (小檔不落地)。
+        已知是大檔 (size_hint 超過 spool 的記憶體上限) 時直接寫到 .incoming，避免之後再複製一次。
+        """
+        h = hashlib.sha256()
+        size = 0
+        tmp_path = None
+        if size_hint and size_hint > get_spool_max_memory():
+            fd, tmp_path = tempfile.mkstemp(dir=self.incoming)
+            spool = os.fdopen(fd, "w+b")
+        else:
+            spool = open_spool()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    h.update(chunk)
+                    spool.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            spool.close()
+            if tmp_path:
+                os.remove(tmp_path)
+            raise
+
+        if tmp_path:
+            spool.close()
+            staged = StagedSample(None, h.hexdigest(), size)
+            staged.path = Path(tmp_path)
+            return staged
+        spool.seek(0)
+        return StagedSample(spool, h.hexdigest(), size)
+
+    def stage_file(self, path):
+        """
+        已經完整下載到 .incoming 底下的檔案 (例如續傳完成的 .part)：計算 SHA256 後直接接手，不再複製。
+        """
+        h = hashlib.sha256()
+        size = 0
+        chunk_size = get_chunk_size()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+                size += len(chunk)
+        fd, tmp_path = tempfile.mkstemp(dir=self.incoming)
+        os.close(fd)
+        os.replace(path, tmp_path)
+        staged = StagedSample(None, h.hexdigest(), size)
+        staged.path = Path(tmp_path)
+        return staged
+
+    def materialize(self, staged):
+        """
+        把暫存內容寫到 objects/.incoming 底下，供需要檔案路徑的檢查 (PE / 簽章 / ClamAV) 使用。
+        """
+        if staged.path is None:
+            fd, tmp_path = tempfile.mkstemp(dir=self.incoming, prefix=staged.sha256[:16] + "-")
+            staged.spool.seek(0)
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(staged.spool, f, get_chunk_size())
+            staged.path = Path(tmp_path)
+        return staged.path
+
+    def commit(self, staged):
+        """
+        將通過檢查的樣本移入 objects/ (或追加到分片)，回傳最終路徑 (分片中的樣本為 shard:<sha256>)。
+        """
+        path = self.materialize(staged)
+        if self.shards is not None:
+            # 同一內容的兩個候選可能同時通過 validate，已經在分片裡就不再追加
+            if not self.shards.contains(staged.sha256):
+                self.shards.append(staged.sha256, path)
+            staged.close()
+            return sample_path(staged.sha256)
+        dest = self.object_path(staged.sha256)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, dest)
+        staged.path = None
+        staged.close()
+        return dest
+
+    def add_manifest(self, source, origin_url, member_path, sha256):
+        self.db.execute(
+            "INSERT OR REPLACE INTO manifest (source, origin_url, member_path, sha256, added_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (source, origin_url, member_path, sha256, time.time()))
+
+    def known_infected(self, sha256):
+        return bool(self.db.query(
+            "SELECT 1 FROM files WHERE sha256 = ? AND scan_result = 'infected' LIMIT 1", (sha256,)))
+
+
+_default_store = None
+
+
+def get_store(db):
+    global _default_store
+    if _default_store is None:
+        shards = get_shards(db) if shards_enabled() else None
+        _default_store = SampleStore(db, shards=shards)
+    return _default_store
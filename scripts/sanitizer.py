@@ -1,60 +1,262 @@
+import argparse
 import os
+import time
 from pathlib import Path
-from utils import is_pe_file, verify_signature, scan_with_clamav, remove_empty_dirs
+from utils import sha256_file, clamav_verdict, remove_empty_parents
+from pipeline import build_pipeline, get_pipeline_settings
+from collect_pipeline import inspect_pe
+from clamd_scanner import get_clamav_db_version
+from state_db import get_db
+from sample_store import get_store
+from shard_store import get_shards, sample_path
+from similarity import get_similarity
+from fingerprint import get_index
+from stats_manifest import get_stats
+from metrics import get_metrics, instrumented
 
+# 每個檔案的檢查結果；(size, mtime) 沒變就沿用，病毒庫版本變了只需要重新掃描。
+# clean 為 NULL 代表上次掃描出錯，下次一定重掃
+VERDICT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sanitizer_verdicts (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    sha256 TEXT,
+    is_pe INTEGER,
+    signed INTEGER,
+    clean INTEGER,
+    clamav_db TEXT,
+    checked_at REAL
+) WITHOUT ROWID;
+"""
+
+def inspect_file(path):
+    """
+    在行程池中執行：計算 SHA256、驗證 PE 並解析簽章。回傳 (sha256, is_pe, signed)。
+    """
+    sha256 = sha256_file(path)
+    is_pe, info = inspect_pe(path, True)
+    return sha256, is_pe, info is not None
+
+def load_verdicts(db):
+    rows = db.query("SELECT path, size, mtime, sha256, is_pe, signed, clean, clamav_db FROM sanitizer_verdicts")
+    return {row[0]: row[1:] for row in rows}
+
+def plan_item(path, size, mtime, cached, db_version, full, member=None):
+    """
+    依快取決定這個檔案需要做哪些檢查。分片中的樣本 (member) 以 shard:<sha256> 當作路徑，內容不會改變。
+    """
+    item = {"path": path, "size": size, "mtime": mtime, "member": member, "tmp": None,
+            "sha256": None, "is_pe": False, "signed": False, "clean": False,
+            "inspect": True, "scan": True}
+    if full or cached is None:
+        return item
+    cached_size, cached_mtime, sha256, is_pe, signed, clean, clamav_db = cached
+    if cached_size != size or cached_mtime != mtime:
+        return item
+
+    item.update(sha256=sha256, is_pe=bool(is_pe), signed=bool(signed),
+                clean=None if clean is None else bool(clean), inspect=False)
+    # 不是 PE 的檔案不需要掃描；病毒庫沒有更新時沿用上次的掃描結果。
+    # 上次掃描出錯、或取不到病毒庫版本 (無法判斷是否更新過) 時一律重掃
+    item["scan"] = bool(is_pe) and (clean is None or db_version is None or clamav_db != db_version)
+    return item
+
+def discard_tmp(item):
+    if item["tmp"] is not None:
+        os.remove(item["tmp"])
+        item["tmp"] = None
+
+@instrumented("sanitizer")
 def main():
+    parser = argparse.ArgumentParser(description="Retroactively validate and scan the collected dataset.")
+    parser.add_argument("--dry-run", "--report", dest="dry_run", action="store_true",
+                        help="only list files that would be deleted")
+    parser.add_argument("--full", action="store_true", help="ignore the verdict cache and re-check every file")
+    args = parser.parse_args()
+
     base_dir = Path("benign_pe")
     if not base_dir.exists():
         print("Base directory 'benign_pe' does not exist.")
         return
 
     print("=== Retroactive Dataset Sanitization Starting ===")
-    
+    if args.dry_run:
+        print("[*] Dry run: nothing will be deleted.")
+
+    db = get_db()
+    db.ensure_schema(VERDICT_SCHEMA)
+    verdicts = load_verdicts(db)
+    manifest = get_stats(db)
+    similarity = get_similarity(db)
+    fingerprints = get_index(db)
+    shards = get_shards(db)
+    incoming = get_store(db).incoming
+    db_version = get_clamav_db_version()
+    print(f"[*] ClamAV database: {db_version or 'unknown'} ({len(verdicts)} cached verdicts)")
+
     stats = {
         "total": 0,
+        "cached": 0,
+        "inspected": 0,
+        "rescanned": 0,
         "kept": 0,
         "deleted_pe": 0,
-        "deleted_malware": 0
+        "deleted_malware": 0,
+        "scan_errors": 0
     }
+    would_delete = []
+    deleted = []
+
+    def validate(item):
+        # 分片中的樣本先解壓到暫存檔 (commit 階段刪除)
+        if item["member"] is not None and (item["inspect"] or item["scan"]):
+            item["tmp"] = shards.extract(item["member"], incoming)
+        # 1. PE Validation + signature parsing (CPU bound, runs in the process pool)
+        if item["inspect"]:
+            try:
+                item["sha256"], item["is_pe"], item["signed"] = pipeline.run_cpu(
+                    inspect_file, str(item["tmp"] or item["path"]))
+            except Exception:
+                discard_tmp(item)
+                raise
+        return [item]
+
+    def scan(item):
+        # 2. ClamAV Scan
+        # ClamAV is our primary gatekeeper for "benign" status
+        if item["is_pe"] and item["scan"]:
+            try:
+                item["clean"] = clamav_verdict(item["tmp"] or item["path"])
+            except Exception:
+                discard_tmp(item)
+                raise
+        return [item]
+
+    def commit(item):
+        discard_tmp(item)
+        file_path = item["path"]
+        if item["inspect"]:
+            stats["inspected"] += 1
+        elif item["scan"]:
+            stats["rescanned"] += 1
+        else:
+            stats["cached"] += 1
+
+        if item["is_pe"] and item["clean"] is None:
+            # 掃描出錯：這一輪先保留，但不快取掃描結果 (clean 寫入 NULL)，下次一定重掃
+            stats["scan_errors"] += 1
+            print(f" [!] Scan failed, keeping for now: {file_path}")
+
+        if item["inspect"] or item["scan"]:
+            db.execute(
+                "INSERT OR REPLACE INTO sanitizer_verdicts "
+                "(path, size, mtime, sha256, is_pe, signed, clean, clamav_db, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(file_path), item["size"], item["mtime"], item["sha256"], int(item["is_pe"]),
+                 int(item["signed"]), None if item["clean"] is None else int(item["clean"]),
+                 db_version, time.time()))
+
+        if not item["is_pe"]:
+            reason = "Invalid PE"
+            stats["deleted_pe"] += 1
+        elif item["clean"] is False:
+            reason = "Malware Detected"
+            stats["deleted_malware"] += 1
+            if item["scan"] and not args.dry_run:
+                # 讓爬蟲之後不再收下同樣內容
+                db.record_file(item["sha256"], "sanitizer", None, None, item["size"], item["signed"], "infected")
+        else:
+            if (item["inspect"] or item["scan"]) and item["clean"]:
+                # 3. Signature verification (Informational)
+                signed = " (Signed)" if item["signed"] else " (Unsigned)"
+                print(f" [KEEP] Verified: {file_path}{signed}")
+            stats["kept"] += 1
+            return
+
+        if args.dry_run:
+            print(f" [WOULD DELETE] {reason}: {file_path}")
+            would_delete.append((reason, file_path))
+        else:
+            print(f" [DELETE] {reason}: {file_path}")
+            db.execute("DELETE FROM sanitizer_verdicts WHERE path = ?", (str(file_path),))
+            manifest.remove(file_path, item["size"], item["signed"] if item["is_pe"] else None)
+            if item["sha256"]:
+                # manifest.remove 依 fingerprints 查分類，分類紀錄要在之後才刪
+                fingerprints.remove(item["sha256"])
+                similarity.remove(item["sha256"])
+            if item["member"] is not None:
+                shards.delete(item["member"].sha256)
+            else:
+                os.remove(file_path)
+                deleted.append(file_path)
+
+    # 行程池依 CPU 核心數建立，validate 的執行緒數與行程數相同才能餵滿所有行程
+    settings = get_pipeline_settings()
+    processes = settings.get("PROCESS_WORKERS") or os.cpu_count() or 2
+    pipeline = build_pipeline([
+        ("validate", validate, processes),
+        ("scan", scan, 4),
+        ("commit", commit, 1),
+    ], {"QUEUE_SIZE": settings.get("QUEUE_SIZE", 16), "PROCESS_WORKERS": processes})
+    # 統計數字只在 commit 階段更新，固定單一 worker 就不需要額外的鎖
+    pipeline.stages[-1].workers = 1
+    pipeline.start()
 
     # Walk through all files in benign_pe/
+    seen = set()
     for root, dirs, files in os.walk(base_dir):
-        # Skip metadata
-        if "metadata" in root:
+        # Skip metadata, in-flight files of the sample store and the shard packs (checked below)
+        if "metadata" in root or ".incoming" in root or Path(root) == shards.root:
             continue
 
         for name in files:
             file_path = Path(root) / name
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
             stats["total"] += 1
+            seen.add(str(file_path))
+            pipeline.put(plan_item(file_path, stat.st_size, stat.st_mtime, verdicts.get(str(file_path)),
+                                   db_version, args.full))
 
-            # 1. PE Validation
-            if not is_pe_file(file_path):
-                print(f" [DELETE] Invalid PE: {file_path}")
-                os.remove(file_path)
-                stats["deleted_pe"] += 1
-                continue
+    for member in shards.members():
+        path = sample_path(member.sha256)
+        stats["total"] += 1
+        seen.add(path)
+        pipeline.put(plan_item(path, member.size, 0.0, verdicts.get(path), db_version, args.full, member))
 
-            # 2. ClamAV Scan
-            # ClamAV is our primary gatekeeper for "benign" status
-            if not scan_with_clamav(file_path):
-                print(f" [DELETE] Malware Detected: {file_path}")
-                os.remove(file_path)
-                stats["deleted_malware"] += 1
-                continue
+    pipeline.close()
+    pipeline.report()
 
-            # 3. Signature verification (Informational)
-            signed = " (Signed)" if verify_signature(file_path) else " (Unsigned)"
-            print(f" [KEEP] Verified: {file_path}{signed}")
-            stats["kept"] += 1
+    # 已經不存在的檔案不必再保留快取
+    for path in verdicts.keys() - seen:
+        db.execute("DELETE FROM sanitizer_verdicts WHERE path = ?", (path,))
+    db.commit()
+
+    # 只清理這一輪刪除檔案後變空的資料夾，不再走訪整個 benign_pe/
+    remove_empty_parents(deleted, base_dir)
 
-    # Cleanup empty dirs
-    remove_empty_dirs(base_dir)
+    metrics = get_metrics()
+    for outcome, count in stats.items():
+        metrics.inc("sanitizer_files_total", count, outcome=outcome)
 
     print("\n=== Sanitization Complete ===")
     print(f"Total files checked: {stats['total']}")
+    print(f"Unchanged (cached):  {stats['cached']}")
+    print(f"Inspected:           {stats['inspected']}")
+    print(f"Rescanned (new DB):  {stats['rescanned']}")
     print(f"Files kept:          {stats['kept']}")
     print(f"Deleted (Not PE):    {stats['deleted_pe']}")
     print(f"Deleted (Malware):   {stats['deleted_malware']}")
+    print(f"Scan errors (kept):  {stats['scan_errors']}")
+
+    if args.dry_run:
+        print(f"\n=== Dry Run Report: {len(would_delete)} files would be deleted ===")
+        for reason, file_path in would_delete:
+            print(f"  {reason}: {file_path}")
+    return dict(stats, would_delete=len(would_delete), stages=pipeline.stats())
 
 if __name__ == "__main__":
     main()
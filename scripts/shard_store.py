@@ -0,0 +1,549 @@
+import argparse
+import fcntl
+import hashlib
+import lzma
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+import yaml
+
+SHARD_ROOT = Path("benign_pe/shards")
+SHARD_PREFIX = "shard-"
+SHARD_SUFFIX = ".pack"
+LOCK_FILE = ".lock"
+
+# files / 統計資料表中，存在分片裡的樣本以這個前綴代替檔案路徑
+PATH_PREFIX = "shard:"
+
+DEFAULT_MAX_SHARD_MB = 1024
+DEFAULT_CODEC = "auto"
+CHUNK_SIZE = 1024 * 1024
+# 先以 zlib level 1 試壓縮檔案中間的一小段，壓縮率高於 INCOMPRESSIBLE_RATIO (例如已經壓縮過的安裝檔)
+# 就不壓縮，讀取時也能直接 mmap
+TRIAL_BYTES = 64 * 1024
+INCOMPRESSIBLE_RATIO = 0.95
+
+# 每個成員前面的 header：magic、codec、sha256、原始大小、壓縮後長度
+# (分片本身可以自我描述，索引遺失時能以 reindex 重建)；sha256 全為 0 表示已刪除的成員
+HEADER = struct.Struct("<4sB32sQQ")
+MAGIC = b"PESH"
+DELETED = b"\0" * 32
+
+RAW = "raw"
+CODEC_IDS = {RAW: 0, "zlib": 1, "lzma": 2, "zstd": 3}
+CODEC_NAMES = {value: key for key, value in CODEC_IDS.items()}
+
+SHARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shard_index (
+    sha256 TEXT PRIMARY KEY,
+    shard TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    codec TEXT NOT NULL,
+    added_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS shard_index_shard ON shard_index(shard);
+"""
+
+# 分片中的一個樣本；shard 是分片檔案的路徑，offset 指向壓縮資料的開頭 (header 之後)
+Member = namedtuple("Member", ["sha256", "shard", "offset", "length", "size", "codec"])
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("SHARD_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+def shards_enabled():
+    return bool(load_settings().get("ENABLED", False))
+
+
+def _zstd():
+    import zstandard
+    return zstandard
+
+
+def zstd_available():
+    try:
+        _zstd()
+        return True
+    except ImportError:
+        return False
+
+
+def resolve_codec(codec):
+    """
+    auto：有安裝 zstandard 時用 zstd，否則用標準函式庫的 zlib。
+    """
+    codec = (codec or DEFAULT_CODEC).lower()
+    if codec == "auto":
+        return "zstd" if zstd_available() else "zlib"
+    if codec not in CODEC_IDS:
+        raise ValueError(f"unknown codec: {codec}")
+    if codec == "zstd" and not zstd_available():
+        print(" [!] zstandard is not installed, falling back to zlib.")
+        return "zlib"
+    return codec
+
+
+def _compressor(codec, level):
+    if codec == "zlib":
+        return zlib.compressobj(6 if level is None else level)
+    if codec == "lzma":
+        return lzma.LZMACompressor(preset=6 if level is None else level)
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=3 if level is None else level).compressobj()
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def _decompressor(codec):
+    if codec == "zlib":
+        return zlib.decompressobj()
+    if codec == "lzma":
+        return lzma.LZMADecompressor()
+    if codec == "zstd":
+        return _zstd().ZstdDecompressor().decompressobj()
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def decompress(codec, data, size):
+    if codec == RAW:
+        return bytes(data)
+    if codec == "zstd":
+        # 串流寫入的 frame 沒有記錄原始大小，要明確給上限
+        return _zstd().ZstdDecompressor().decompress(data, max_output_size=size)
+    decompressor = _decompressor(codec)
+    return decompressor.decompress(data)
+
+
+def sample_path(sha256):
+    return PATH_PREFIX + sha256
+
+
+def is_shard_path(path):
+    return str(path).startswith(PATH_PREFIX)
+
+
+class ShardReader:
+    """
+    以 mmap 讀取分片中的成員，不需要解開整個分片。每個分片只 map 一次 (執行緒安全)。
+    """
+
+    def __init__(self):
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def _map(self, member):
+        end = member.offset + member.length
+        with self._lock:
+            entry = self._maps.get(member.shard)
+            # 分片在 map 之後可能又被追加內容，要讀的範圍超出時重新 map
+            if entry is None or len(entry[1]) < end:
+                if entry is not None:
+                    self._close(entry)
+                f = open(member.shard, "rb")
+                entry = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                self._maps[member.shard] = entry
+            return entry[1]
+
+    @staticmethod
+    def _close(entry):
+        f, mapped = entry
+        try:
+            mapped.close()
+        except BufferError:
+            # 還有 view() 傳出去的 memoryview 在使用，交給 GC 處理
+            pass
+        f.close()
+
+    def read(self, member):
+        """
+        回傳解壓後的內容 (bytes)。
+        """
+        mapped = self._map(member)
+        return decompress(member.codec, mapped[member.offset:member.offset + member.length], member.size)
+
+    def view(self, member):
+        """
+        回傳 memoryview：未壓縮的成員直接指向 mmap (不複製)，壓縮的成員則是解壓後的內容。
+        """
+        if member.codec == RAW:
+            mapped = self._map(member)
+            return memoryview(mapped)[member.offset:member.offset + member.length]
+        return memoryview(self.read(member))
+
+    def extract(self, member, dest):
+        """
+        以串流方式解壓到 dest (給需要檔案路徑的工具，例如 ClamAV)。
+        """
+        mapped = self._map(member)
+        end = member.offset + member.length
+        decompressor = None if member.codec == RAW else _decompressor(member.codec)
+        with open(dest, "wb") as f:
+            for start in range(member.offset, end, CHUNK_SIZE):
+                chunk = mapped[start:min(start + CHUNK_SIZE, end)]
+                f.write(chunk if decompressor is None else decompressor.decompress(chunk))
+            if decompressor is not None and hasattr(decompressor, "flush"):
+                f.write(decompressor.flush())
+        return dest
+
+    def close(self):
+        with self._lock:
+            for entry in self._maps.values():
+                self._close(entry)
+            self._maps.clear()
+
+
+_reader = None
+
+
+def read_member(member):
+    """
+    行程池中使用：每個 worker 行程共用一個 ShardReader。
+    """
+    global _reader
+    if _reader is None:
+        _reader = ShardReader()
+    return _reader.read(member)
+
+
+def load_pe(sample, fast_load=True):
+    """
+    sample 可以是檔案路徑或分片中的 Member，回傳 pefile.PE。
+    """
+    import pefile
+    if isinstance(sample, Member):
+        return pefile.PE(data=read_member(sample), fast_load=fast_load)
+    return pefile.PE(str(sample), fast_load=fast_load)
+
+
+class ShardStore:
+    """
+    把樣本追加到有大小上限的分片檔 (shard-00001.pack …)，每個成員各自壓縮，可以單獨解壓。
+    索引 (sha256 → 分片, offset, 長度, codec) 存在 state DB 的 shard_index 資料表。
+    追加時以 .lock 檔案鎖住，多個爬蟲行程可以同時寫入同一組分片。
+    """
+
+    def __init__(self, db, root=SHARD_ROOT, settings=None):
+        settings = load_settings() if settings is None else settings
+        self.db = db
+        self.root = Path(settings.get("DIR") or root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_shard_bytes = int(settings.get("MAX_SHARD_MB", DEFAULT_MAX_SHARD_MB)) * 1024 * 1024
+        self.codec = resolve_codec(settings.get("CODEC", DEFAULT_CODEC))
+        self.level = settings.get("LEVEL")
+        self.reader = ShardReader()
+        self._lock = threading.Lock()
+        self._file = None
+        db.ensure_schema(SHARD_SCHEMA)
+
+    # --- 索引 ---
+
+    def _member(self, row):
+        sha256, shard, offset, length, size, codec = row
+        return Member(sha256, str(self.root / shard), offset, length, size, codec)
+
+    def locate(self, sha256):
+        rows = self.db.query(
+            "SELECT sha256, shard, offset, length, size, codec FROM shard_index WHERE sha256 = ?", (sha256,))
+        return self._member(rows[0]) if rows else None
+
+    def contains(self, sha256):
+        return bool(self.db.query("SELECT 1 FROM shard_index WHERE sha256 = ?", (sha256,)))
+
+    def members(self):
+        rows = self.db.query(
+            "SELECT sha256, shard, offset, length, size, codec FROM shard_index ORDER BY shard, offset")
+        return [self._member(row) for row in rows]
+
+    def delete(self, sha256):
+        """
+        從索引移除，並把分片中該成員的 header 標記為已刪除 (reindex 不會再把它加回來)。
+        內容本身仍佔用分片空間。
+        """
+        member = self.locate(sha256)
+        if member is None:
+            return
+        with self._lock, open(self.root / LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(member.shard, "r+b") as f:
+                f.seek(member.offset - HEADER.size)
+                _, codec_id, _, size, length = HEADER.unpack(f.read(HEADER.size))
+                f.seek(member.offset - HEADER.size)
+                f.write(HEADER.pack(MAGIC, codec_id, DELETED, size, length))
+        self.db.execute("DELETE FROM shard_index WHERE sha256 = ?", (sha256,))
+
+    # --- 寫入 ---
+
+    def shard_files(self):
+        return sorted(self.root.glob(f"{SHARD_PREFIX}*{SHARD_SUFFIX}"))
+
+    def _open_shard(self, size):
+        """
+        在持有 .lock 的情況下選擇要追加的分片：最新的分片放不下時開新的分片。
+        """
+        shards = self.shard_files()
+        path = shards[-1] if shards else self.root / f"{SHARD_PREFIX}00001{SHARD_SUFFIX}"
+        if path.exists():
+            current = path.stat().st_size
+            if current and current + HEADER.size + size > self.max_shard_bytes:
+                number = int(path.stem[len(SHARD_PREFIX):]) + 1
+                path = self.root / f"{SHARD_PREFIX}{number:05d}{SHARD_SUFFIX}"
+
+        if self._file is None or self._file.name != str(path):
+            if self._file is not None:
+                self._file.close()
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._file = os.fdopen(fd, "r+b")
+        return path
+
+    def _choose_codec(self, src, size):
+        if not size or self.codec == RAW:
+            return RAW
+        src.seek(max(0, size // 2 - TRIAL_BYTES // 2))
+        sample = src.read(TRIAL_BYTES)
+        src.seek(0)
+        return RAW if len(zlib.compress(sample, 1)) >= len(sample) * INCOMPRESSIBLE_RATIO else self.codec
+
+    def append(self, sha256, path):
+        """
+        把 path 的內容追加到分片並寫入索引，回傳 Member。
+        寫入時重新計算 SHA256，跟 sha256 不符時丟出 ValueError (不會寫入索引)。
+        """
+        size = os.path.getsize(path)
+        with self._lock, open(self.root / LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            shard = self._open_shard(size)
+            f = self._file
+            header_offset = f.seek(0, os.SEEK_END)
+            f.write(b"\0" * HEADER.size)
+
+            h = hashlib.sha256()
+            length = 0
+            with open(path, "rb") as src:
+                codec = self._choose_codec(src, size)
+                chunk = src.read(CHUNK_SIZE)
+                compressor = None if codec == RAW else _compressor(codec, self.level)
+                while chunk:
+                    h.update(chunk)
+                    out = chunk if compressor is None else compressor.compress(chunk)
+                    f.write(out)
+                    length += len(out)
+                    chunk = src.read(CHUNK_SIZE)
+                if compressor is not None:
+                    out = compressor.flush()
+                    f.write(out)
+                    length += len(out)
+
+            # 內容跟 sha256 不符時仍寫入 header (標記為已刪除)，後面的成員才能被 reindex 找到
+            matched = h.hexdigest() == sha256
+            f.seek(header_offset)
+            f.write(HEADER.pack(MAGIC, CODEC_IDS[codec], bytes.fromhex(sha256) if matched else DELETED,
+                                size, length))
+            f.flush()
+        if not matched:
+            raise ValueError(f"content of {path} does not match {sha256}")
+
+        member = Member(sha256, str(shard), header_offset + HEADER.size, length, size, codec)
+        self.db.execute(
+            "INSERT OR REPLACE INTO shard_index (sha256, shard, offset, length, size, codec, added_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (sha256, shard.name, member.offset, length, size, codec, time.time()))
+        return member
+
+    def sync(self):
+        """
+        把目前的分片寫到磁碟 (刪除原始檔案之前呼叫)。
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    # --- 讀取 ---
+
+    def read(self, sha256):
+        member = self.locate(sha256)
+        return None if member is None else self.reader.read(member)
+
+    def view(self, sha256):
+        member = self.locate(sha256)
+        return None if member is None else self.reader.view(member)
+
+    def extract(self, member, dest_dir=None):
+        """
+        解壓到暫存檔並回傳路徑 (呼叫端負責刪除)。
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=member.sha256[:16] + "-")
+        os.close(fd)
+        return Path(self.reader.extract(member, tmp_path))
+
+    # --- 維護 ---
+
+    def reindex(self):
+        """
+        掃描所有分片的 header 重建索引，已刪除的成員會略過。
+        """
+        count = 0
+        for path in self.shard_files():
+            with open(path, "rb") as f:
+                end = f.seek(0, os.SEEK_END)
+                offset = 0
+                while offset + HEADER.size <= end:
+                    f.seek(offset)
+                    magic, codec_id, digest, size, length = HEADER.unpack(f.read(HEADER.size))
+                    if magic != MAGIC:
+                        # 寫到一半就中斷的成員沒有 header，無法得知長度，這個分片後面的內容都無法索引
+                        print(f" [!] {path.name}: no member header at offset {offset}, skipping the rest.")
+                        break
+                    offset += HEADER.size + length
+                    if digest == DELETED:
+                        continue
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO shard_index (sha256, shard, offset, length, size, codec, added_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (digest.hex(), path.name, offset - length, length, size,
+                         CODEC_NAMES[codec_id], time.time()))
+                    count += 1
+        self.db.commit()
+        return count
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self.reader.close()
+
+
+_default_shards = None
+
+
+def get_shards(db):
+    global _default_shards
+    if _default_shards is None:
+        _default_shards = ShardStore(db)
+    return _default_shards
+
+
+def migrate(db, shards, base_dir=Path("benign_pe"), keep=False, batch_size=200):
+    """
+    把 objects/ 的散檔與舊版來源資料夾的檔案搬進分片。
+    每 batch_size 個檔案 fsync 分片並 commit 索引後才刪除原始檔案 (keep 時保留)。
+    """
+    from feature_extractor import iter_store_objects
+    from pe_sniff import sniff_pe_header, OK, NEED_MORE
+    from sample_store import get_store
+    from stats_manifest import LEGACY_DIRS, get_stats
+    from utils import sha256_file, remove_empty_parents
+
+    store = get_store(db)
+    done = []
+    stats = {"migrated": 0, "duplicates": 0, "skipped": 0, "bytes": 0}
+
+    def flush():
+        shards.sync()
+        db.commit()
+        if not keep:
+            for path in done:
+                os.remove(path)
+            remove_empty_parents(done, base_dir)
+        done.clear()
+        print(f"  [SHARD] {stats['migrated']} migrated, {stats['duplicates']} duplicates, "
+              f"{stats['skipped']} skipped")
+
+    def add(path, sha256, source=None):
+        """
+        搬入一個檔案；source 不是 None 時 (舊版資料夾的新樣本) 補上 files 紀錄。
+        """
+        if shards.contains(sha256):
+            stats["duplicates"] += 1
+        else:
+            try:
+                member = shards.append(sha256, path)
+            except ValueError as e:
+                print(f" [!] {e}, leaving it in place.")
+                stats["skipped"] += 1
+                return
+            stats["migrated"] += 1
+            stats["bytes"] += member.size
+            if source is not None:
+                db.record_file(sha256, source, None, sample_path(sha256), member.size, None, "clean")
+        # 樣本庫散檔原本的 files 紀錄改指向分片
+        db.execute("UPDATE files SET path = ? WHERE path = ?", (sample_path(sha256), str(path)))
+        done.append(path)
+        if len(done) >= batch_size:
+            flush()
+
+    # 樣本庫的散檔：檔名就是 SHA256，寫入時會重新驗證
+    for path in iter_store_objects(store.root):
+        add(path, path.name)
+
+    # 舊版來源資料夾：沒有經過樣本庫，只搬 PE 檔案並補上 files / manifest 紀錄
+    for source, dirname in LEGACY_DIRS.items():
+        legacy_dir = Path(base_dir) / dirname
+        for root, _, files in os.walk(legacy_dir):
+            for name in files:
+                path = Path(root) / name
+                with open(path, "rb") as f:
+                    verdict, detail = sniff_pe_header(f.read(4096))
+                if verdict not in (OK, NEED_MORE):
+                    print(f"  [SKIP] Not a valid PE: {path} ({detail})")
+                    stats["skipped"] += 1
+                    continue
+                sha256 = sha256_file(path)
+                store.add_manifest(source, f"legacy:{path.relative_to(legacy_dir)}", name, sha256)
+                add(path, sha256, None if store.contains(sha256) else source)
+    flush()
+    get_stats(db).rebuild()
+    return stats
+
+
+def print_stats(db, shards):
+    rows = db.query("SELECT codec, COUNT(*), SUM(size), SUM(length) FROM shard_index GROUP BY codec")
+    files = sum(row[1] for row in rows)
+    print("=== Sample Shards ===")
+    print(f"Directory:  {shards.root}")
+    print(f"Shards:     {len(shards.shard_files())} "
+          f"({sum(path.stat().st_size for path in shards.shard_files()) / (1024 * 1024):.1f} MB on disk)")
+    print(f"Samples:    {files}")
+    for codec, count, size, length in rows:
+        print(f"  {codec:<6} {count:>8} samples  {size / (1024 * 1024):>10.1f} MB -> "
+              f"{length / (1024 * 1024):>10.1f} MB ({length / size if size else 0:.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage packed sample shards.")
+    parser.add_argument("command", nargs="?", choices=["stats", "migrate", "reindex"], default="stats",
+                        help="stats: show shard usage; migrate: move loose samples into shards; "
+                             "reindex: rebuild the index from the shard headers")
+    parser.add_argument("--keep", action="store_true", help="migrate without deleting the loose files")
+    args = parser.parse_args()
+
+    from state_db import get_db
+    db = get_db()
+    shards = get_shards(db)
+    if args.command == "migrate":
+        print(f"=== Migrating samples into shards ({shards.codec}) ===")
+        stats = migrate(db, shards, keep=args.keep)
+        print(f"\n[*] Migrated {stats['migrated']} samples ({stats['bytes'] / (1024 * 1024):.1f} MB), "
+              f"{stats['duplicates']} already in shards, {stats['skipped']} skipped.")
+    elif args.command == "reindex":
+        print(f"[*] Indexed {shards.reindex()} samples.")
+    print_stats(db, shards)
+    shards.close()
+
+
+if __name__ == "__main__":
+    main()
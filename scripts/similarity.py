@@ -0,0 +1,358 @@
+import argparse
+import hashlib
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pefile
+import yaml
+
+from shard_store import load_pe
+from utils import close_pe, remove_empty_parents
+
+# MinHash 簽名：128 個桶 (one permutation hashing)，每個桶是 uint32
+NUM_BINS = 128
+BIN_BITS = 7
+VALUE_MASK = (1 << (32 - BIN_BITS)) - 1
+EMPTY = 0xFFFFFFFF
+SIGNATURE_FORMAT = f"<{NUM_BINS}I"
+
+# 以 8 bytes 為一個 shingle，每次處理 4MB (避免大型安裝檔一次展開成好幾倍大小的陣列)
+SHINGLE = 8
+CHUNK_BYTES = 4 * 1024 * 1024
+MULTIPLIER = 0x9E3779B97F4A7C15
+KEEP_PER_BIN = 32
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_IMPHASH_THRESHOLD = 0.6
+DEFAULT_MAX_VARIANTS = 5
+DEFAULT_BANDS = 16
+
+SIMILARITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS similarity (
+    sha256 TEXT PRIMARY KEY,
+    imphash TEXT,
+    minhash BLOB NOT NULL,
+    cluster TEXT NOT NULL,
+    indexed_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS similarity_cluster ON similarity(cluster);
+CREATE TABLE IF NOT EXISTS similarity_lsh (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (band, bucket, sha256)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS similarity_lsh_sha256 ON similarity_lsh(sha256);
+"""
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("SIMILARITY_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+def minhash(segments):
+    """
+    對多段位元組內容的 8-byte shingle 集合計算 MinHash 簽名 (bytes)：
+    每個 shingle 雜湊一次，高 7 位元決定桶、其餘位元取最小值，空桶由右側最近的非空桶補上。
+    兩個簽名相同桶的比例即為 Jaccard 相似度的估計值。內容太短 (沒有任何 shingle) 時回傳 None。
+    """
+    import numpy as np
+
+    signature = np.full(NUM_BINS, EMPTY, dtype=np.uint32)
+    for segment in segments:
+        total = len(segment) - SHINGLE + 1
+        for start in range(0, max(total, 0), CHUNK_BYTES):
+            count = min(CHUNK_BYTES, total - start)
+            # 每個位置的 8 bytes：stride 為 1 的 uint64 view，不需要逐 byte 組合
+            x = np.ndarray((count,), dtype="<u8", buffer=segment, offset=start, strides=(1,))
+            # xorshift + 乘法雜湊，取乘積的高 32 位元
+            h = ((x ^ (x >> np.uint64(31))) * np.uint64(MULTIPLIER)).view(np.uint32)[1::2]
+            # 每個桶的最小值幾乎一定小於 limit (預期每桶留下 KEEP_PER_BIN 個)，先濾掉其餘的值
+            limit = (VALUE_MASK + 1) * NUM_BINS * KEEP_PER_BIN // count
+            if limit <= VALUE_MASK:
+                h = h[(h & VALUE_MASK) < limit]
+            np.minimum.at(signature, h >> (32 - BIN_BITS), h & VALUE_MASK)
+
+    filled = np.flatnonzero(signature != EMPTY)
+    if not len(filled):
+        return None
+    # 空桶：取右側 (環狀) 最近的非空桶，加上與距離相關的位移，兩個集合在同一位置得到一樣的值
+    for index in np.flatnonzero(signature == EMPTY):
+        source = filled[np.searchsorted(filled, index) % len(filled)]
+        distance = (source - index) % NUM_BINS
+        signature[index] = (int(signature[source]) + distance * 0x01000193) & 0xFFFFFFFF
+    return signature.astype("<u4").tobytes()
+
+
+def similarity_pe(pe):
+    """
+    回傳 (minhash, imphash)。重新編譯時一定會變的欄位不納入：
+    File Header 的 TimeDateStamp、Optional Header 的 CheckSum 以及 Authenticode 簽章 (憑證表)。
+    """
+    data = pe.__data__
+    oh = pe.OPTIONAL_HEADER
+    header_size = min(max(oh.SizeOfHeaders, 0x200), len(data))
+    header = bytearray(data[:header_size])
+    for offset in (pe.FILE_HEADER.get_file_offset() + 4, oh.get_file_offset() + 64):
+        if offset + 4 <= header_size:
+            header[offset:offset + 4] = b"\x00\x00\x00\x00"
+
+    security = oh.DATA_DIRECTORY[pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_SECURITY"]]
+    cert_start, cert_end = len(data), len(data)
+    if security.VirtualAddress and security.Size and security.VirtualAddress >= header_size:
+        cert_start = min(security.VirtualAddress, len(data))
+        cert_end = min(security.VirtualAddress + security.Size, len(data))
+    body = memoryview(data)
+    signature = minhash([bytes(header), body[header_size:cert_start], body[cert_end:]])
+    if signature is None:
+        return None
+
+    pe.parse_data_directories(directories=[pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_IMPORT"]])
+    imphash = pe.get_imphash() if hasattr(pe, "DIRECTORY_ENTRY_IMPORT") else ""
+    return signature, imphash
+
+
+def similarity_file(sample):
+    """
+    在行程池中執行 (sample 是檔案路徑或分片中的 Member)：回傳 (minhash, imphash)；無法解析時回傳 None。
+    """
+    try:
+        pe = load_pe(sample)
+    except Exception:
+        return None
+    try:
+        return similarity_pe(pe)
+    except Exception:
+        return None
+    finally:
+        close_pe(pe)
+
+
+def estimate(a, b):
+    """
+    兩個 MinHash 簽名的 Jaccard 相似度估計值 (0 ~ 1)。
+    """
+    return sum(x == y for x, y in zip(struct.unpack(SIGNATURE_FORMAT, a), struct.unpack(SIGNATURE_FORMAT, b))) / NUM_BINS
+
+
+class SimilarityIndex:
+    """
+    近似重複樣本的索引 (存在 state DB)：每個樣本的 MinHash 簽名、imphash 與所屬群集。
+    LSH 把簽名切成 BANDS 段，每段雜湊成一個 bucket；只有至少一段相同的樣本才會被拿來比較，
+    查詢成本與樣本庫大小無關。相似度達到 THRESHOLD (imphash 相同時放寬到 IMPHASH_THRESHOLD) 視為同一群集的變體，
+    每個群集最多收 MAX_VARIANTS 個 (0 表示不限制)。
+    """
+
+    def __init__(self, db, settings=None):
+        self.db = db
+        settings = load_settings() if settings is None else settings
+        self.enabled = settings.get("ENABLED", True)
+        self.threshold = settings.get("THRESHOLD", DEFAULT_THRESHOLD)
+        self.imphash_threshold = settings.get("IMPHASH_THRESHOLD", DEFAULT_IMPHASH_THRESHOLD)
+        self.max_variants = settings.get("MAX_VARIANTS", DEFAULT_MAX_VARIANTS)
+        self.bands = settings.get("BANDS", DEFAULT_BANDS)
+        if NUM_BINS % self.bands:
+            raise ValueError(f"SIMILARITY_SETTINGS.BANDS must divide {NUM_BINS}")
+        db.ensure_schema(SIMILARITY_SCHEMA)
+
+    def buckets(self, signature):
+        """
+        每一段簽名的 bucket：[(band, 64-bit 整數)]。
+        """
+        width = len(signature) // self.bands
+        return [(band, int.from_bytes(hashlib.blake2b(signature[band * width:(band + 1) * width],
+                                                      digest_size=8).digest(), "little", signed=True))
+                for band in range(self.bands)]
+
+    def neighbours(self, signature, imphash, exclude=None):
+        """
+        相似度達到門檻的已索引樣本：[(相似度, sha256, cluster)]，由高到低排序。
+        """
+        candidates = set()
+        for band, bucket in self.buckets(signature):
+            candidates.update(row[0] for row in self.db.query(
+                "SELECT sha256 FROM similarity_lsh WHERE band = ? AND bucket = ?", (band, bucket)))
+        candidates.discard(exclude)
+        if not candidates:
+            return []
+
+        result = []
+        candidates = list(candidates)
+        # SQLite 的參數數量有上限，分批查詢
+        for start in range(0, len(candidates), 500):
+            batch = candidates[start:start + 500]
+            rows = self.db.query(
+                f"SELECT sha256, minhash, imphash, cluster FROM similarity "
+                f"WHERE sha256 IN ({','.join('?' * len(batch))})", batch)
+            for sha256, other, other_imphash, cluster in rows:
+                score = estimate(signature, other)
+                threshold = self.imphash_threshold if imphash and imphash == other_imphash else self.threshold
+                if score >= threshold:
+                    result.append((score, sha256, cluster))
+        result.sort(reverse=True)
+        return result
+
+    def cluster_size(self, cluster):
+        return self.db.query("SELECT COUNT(*) FROM similarity WHERE cluster = ?", (cluster,))[0][0]
+
+    def check(self, signature, imphash, exclude=None):
+        """
+        回傳 (cluster, 群集目前的變體數, 最高相似度)；沒有相似的樣本時回傳 (None, 0, 0.0)。
+        """
+        found = self.neighbours(signature, imphash, exclude)
+        if not found:
+            return None, 0, 0.0
+        score, _, cluster = found[0]
+        return cluster, self.cluster_size(cluster), score
+
+    def over_cap(self, variants):
+        return bool(self.max_variants) and variants >= self.max_variants
+
+    def record(self, sha256, signature, imphash):
+        """
+        加入索引：歸入最相似樣本的群集，沒有相似樣本時自成一個群集 (以自己的 sha256 為名)。回傳群集。
+        """
+        cluster, _, _ = self.check(signature, imphash, exclude=sha256)
+        cluster = cluster or sha256
+        self.remove(sha256)
+        self.db.execute(
+            "INSERT INTO similarity (sha256, imphash, minhash, cluster, indexed_at) VALUES (?, ?, ?, ?, ?)",
+            (sha256, imphash, signature, cluster, time.time()))
+        for band, bucket in self.buckets(signature):
+            self.db.execute("INSERT OR IGNORE INTO similarity_lsh (band, bucket, sha256) VALUES (?, ?, ?)",
+                            (band, bucket, sha256))
+        return cluster
+
+    def remove(self, sha256):
+        self.db.execute("DELETE FROM similarity WHERE sha256 = ?", (sha256,))
+        self.db.execute("DELETE FROM similarity_lsh WHERE sha256 = ?", (sha256,))
+
+    def indexed(self):
+        return {row[0] for row in self.db.query("SELECT sha256 FROM similarity")}
+
+    def clusters(self, min_size=2):
+        """
+        變體數至少 min_size 的群集：[(cluster, 變體數)]，由大到小排序。
+        """
+        return self.db.query(
+            "SELECT cluster, COUNT(*) FROM similarity GROUP BY cluster HAVING COUNT(*) >= ? "
+            "ORDER BY COUNT(*) DESC, cluster", (min_size,))
+
+    def members(self, cluster):
+        """
+        群集中的樣本，依加入索引的先後排序。
+        """
+        return [row[0] for row in self.db.query(
+            "SELECT sha256 FROM similarity WHERE cluster = ? ORDER BY indexed_at, sha256", (cluster,))]
+
+    def reindex(self):
+        """
+        以存下來的簽名重建 LSH bucket (修改 BANDS 之後使用)。
+        """
+        self.db.execute("DELETE FROM similarity_lsh")
+        rows = self.db.query("SELECT sha256, minhash FROM similarity")
+        for sha256, signature in rows:
+            for band, bucket in self.buckets(signature):
+                self.db.execute("INSERT OR IGNORE INTO similarity_lsh (band, bucket, sha256) VALUES (?, ?, ?)",
+                                (band, bucket, sha256))
+        self.db.commit()
+        return len(rows)
+
+
+_default_index = None
+
+
+def get_similarity(db):
+    global _default_index
+    if _default_index is None:
+        _default_index = SimilarityIndex(db)
+    return _default_index
+
+
+def delete_sample(db, sha256):
+    """
+    從樣本庫移除一個樣本 (散檔或分片成員)，同時更新 stats manifest、分類索引與相似度索引。
+    """
+    from fingerprint import get_index
+    from sample_store import get_store
+    from shard_store import get_shards
+    from stats_manifest import get_stats
+
+    stats = get_stats(db)
+    for (path,) in db.query("SELECT DISTINCT path FROM files WHERE sha256 = ? AND path IS NOT NULL", (sha256,)):
+        stats.remove(path)
+    shards = get_shards(db)
+    if shards.contains(sha256):
+        shards.delete(sha256)
+    store = get_store(db)
+    path = store.object_path(sha256)
+    if path.exists():
+        os.remove(path)
+        remove_empty_parents([path], store.root)
+    # stats manifest 依 fingerprints 查分類，所以分類紀錄要在扣除統計之後才刪
+    get_index(db).remove(sha256)
+    get_similarity(db).remove(sha256)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index samples for near-duplicate detection and report clusters.")
+    parser.add_argument("--reindex", action="store_true", help="rebuild the LSH buckets from the stored signatures")
+    parser.add_argument("--prune", action="store_true",
+                        help="delete the newest variants of clusters over MAX_VARIANTS")
+    parser.add_argument("--dry-run", action="store_true", help="with --prune, only list what would be deleted")
+    args = parser.parse_args()
+
+    from state_db import get_db
+    from feature_extractor import iter_store_samples
+
+    db = get_db()
+    index = get_similarity(db)
+    if args.reindex:
+        print(f"[*] Rebuilt LSH buckets for {index.reindex()} samples ({index.bands} bands).")
+
+    # 補齊還沒有索引的樣本 (例如在這個功能加入之前收集的檔案)
+    done = index.indexed()
+    pending = [(sha256, sample) for sha256, sample in iter_store_samples(db) if sha256 not in done]
+    if pending:
+        print(f"[*] Hashing {len(pending)} samples...")
+        samples = [sample for _, sample in pending]
+        with ProcessPoolExecutor(max_workers=os.cpu_count() or 2) as executor:
+            for (sha256, _), result in zip(pending, executor.map(similarity_file, samples, chunksize=8)):
+                if result is not None:
+                    index.record(sha256, *result)
+        db.commit()
+
+    clusters = index.clusters()
+    indexed = len(index.indexed())
+    over = [(cluster, size) for cluster, size in clusters if index.max_variants and size > index.max_variants]
+    print("\n=== Near-Duplicate Clusters ===")
+    print(f"  Indexed samples:     {indexed}")
+    print(f"  Clusters (2+):       {len(clusters)} holding {sum(size for _, size in clusters)} samples")
+    print(f"  Over the variant cap: {len(over)} (MAX_VARIANTS {index.max_variants or 'unlimited'})")
+    for cluster, size in clusters[:10]:
+        print(f"    {cluster[:16]}  {size:>5} variants")
+
+    if not args.prune or not index.max_variants:
+        return
+    print(f"\n=== Pruning clusters down to {index.max_variants} variants ===")
+    removed = 0
+    for cluster, _ in over:
+        for sha256 in index.members(cluster)[index.max_variants:]:
+            if args.dry_run:
+                print(f" [WOULD DELETE] Near-duplicate of {cluster[:16]}: {sha256}")
+            else:
+                print(f" [DELETE] Near-duplicate of {cluster[:16]}: {sha256}")
+                delete_sample(db, sha256)
+            removed += 1
+    db.commit()
+    print(f"{'Would delete' if args.dry_run else 'Deleted'}: {removed} samples")
+
+
+if __name__ == "__main__":
+    main()
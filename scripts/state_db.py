@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from metrics import get_metrics
+
+DB_PATH = Path("benign_pe/metadata/state.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    source TEXT NOT NULL,
+    url TEXT NOT NULL,
+    added_at REAL,
+    PRIMARY KEY (source, url)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cursors (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    updated_at REAL,
+    PRIMARY KEY (source, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT,
+    source TEXT,
+    origin_url TEXT,
+    path TEXT,
+    size INTEGER,
+    signed INTEGER,
+    scan_result TEXT,
+    added_at REAL
+);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256);
+CREATE INDEX IF NOT EXISTS files_path ON files(path);
+CREATE INDEX IF NOT EXISTS files_source ON files(source);
+"""
+
+
+class StateDB:
+    """
+    以單一 SQLite 資料庫 (WAL 模式) 保存下載紀錄、搜尋游標與檔案資訊。
+    寫入先累積在記憶體，滿 batch_size 筆或 batch_seconds 秒後才在一個短交易中一次寫入，
+    寫入鎖只在寫入批次的幾 ms 內持有，多個爬蟲行程可以同時寫入。
+    讀取前會先寫入尚未送出的批次，同一個行程一定讀得到自己剛寫入的資料。
+    """
+
+    def __init__(self, path=DB_PATH, batch_size=200, batch_seconds=5.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self._lock = threading.RLock()
+        self._pending = []
+        self._batch_started = None
+        self._timer = None
+
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self.ensure_schema(SCHEMA)
+
+    def ensure_schema(self, schema):
+        """
+        建立資料表 (其他模組也可用這個方法在同一個資料庫加上自己的資料表)。
+        """
+        with self._lock:
+            # executescript 會先自行 COMMIT，要先結束目前的批次，否則批次狀態會跟連線對不上
+            self.commit()
+            self.conn.executescript(schema)
+
+    def execute(self, sql, params=()):
+        """
+        排入一筆寫入 (不回傳 cursor)；實際寫入在 commit() 時進行。
+        """
+        with self._lock:
+            if self._batch_started is None:
+                self._start_batch()
+            self._pending.append((sql, params))
+            if len(self._pending) >= self.batch_size or time.time() - self._batch_started >= self.batch_seconds:
+                self.commit()
+
+    def _start_batch(self):
+        self._batch_started = time.time()
+        # 沒有後續寫入或讀取時，最多 batch_seconds 秒後也會寫入
+        self._timer = threading.Timer(self.batch_seconds, self._commit_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _commit_from_timer(self):
+        try:
+            self.commit()
+        except Exception as e:
+            print(f" [!] StateDB: background commit failed: {e}")
+
+    def query(self, sql, params=()):
+        with self._lock:
+            self.commit()
+            return self.conn.execute(sql, params).fetchall()
+
+    def commit(self):
+        """
+        在一個 BEGIN IMMEDIATE 交易中寫入目前的批次。
+        批次中的寫入來自不同的呼叫端，錯誤不會丟給剛好觸發寫入的呼叫端：
+        取不到寫入鎖 (其他行程寫入超過 busy_timeout) 時整批放回佇列，下次再寫入；
+        個別語句失敗時只有該筆不生效，記錄錯誤與 SQL 後其餘照常寫入。
+        """
+        with self._lock:
+            if self._batch_started is None:
+                return
+            self._timer.cancel()
+            pending, self._pending = self._pending, []
+            self._batch_started = None
+            with get_metrics().timer("db_commit_seconds"):
+                try:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError as e:
+                    print(f" [!] StateDB: database is busy ({e}), keeping {len(pending)} writes for the next commit.")
+                    self._pending = pending + self._pending
+                    self._start_batch()
+                    return
+                try:
+                    for sql, params in pending:
+                        try:
+                            self.conn.execute(sql, params)
+                        except sqlite3.DatabaseError as e:
+                            print(f" [!] StateDB: write failed ({e}): {sql}")
+                            get_metrics().inc("db_write_errors_total")
+                    self.conn.execute("COMMIT")
+                except BaseException:
+                    self.conn.execute("ROLLBACK")
+                    raise
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- 下載紀錄 ---
+
+    def seen(self, source, url):
+        return bool(self.query("SELECT 1 FROM history WHERE source = ? AND url = ?", (source, url)))
+
+    def add_history(self, source, url):
+        self.execute("INSERT OR IGNORE INTO history (source, url, added_at) VALUES (?, ?, ?)",
+                    (source, url, time.time()))
+
+    # --- 搜尋游標 ---
+
+    def get_cursor(self, source, key, default=None):
+        rows = self.query("SELECT value FROM cursors WHERE source = ? AND key = ?", (source, key))
+        if not rows:
+            return default
+        return json.loads(rows[0][0])
+
+    def set_cursor(self, source, key, value):
+        self.execute("INSERT OR REPLACE INTO cursors (source, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                    (source, key, json.dumps(value), time.time()))
+
+    def get_cursors(self, source):
+        rows = self.query("SELECT key, value FROM cursors WHERE source = ?", (source,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def reset_history(self, source=None):
+        """
+        清除下載紀錄與搜尋游標 (只限 source，或全部來源)，下一輪會從頭探索。
+        檔案紀錄、分類與相似度索引等其他資料表不受影響。回傳 (history 筆數, cursors 筆數)。
+        """
+        where, params = ("WHERE source = ?", (source,)) if source else ("", ())
+        with self._lock:
+            history = self.query(f"SELECT COUNT(*) FROM history {where}", params)[0][0]
+            cursors = self.query(f"SELECT COUNT(*) FROM cursors {where}", params)[0][0]
+            self.execute(f"DELETE FROM history {where}", params)
+            self.execute(f"DELETE FROM cursors {where}", params)
+            self.commit()
+        return history, cursors
+
+    # --- 檔案紀錄 ---
+
+    def record_file(self, sha256, source, origin_url, path, size, signed, scan_result):
+        self.execute(
+            "INSERT INTO files (sha256, source, origin_url, path, size, signed, scan_result, added_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (sha256, source, origin_url, str(path) if path else None, size,
+             None if signed is None else int(bool(signed)), scan_result, time.time()))
+
+    def has_sha256(self, sha256):
+        return bool(self.query("SELECT 1 FROM files WHERE sha256 = ? LIMIT 1", (sha256,)))
+
+    # --- 舊版 JSON 檔案轉移 ---
+
+    def import_legacy_history(self, source, json_path):
+        """
+        將舊版 history_*.json 匯入資料庫，完成後改名為 .migrated 避免重複匯入。
+        """
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0
+        try:
+            with open(json_path, "r") as f:
+                urls = json.load(f)
+        except Exception as e:
+            print(f"Error loading legacy history {json_path}: {e}")
+            return 0
+        for url in urls:
+            self.add_history(source, url)
+        self.commit()
+        os.replace(json_path, str(json_path) + ".migrated")
+        print(f"[*] Migrated {len(urls)} history entries from {json_path}")
+        return len(urls)
+
+    def import_legacy_state(self, json_path):
+        """
+        將舊版 discovery_state.json ({source: {key: value}}) 匯入 cursors 資料表。
+        """
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return
+        try:
+            with open(json_path, "r") as f:
+                state = json.load(f)
+        except Exception:
+            return
+        for source, cursors in state.items():
+            for key, value in cursors.items():
+                self.set_cursor(source, key, value)
+        self.commit()
+        os.replace(json_path, str(json_path) + ".migrated")
+
+
+_default_db = None
+
+
+def get_db():
+    """
+    取得這個行程共用的 StateDB，並自動匯入舊版 JSON 紀錄。
+    """
+    global _default_db
+    if _default_db is None:
+        _default_db = StateDB()
+        metadata_dir = DB_PATH.parent
+        for source in ["github", "choco", "portable"]:
+            _default_db.import_legacy_history(source, metadata_dir / f"history_{source}.json")
+        _default_db.import_legacy_state(metadata_dir / "discovery_state.json")
+        import atexit
+        atexit.register(_default_db.commit)
+    return _default_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the crawler state DB.")
+    parser.add_argument("--reset-history", action="store_true",
+                        help="clear download history and discovery cursors (sample records are kept)")
+    parser.add_argument("--source", help="with --reset-history, only reset this source")
+    args = parser.parse_args()
+
+    if not args.reset_history:
+        parser.print_help()
+        return
+    history, cursors = get_db().reset_history(args.source)
+    print(f"[*] Cleared {history} history entries and {cursors} cursors ({args.source or 'all sources'}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import os
+import time
+from pathlib import Path
+
+import yaml
+
+from fingerprint import FINGERPRINT_SCHEMA
+
+BASE_DIR = Path("benign_pe")
+
+# 樣本庫出現之前各來源的下載資料夾 (重建統計時一併計入)
+LEGACY_DIRS = {
+    "github": "github_release",
+    "choco": "chocolatey",
+    "portable": "portableapps",
+}
+
+UNKNOWN = "unknown"
+TOTAL = "all"
+DEFAULT_GOAL = 100000
+
+# 大小直方圖的上界 (bytes)，最後一個桶沒有上界
+SIZE_BUCKETS = [
+    ("<64KB", 64 * 1024),
+    ("<256KB", 256 * 1024),
+    ("<1MB", 1024 * 1024),
+    ("<4MB", 4 * 1024 * 1024),
+    ("<16MB", 16 * 1024 * 1024),
+    ("<64MB", 64 * 1024 * 1024),
+    ("<256MB", 256 * 1024 * 1024),
+    (">=256MB", None),
+]
+
+# 報表依這個順序列出各維度
+DIMENSIONS = ["source", "category", "size"]
+
+STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    files INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    signed INTEGER NOT NULL DEFAULT 0,
+    unsigned INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    PRIMARY KEY (dimension, key)
+) WITHOUT ROWID;
+"""
+
+
+def load_settings():
+    try:
+        with open("config.yaml", "r") as f:
+            return (yaml.safe_load(f) or {}).get("STATS_SETTINGS", {}) or {}
+    except Exception:
+        return {}
+
+
+def size_bucket(size):
+    for name, limit in SIZE_BUCKETS:
+        if limit is None or (size or 0) < limit:
+            return name
+
+
+def format_bytes(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class StatsManifest:
+    """
+    樣本庫的統計 (各來源 / 分類 / 大小桶的檔案數、容量、有無簽章)，存在 state DB 的 stats 資料表。
+    收集管線存入樣本、sanitizer 刪除樣本時就地加減，跟 files 資料表在同一個批次 commit，
+    報表只需要讀這幾十列，不必掃描整個 benign_pe/。
+    """
+
+    def __init__(self, db):
+        self.db = db
+        db.ensure_schema(STATS_SCHEMA)
+        db.ensure_schema(FINGERPRINT_SCHEMA)
+
+    def _apply(self, source, category, size, signed, sign):
+        size = size or 0
+        now = time.time()
+        for dimension, key in [("total", TOTAL), ("source", source or UNKNOWN),
+                               ("category", category or UNKNOWN), ("size", size_bucket(size))]:
+            self.db.execute(
+                "INSERT INTO stats (dimension, key, files, bytes, signed, unsigned, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (dimension, key) DO UPDATE SET "
+                "files = files + excluded.files, bytes = bytes + excluded.bytes, "
+                "signed = signed + excluded.signed, unsigned = unsigned + excluded.unsigned, "
+                "updated_at = excluded.updated_at",
+                (dimension, key, sign, sign * size, sign * int(signed is True), sign * int(signed is False), now))
+
+    def add(self, source, category, size, signed):
+        """
+        新的樣本存入樣本庫 (signed 為 None 表示未知)。
+        """
+        self._apply(source, category, size, signed, 1)
+
+    def remove(self, path, size=None, signed=None):
+        """
+        樣本被刪除：從 files 資料表找回來源、分類與大小後扣除，並清掉該筆紀錄的路徑。
+        舊版來源資料夾中的檔案沒有紀錄，改以資料夾判斷來源，大小與簽章由呼叫端提供。
+        """
+        rows = self.db.query(
+            "SELECT f.source, f.size, f.signed, fp.category FROM files f "
+            "LEFT JOIN fingerprints fp ON fp.sha256 = f.sha256 "
+            "WHERE f.path = ? AND f.scan_result = 'clean' LIMIT 1", (str(path),))
+        if rows:
+            source, recorded_size, recorded_signed, category = rows[0]
+            self._apply(source, category, recorded_size, None if recorded_signed is None else bool(recorded_signed), -1)
+            self.db.execute("UPDATE files SET path = NULL WHERE path = ?", (str(path),))
+            return
+
+        parts = Path(path).parts
+        legacy = {dirname: source for source, dirname in LEGACY_DIRS.items()}
+        if len(parts) > 1 and parts[1] in legacy:
+            self._apply(legacy[parts[1]], None, size, signed, -1)
+
+    def rebuild(self, base_dir=BASE_DIR):
+        """
+        由 files / fingerprints 資料表重新計算所有統計 (第一次使用，或統計跟實際檔案對不上時)。
+        舊版來源資料夾沒有資料庫紀錄，只有這裡會掃描這些資料夾。
+        """
+        totals = {}
+
+        def count(source, category, size, signed):
+            size = size or 0
+            for key in [("total", TOTAL), ("source", source or UNKNOWN),
+                        ("category", category or UNKNOWN), ("size", size_bucket(size))]:
+                entry = totals.setdefault(key, [0, 0, 0, 0])
+                entry[0] += 1
+                entry[1] += size
+                entry[2] += int(signed is True)
+                entry[3] += int(signed is False)
+
+        # 同一個 SHA256 只算一次 (樣本庫只存一份)
+        rows = self.db.query(
+            "SELECT f.source, f.size, f.signed, fp.category FROM files f "
+            "LEFT JOIN fingerprints fp ON fp.sha256 = f.sha256 "
+            "WHERE f.scan_result = 'clean' AND f.path IS NOT NULL GROUP BY f.sha256")
+        for source, size, signed, category in rows:
+            count(source, category, size, None if signed is None else bool(signed))
+
+        for source, dirname in LEGACY_DIRS.items():
+            for root, _, files in os.walk(Path(base_dir) / dirname):
+                for name in files:
+                    try:
+                        count(source, None, os.path.getsize(os.path.join(root, name)), None)
+                    except OSError:
+                        pass
+
+        now = time.time()
+        self.db.execute("DELETE FROM stats")
+        for (dimension, key), (files, size, signed, unsigned) in totals.items():
+            self.db.execute(
+                "INSERT INTO stats (dimension, key, files, bytes, signed, unsigned, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (dimension, key, files, size, signed, unsigned, now))
+        self.db.commit()
+        return totals.get(("total", TOTAL), [0])[0]
+
+    def snapshot(self):
+        """
+        回傳 {dimension: {key: {"files", "bytes", "signed", "unsigned", "updated_at"}}}。
+        """
+        result = {}
+        for dimension, key, files, size, signed, unsigned, updated_at in self.db.query(
+                "SELECT dimension, key, files, bytes, signed, unsigned, updated_at FROM stats"):
+            result.setdefault(dimension, {})[key] = {
+                "files": files, "bytes": size, "signed": signed, "unsigned": unsigned, "updated_at": updated_at}
+        return result
+
+
+_default_stats = None
+
+
+def get_stats(db):
+    global _default_stats
+    if _default_stats is None:
+        _default_stats = StatsManifest(db)
+    return _default_stats
+
+
+def signed_ratio(entry):
+    known = entry["signed"] + entry["unsigned"]
+    return f"{entry['signed'] / known:6.1%} signed" if known else "   n/a signed"
+
+
+def print_report(snapshot, goal):
+    print("=== PE Collection Progress Report ===")
+    print(f"Date: {time.ctime()}")
+
+    size_order = [name for name, _ in SIZE_BUCKETS]
+    for dimension in DIMENSIONS:
+        entries = snapshot.get(dimension, {})
+        if not entries:
+            continue
+        print(f"\nBy {dimension}:")
+        if dimension == "size":
+            keys = [key for key in size_order if key in entries]
+        else:
+            keys = sorted(entries, key=lambda key: -entries[key]["files"])
+        for key in keys:
+            entry = entries[key]
+            print(f"  {key:<12} {entry['files']:>8} files  {format_bytes(entry['bytes']):>10}  {signed_ratio(entry)}")
+
+    total = snapshot.get("total", {}).get(TOTAL, {"files": 0, "bytes": 0, "signed": 0, "unsigned": 0,
+                                                   "updated_at": None})
+    print("--------------------------------")
+    print(f"Total Benign PE: {total['files']} files ({format_bytes(total['bytes'])})")
+    unknown = total["files"] - total["signed"] - total["unsigned"]
+    print(f"Signed:          {total['signed']} signed / {total['unsigned']} unsigned / {unknown} unknown")
+    print(f"Goal Progress:   {total['files'] * 100 / goal:.2f}% ({total['files']} / {goal})")
+    if total["updated_at"]:
+        print(f"Last update:     {time.ctime(total['updated_at'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print collection progress from the stats manifest.")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute the stats from the state DB (and legacy source folders)")
+    args = parser.parse_args()
+
+    from state_db import get_db
+    db = get_db()
+    stats = get_stats(db)
+    snapshot = stats.snapshot()
+    if args.rebuild or not snapshot:
+        print("[*] Rebuilding stats manifest from the state DB...")
+        print(f"[*] {stats.rebuild()} files counted.\n")
+        snapshot = stats.snapshot()
+    print_report(snapshot, load_settings().get("GOAL", DEFAULT_GOAL))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# scripts/ 底下是扁平的模組 (以 python scripts/xxx.py 執行)，測試時同樣加入 sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """
+    每個測試在空的暫存目錄中執行：不會讀到專案的 config.yaml (一律使用預設值)，也不會寫入 benign_pe/。
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
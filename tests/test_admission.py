@@ -0,0 +1,137 @@
+import threading
+from collections import namedtuple
+
+import pytest
+
+import admission
+from admission import MB, UNKNOWN, AdmissionControl
+
+Usage = namedtuple("Usage", "total used free")
+
+SETTINGS = {
+    "BUCKETS": [
+        {"NAME": "small", "MAX_MB": 10, "QUOTA": 0},
+        {"NAME": "large", "MAX_MB": 100, "QUOTA": 2},
+        {"NAME": "huge", "MAX_MB": None, "QUOTA": 1},
+    ],
+    "UNKNOWN_QUOTA": 3,
+    "MAX_DOWNLOAD_MB": 500,
+}
+
+
+@pytest.fixture
+def disk(monkeypatch):
+    """
+    假的磁碟：總共 1000 MB，used 可以在測試中調整。
+    """
+    usage = {"total": 1000 * MB, "used": 100 * MB}
+    monkeypatch.setattr(admission.shutil, "disk_usage",
+                        lambda path: Usage(usage["total"], usage["used"], usage["total"] - usage["used"]))
+    return usage
+
+
+@pytest.fixture
+def control(disk):
+    return AdmissionControl(SETTINGS, threshold=0.9)
+
+
+@pytest.mark.parametrize("size, bucket", [
+    (0, "small"),
+    (10 * MB, "small"),
+    (10 * MB + 1, "large"),
+    (100 * MB, "large"),
+    (400 * MB, "huge"),
+    (None, UNKNOWN),
+])
+def test_bucket_for(control, size, bucket):
+    assert control.bucket_for(size)[0] == bucket
+
+
+def test_bucket_quota(control):
+    assert control.admit(50 * MB) == (True, "large")
+    assert control.admit(60 * MB) == (True, "large")
+    allowed, reason = control.admit(70 * MB)
+    assert not allowed and "bucket 'large' is full" in reason
+    # 其他桶不受影響，QUOTA 0 表示不限
+    for _ in range(5):
+        assert control.admit(1 * MB) == (True, "small")
+    assert control.counts == {"large": 2, "small": 5}
+    assert control.summary() == "large: 2, small: 5"
+
+
+def test_rejected_downloads_do_not_use_quota(control, disk):
+    disk["used"] = 890 * MB
+    assert not control.admit(50 * MB)[0]
+    disk["used"] = 100 * MB
+    assert control.admit(50 * MB)[0]
+    assert control.counts == {"large": 1}
+
+
+def test_unknown_size_has_its_own_quota(control):
+    for _ in range(3):
+        assert control.admit(None) == (True, UNKNOWN)
+    assert not control.admit(None)[0]
+    assert control.reserved == 0
+
+
+def test_larger_than_max_download(control):
+    allowed, reason = control.admit(501 * MB)
+    assert not allowed and "MAX_DOWNLOAD_MB" in reason
+    assert control.counts == {}
+
+
+def test_disk_budget_counts_in_flight_downloads(control, disk):
+    # 門檻是 900 MB，已使用 100 MB
+    assert control.admit(90 * MB)[0]
+    assert control.admit(9 * MB)[0]
+    assert control.reserved == 99 * MB
+    disk["used"] = 800 * MB
+    allowed, reason = control.admit(5 * MB)
+    assert not allowed and "disk budget exceeded" in reason
+    # 下載結束釋放保留的空間後就能繼續
+    control.release(90 * MB)
+    assert control.reserved == 9 * MB
+    assert control.admit(5 * MB)[0]
+
+
+def test_budget_is_rechecked_before_each_download(control, disk):
+    assert control.admit(5 * MB)[0]
+    control.release(5 * MB)
+    disk["used"] = 899 * MB
+    assert not control.admit(5 * MB)[0]
+
+
+def test_release_never_goes_negative(control):
+    control.admit(5 * MB)
+    control.release(5 * MB)
+    control.release(5 * MB)
+    control.release(None)
+    assert control.reserved == 0
+
+
+def test_concurrent_admits_respect_budget(control, disk):
+    # 同時進行的下載：保留的空間加總不會超過門檻
+    results = []
+    lock = threading.Lock()
+
+    def admit():
+        allowed, _ = control.admit(9 * MB)
+        with lock:
+            results.append(allowed)
+
+    threads = [threading.Thread(target=admit) for _ in range(200)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # (900 - 100) / 9 = 88.9，最多 88 個
+    assert results.count(True) == 88
+    assert control.reserved == 88 * 9 * MB
+
+
+def test_default_buckets(disk):
+    control = AdmissionControl({}, threshold=0.9)
+    assert control.bucket_for(512 * 1024)[0] == "tiny"
+    assert control.bucket_for(300 * MB) == ("huge", 5)
+    assert control.max_size is None
+    assert control.admit(300 * MB) == (True, "huge")
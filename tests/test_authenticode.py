@@ -0,0 +1,131 @@
+import struct
+
+import pytest
+
+from authenticode import ASN1Error, get_signature_info, matches_vendor, parse_pkcs7
+from fixture_server import build_pe
+
+
+# --- 最小的 DER 編碼器，只用來組出測試用的 PKCS#7 ---
+
+def der(tag, content):
+    if len(content) < 0x80:
+        length = bytes([len(content)])
+    else:
+        raw = len(content).to_bytes((len(content).bit_length() + 7) // 8, "big")
+        length = bytes([0x80 | len(raw)]) + raw
+    return bytes([tag]) + length + content
+
+
+def seq(*items):
+    return der(0x30, b"".join(items))
+
+
+def oid(dotted):
+    parts = [int(p) for p in dotted.split(".")]
+    out = bytearray([40 * parts[0] + parts[1]])
+    for value in parts[2:]:
+        chunk = [value & 0x7F]
+        value >>= 7
+        while value:
+            chunk.append(0x80 | (value & 0x7F))
+            value >>= 7
+        out += bytes(reversed(chunk))
+    return der(0x06, bytes(out))
+
+
+def name(**attrs):
+    oids = {"CN": "2.5.4.3", "O": "2.5.4.10", "C": "2.5.4.6"}
+    return seq(*(der(0x31, seq(oid(oids[key]), der(0x0C, value.encode()))) for key, value in attrs.items()))
+
+
+def certificate(serial, issuer, subject):
+    tbs = seq(der(0xA0, der(0x02, b"\x02")), der(0x02, serial), seq(oid("1.2.840.113549.1.1.11")),
+              issuer, seq(), subject, seq())
+    return seq(tbs, seq(oid("1.2.840.113549.1.1.11")), der(0x03, b"\x00" + bytes(64)))
+
+
+def signed_data(certs, issuer, serial, digest="2.16.840.1.101.3.4.2.1"):
+    signer = seq(der(0x02, b"\x01"), seq(issuer, der(0x02, serial)), seq(oid(digest), der(0x05, b"")))
+    content = seq(der(0x02, b"\x01"), der(0x31, seq(oid(digest))), seq(oid("1.3.6.1.4.1.311.2.1.4")),
+                  der(0xA0, b"".join(certs)), der(0x31, signer))
+    return seq(oid("1.2.840.113549.1.7.2"), der(0xA0, content))
+
+
+def sign_pe(pe, blob, cert_type=2):
+    """
+    把 WIN_CERTIFICATE 接在檔案結尾，並設定 Security Directory (VirtualAddress 是檔案偏移)。
+    """
+    cert = struct.pack("<IHH", 8 + len(blob), 0x0200, cert_type) + blob
+    cert += bytes(-len(cert) % 8)
+    data = bytearray(pe)
+    e_lfanew = struct.unpack_from("<I", data, 0x3C)[0]
+    security = e_lfanew + 24 + 96 + 4 * 8
+    struct.pack_into("<II", data, security, len(pe), len(cert))
+    return bytes(data) + cert
+
+
+CA = name(CN="Test Root CA", O="Test PKI")
+VENDOR = name(CN="Contoso Ltd", O="Contoso", C="US")
+
+
+def test_parse_pkcs7_finds_signer_certificate():
+    blob = signed_data([certificate(b"\x07", CA, CA), certificate(b"\x01\x23", CA, VENDOR)], CA, b"\x01\x23")
+    info = parse_pkcs7(blob)
+    assert info["subject"] == "CN=Contoso Ltd, O=Contoso, C=US"
+    assert info["issuer"] == "CN=Test Root CA, O=Test PKI"
+    assert info["serial"] == "0123"
+    assert info["digest_algorithm"] == "sha256"
+    assert info["signer"] == "Contoso Ltd"
+
+
+def test_parse_pkcs7_signer_without_matching_certificate():
+    blob = signed_data([certificate(b"\x07", CA, CA)], CA, b"\x99", digest="1.3.14.3.2.26")
+    info = parse_pkcs7(blob)
+    assert info["subject"] is None
+    assert info["signer"] is None
+    assert info["digest_algorithm"] == "sha1"
+
+
+def test_parse_pkcs7_long_form_lengths():
+    # 超過 127 / 255 位元組的內容會用 0x81 / 0x82 長度編碼
+    long_name = name(CN="x" * 300, O="Contoso")
+    blob = signed_data([certificate(b"\x05", CA, long_name)], CA, b"\x05")
+    assert blob[1] == 0x82
+    assert parse_pkcs7(blob)["signer"] == "x" * 300
+
+
+def test_parse_pkcs7_rejects_other_content_types():
+    with pytest.raises(ASN1Error):
+        parse_pkcs7(seq(oid("1.2.840.113549.1.7.1"), der(0xA0, seq())))
+
+
+@pytest.mark.parametrize("cut", [1, 10, 60])
+def test_parse_pkcs7_truncated(cut):
+    blob = signed_data([certificate(b"\x01", CA, VENDOR)], CA, b"\x01")
+    with pytest.raises((ASN1Error, IndexError)):
+        parse_pkcs7(blob[:cut])
+
+
+def test_get_signature_info_on_signed_pe():
+    blob = signed_data([certificate(b"\x01", CA, VENDOR)], CA, b"\x01")
+    info = get_signature_info(data=sign_pe(build_pe(1, 4096), blob))
+    assert info["signed"] is True
+    assert info["signer"] == "Contoso Ltd"
+
+
+def test_get_signature_info_unsigned_and_unparsable():
+    pe = build_pe(2, 4096)
+    assert get_signature_info(data=pe) is None
+    # 有簽章但內容無法解析：仍視為已簽署
+    assert get_signature_info(data=sign_pe(pe, b"\x30\x82\xff\xff")) == {"signed": True}
+    # 不是 PKCS#7 SignedData 類型的 WIN_CERTIFICATE
+    assert get_signature_info(data=sign_pe(pe, b"x" * 16, cert_type=1)) is None
+    assert get_signature_info(data=b"not a pe") is None
+
+
+def test_matches_vendor():
+    info = {"subject": "CN=Contoso Ltd, O=Contoso, C=US"}
+    assert matches_vendor(info, ["contoso"])
+    assert not matches_vendor(info, ["Fabrikam"])
+    assert not matches_vendor(None, ["contoso"])
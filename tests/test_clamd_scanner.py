@@ -0,0 +1,137 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+import clamd_scanner
+from clamd_scanner import CLEAN, ERROR, INFECTED, ClamdScanner
+
+EICAR_REPLY = b"stream: Win.Test.EICAR_HDB-1 FOUND\0"
+
+
+class FakeClamd:
+    """
+    假的 clamd：在本機 TCP 連接埠上依 INSTREAM 協定讀取每個 4 位元組長度 (big-endian) 的區塊，
+    直到長度 0 為止，再送出 reply。
+    """
+
+    def __init__(self, reply=b"stream: OK\0"):
+        self.reply = reply
+        self.commands = []
+        self.streams = []
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _read_exact(self, conn, n):
+        data = b""
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the stream early")
+            data += chunk
+        return data
+
+    def _read_command(self, conn):
+        data = b""
+        while not data.endswith(b"\0"):
+            data += self._read_exact(conn, 1)
+        return data
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with conn:
+                command = self._read_command(conn)
+                self.commands.append(command)
+                if command == b"zINSTREAM\0":
+                    chunks = []
+                    while True:
+                        (length,) = struct.unpack("!L", self._read_exact(conn, 4))
+                        if not length:
+                            break
+                        chunks.append(self._read_exact(conn, length))
+                    self.streams.append(chunks)
+                    conn.sendall(self.reply)
+                elif command == b"zPING\0":
+                    conn.sendall(b"PONG\0")
+                elif command == b"zVERSION\0":
+                    conn.sendall(b"ClamAV 1.0.3/27100/Mon Oct 16 08:00:00 2026\0")
+
+    def close(self):
+        try:
+            # 喚醒還在 accept() 的執行緒
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+
+
+@pytest.fixture
+def clamd():
+    clamd = FakeClamd()
+    yield clamd
+    clamd.close()
+
+
+def scanner_for(clamd):
+    return ClamdScanner(host="127.0.0.1", port=clamd.port, timeout=5)
+
+
+def test_instream_framing(clamd, monkeypatch):
+    monkeypatch.setattr(clamd_scanner, "CHUNK_SIZE", 4096)
+    data = bytes(range(256)) * 40
+    assert scanner_for(clamd).scan_bytes(data) == (CLEAN, "")
+    assert clamd.commands == [b"zINSTREAM\0"]
+    chunks = clamd.streams[0]
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 2048]
+    assert b"".join(chunks) == data
+
+
+def test_empty_stream_sends_only_the_terminator(clamd):
+    assert scanner_for(clamd).scan_bytes(b"") == (CLEAN, "")
+    assert clamd.streams == [[]]
+
+
+def test_found_reply_returns_the_signature(clamd, tmp_path):
+    clamd.reply = EICAR_REPLY
+    path = tmp_path / "eicar.com"
+    path.write_bytes(b"X5O!P%@AP")
+    assert scanner_for(clamd).scan_file(path) == (INFECTED, "Win.Test.EICAR_HDB-1")
+    assert clamd.streams == [[b"X5O!P%@AP"]]
+
+
+def test_error_reply(clamd):
+    clamd.reply = b"INSTREAM size limit exceeded. ERROR\0"
+    assert scanner_for(clamd).scan_bytes(b"data") == (ERROR, "INSTREAM size limit exceeded. ERROR")
+
+
+def test_ping_and_version(clamd):
+    scanner = scanner_for(clamd)
+    assert scanner.ping()
+    assert scanner.version() == "ClamAV 1.0.3/27100/Mon Oct 16 08:00:00 2026"
+    assert clamd.commands == [b"zPING\0", b"zVERSION\0"]
+
+
+def test_unreachable_clamd(clamd):
+    clamd.close()
+    scanner = scanner_for(clamd)
+    assert not scanner.ping()
+    verdict, _ = scanner.scan_bytes(b"data")
+    assert verdict == ERROR
+
+
+def test_missing_file_is_an_error(clamd, tmp_path):
+    verdict, _ = scanner_for(clamd).scan_file(tmp_path / "missing.exe")
+    assert verdict == ERROR
+    assert clamd.commands == []
+
+
+def test_db_version_from_clamd(clamd, monkeypatch):
+    monkeypatch.setattr(clamd_scanner, "get_default_scanner", lambda: scanner_for(clamd))
+    assert clamd_scanner.get_clamav_db_version() == "27100/Mon Oct 16 08:00:00 2026"
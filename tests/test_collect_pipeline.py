@@ -0,0 +1,97 @@
+import struct
+
+import pytest
+
+import fingerprint
+import similarity
+import stats_manifest
+from collect_pipeline import FILE, Candidate, CollectPipeline, FetchJob
+from fixture_server import build_pe
+from pe_sniff import OK
+from pipeline import shutdown_process_pools
+from sample_store import DUPLICATE, NEAR_DUPLICATE, NEW, SampleStore
+from state_db import StateDB
+
+pytest.importorskip("numpy")
+
+TIMESTAMP = 0x80 + 8
+
+
+@pytest.fixture
+def collector(tmp_path, monkeypatch):
+    # 索引與統計是每個行程一份的 singleton，每個測試改用自己的 state DB
+    for module, name in ((fingerprint, "_default_index"), (similarity, "_default_index"),
+                         (stats_manifest, "_default_stats")):
+        monkeypatch.setattr(module, name, None)
+    db = StateDB(tmp_path / "state.db")
+    collector = CollectPipeline(SampleStore(db), True, engine=object(),
+                                settings={"PROCESS_WORKERS": 1, "WORKERS": {"commit": 4}})
+    collector.similarity.max_variants = 3
+    yield collector
+    shutdown_process_pools()
+    db.close()
+
+
+def variant(stamp):
+    """
+    只有 TimeDateStamp 不同的重新編譯版本。
+    """
+    data = bytearray(build_pe(1, 16384))
+    struct.pack_into("<I", data, TIMESTAMP, stamp)
+    return bytes(data)
+
+
+def candidate(collector, job, name, data):
+    job.add_member()
+    return Candidate(job, name, collector.store.stage(iter([data])), OK)
+
+
+def collect(collector, c):
+    """
+    依序走過 validate → sign → commit (略過 scan)。
+    """
+    if collector._validate(c) and collector._sign(c):
+        collector._commit(c)
+
+
+def test_commit_stage_has_a_single_worker(collector):
+    assert collector.pipeline.stages[-1].name == "commit"
+    assert collector.pipeline.stages[-1].workers == 1
+
+
+def test_near_duplicates_beyond_the_cap_are_skipped(collector):
+    job = FetchJob("test", "https://example/a.zip", FILE)
+    for i in range(5):
+        collect(collector, candidate(collector, job, f"v{i}.exe", variant(1000 + i)))
+    assert sorted(job.results) == sorted([NEW] * 3 + [NEAR_DUPLICATE] * 2)
+    assert [size for _, size in collector.similarity.clusters()] == [3]
+
+
+def test_cap_is_enforced_when_variants_pass_sign_together(collector):
+    job = FetchJob("test", "https://example/a.zip", FILE)
+    candidates = [candidate(collector, job, f"v{i}.exe", variant(1000 + i)) for i in range(6)]
+    # 模擬多個 sign worker：所有變體都在任何一個存入之前通過 sign 階段的檢查
+    passed = [c for c in candidates if collector._validate(c) and collector._sign(c)]
+    assert len(passed) == 6
+    for c in passed:
+        collector._commit(c)
+    assert sorted(job.results) == sorted([NEW] * 3 + [NEAR_DUPLICATE] * 3)
+    assert [size for _, size in collector.similarity.clusters()] == [3]
+    stored = [c for c in passed if collector.store.contains(c.staged.sha256)]
+    assert len(stored) == 3
+
+
+def test_same_content_is_a_duplicate(collector):
+    job = FetchJob("test", "https://example/a.zip", FILE)
+    data = variant(1000)
+    collect(collector, candidate(collector, job, "a.exe", data))
+    collect(collector, candidate(collector, job, "copy/a.exe", data))
+    assert job.results == [NEW, DUPLICATE]
+    assert job.accepted
+
+
+def test_unrelated_samples_are_not_capped(collector):
+    job = FetchJob("test", "https://example/a.zip", FILE)
+    for seed in range(5):
+        collect(collector, candidate(collector, job, f"s{seed}.exe", build_pe(seed, 16384)))
+    assert job.results == [NEW] * 5
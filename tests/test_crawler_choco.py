@@ -0,0 +1,117 @@
+import datetime
+
+import pytest
+
+import crawler_choco
+from fingerprint import DOTNET, FingerprintIndex
+from state_db import StateDB
+
+CURSOR = "2026-01-01T00:00:00Z"
+NEW_CURSOR = datetime.datetime(2026, 1, 2)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = StateDB(tmp_path / "state.db")
+    yield db
+    db.close()
+
+
+def package(name, category=None):
+    return {"id": name, "version": "1.0.0", "url": f"https://example/{name}", "size": 1, "category": category}
+
+
+def ids(packages):
+    return [pkg["id"] for pkg in packages]
+
+
+@pytest.fixture
+def catalog(db, monkeypatch):
+    """
+    以假的 catalog 結果執行 get_catalog_mode_packages；回傳的 run(found, deferred, over_quota, limit)
+    會記下傳給 get_catalog_packages 的名額與略過的分類。
+    """
+    calls = []
+
+    class Index:
+        def __init__(self, over_quota):
+            self._over_quota = over_quota
+
+        def over_quota(self):
+            return set(self._over_quota)
+
+    def run(found=(), deferred=(), over_quota=(), limit=3, **settings):
+        def get_catalog_packages(engine, cursor, max_packages, include_prerelease=False, skip_categories=()):
+            calls.append((max_packages, set(skip_categories)))
+            return list(found)[:max_packages], NEW_CURSOR, list(deferred)
+
+        monkeypatch.setattr(crawler_choco, "get_db", lambda: db)
+        monkeypatch.setattr(crawler_choco, "get_index", lambda _db: Index(over_quota))
+        monkeypatch.setattr(crawler_choco, "get_engine", lambda: None)
+        monkeypatch.setattr(crawler_choco, "get_catalog_packages", get_catalog_packages)
+        config = {"CHOCO_SETTINGS": {"MAX_PACKAGES_PER_RUN": limit, **settings}}
+        return crawler_choco.get_catalog_mode_packages(config)
+
+    run.calls = calls
+    db.set_cursor(crawler_choco.SOURCE, "catalog_commit", CURSOR)
+    return run
+
+
+def test_over_quota_packages_fill_spare_slots(catalog):
+    packages, cursor, deferred = catalog(found=[package("a")], deferred=[package("x", DOTNET), package("y", DOTNET),
+                                                                       package("z", DOTNET)],
+                                         over_quota={DOTNET})
+    assert ids(packages) == ["a", "x", "y"]
+    assert ids(deferred) == ["z"]
+    assert cursor == NEW_CURSOR
+    assert catalog.calls == [(3, {DOTNET})]
+
+
+def test_saved_packages_wait_while_over_quota(catalog, db):
+    db.set_cursor(crawler_choco.SOURCE, "catalog_deferred", [package("old", DOTNET)])
+    packages, _, deferred = catalog(found=[package("a"), package("b"), package("c")], over_quota={DOTNET})
+    assert ids(packages) == ["a", "b", "c"]
+    assert ids(deferred) == ["old"]
+
+
+def test_saved_packages_resume_first_when_quota_frees(catalog, db):
+    db.set_cursor(crawler_choco.SOURCE, "catalog_deferred",
+                  [package("old1", DOTNET), package("old2", DOTNET), package("old3", DOTNET), package("old4", DOTNET)])
+    packages, _, deferred = catalog(found=[package("a")], limit=2)
+    assert ids(packages) == ["old1", "old2"]
+    # 名額已被延後的套件用完，catalog 這一輪不取新套件
+    assert catalog.calls == [(0, set())]
+    assert ids(deferred) == ["old3", "old4"]
+
+
+def test_deferred_list_is_capped(catalog):
+    deferred = [package(f"d{i}", DOTNET) for i in range(10)]
+    _, _, kept = catalog(deferred=deferred, over_quota={DOTNET}, limit=1, MAX_DEFERRED=4)
+    # 保留最新的幾筆
+    assert ids(kept) == ["d6", "d7", "d8", "d9"]
+
+
+def test_catalog_error_keeps_cursor(catalog, monkeypatch, db):
+    def broken(*args, **kwargs):
+        raise RuntimeError("catalog down")
+
+    db.set_cursor(crawler_choco.SOURCE, "catalog_deferred", [package("old")])
+    catalog(limit=1)  # 套用其他 monkeypatch
+    monkeypatch.setattr(crawler_choco, "get_catalog_packages", broken)
+    packages, cursor, deferred = crawler_choco.get_catalog_mode_packages({"CHOCO_SETTINGS": {"MAX_PACKAGES_PER_RUN": 1}})
+    assert ids(packages) == ["old"]
+    assert cursor is None and deferred is None
+
+
+def test_fingerprint_quota_and_remove(db):
+    index = FingerprintIndex(db, {"QUOTAS": {DOTNET: 0.5}, "MIN_SAMPLES": 4})
+    for i in range(3):
+        index.record(f"dotnet{i}", DOTNET, [])
+    assert index.over_quota() == set()  # 樣本數不足 MIN_SAMPLES
+    index.record("other", "other", [])
+    assert index.over_quota() == {DOTNET}
+    index.remove("dotnet0")
+    index.remove("dotnet1")
+    assert index.lookup("dotnet0") is None
+    assert index.counts() == {DOTNET: 1, "other": 1}
+    assert index.over_quota() == set()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+
+import pytest
+
+from dataset_export import (BENIGN, DEFAULT_SPLITS, GREY, MALICIOUS, MANIFEST_NAME, feature_columns, label_of,
+                            load_vt_results, open_parts, read_parts, split_of, vectorize, write_manifest,
+                            write_part)
+from fixture_server import build_pe
+
+SPLITS = list(DEFAULT_SPLITS.items())
+
+
+def sha(i):
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+
+def test_split_is_deterministic():
+    assert [split_of(sha(i), SPLITS) for i in range(100)] == [split_of(sha(i), SPLITS) for i in range(100)]
+
+
+def test_split_ignores_case():
+    digest = sha(1)
+    assert split_of(digest, SPLITS) == split_of(digest.upper(), SPLITS)
+
+
+def test_split_ratios():
+    counts = {name: 0 for name, _ in SPLITS}
+    total = 20000
+    for i in range(total):
+        counts[split_of(sha(i), SPLITS)] += 1
+    for name, ratio in SPLITS:
+        assert abs(counts[name] / total - ratio) < 0.01
+
+
+def test_split_boundaries():
+    assert split_of("0" * 64, SPLITS) == "train"
+    assert split_of("f" * 64, SPLITS) == "test"
+    # 只看前 64 位元：0xcc… ≈ 0.80 是 train 與 val 的分界，0xe6… ≈ 0.90 是 val 與 test 的分界
+    assert split_of("cc00000000000000" + "f" * 48, SPLITS) == "train"
+    assert split_of("cd00000000000000" + "0" * 48, SPLITS) == "val"
+    assert split_of("e600000000000000" + "f" * 48, SPLITS) == "val"
+    assert split_of("e700000000000000" + "0" * 48, SPLITS) == "test"
+
+
+def test_split_ratios_below_one_fall_into_last_split():
+    assert split_of("f" * 64, [("train", 0.5), ("val", 0.2)]) == "val"
+
+
+@pytest.mark.parametrize("positives, expected", [
+    (None, BENIGN), (0, BENIGN), (1, GREY), (4, GREY), (5, MALICIOUS), (60, MALICIOUS),
+])
+def test_label_of(positives, expected):
+    assert label_of(positives, 5) == expected
+
+
+def test_load_vt_results(tmp_path):
+    path = tmp_path / "vt_result.jsonl"
+    lines = [
+        {"sha256": "AA" * 32, "positives": 3},
+        {"data": {"id": "bb" * 32, "attributes": {"last_analysis_stats": {"malicious": 7}}}},
+        {"id": "cc" * 32, "attributes": {"last_analysis_stats": {"harmless": 60}}},
+        {"sha256": "dd" * 32},
+    ]
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\nnot json\n[]\n", encoding="utf-8")
+    assert load_vt_results(path) == {"aa" * 32: 3, "bb" * 32: 7, "cc" * 32: 0}
+    assert load_vt_results(tmp_path / "missing.jsonl") == {}
+
+
+def test_vectorize(tmp_path):
+    np = pytest.importorskip("numpy")
+    data = build_pe(1, 4096)
+    path = tmp_path / "a.exe"
+    path.write_bytes(data)
+    sha256, vector, size = vectorize((sha(1), path), import_bins=16)
+    assert sha256 == sha(1) and size == len(data)
+    assert vector.dtype == np.float32
+    assert len(vector) == len(feature_columns(16))
+
+    path.write_bytes(b"MZ not a pe")
+    assert vectorize((sha(2), path), import_bins=16) is None
+
+
+def test_part_round_trip(tmp_path):
+    np = pytest.importorskip("numpy")
+    split_names = [name for name, _ in SPLITS]
+    vectors = [np.full(4, i, dtype=np.float32) for i in range(3)]
+    labels = [{"row": i, "sha256": sha(i), "label": (BENIGN, GREY, MALICIOUS)[i], "vt_positives": "",
+               "split": split_of(sha(i), SPLITS), "source": "github", "origin_url": "", "member_path": "",
+               "signed": "", "category": "", "size": 100} for i in range(3)]
+    write_part(tmp_path, "part-00001", vectors, labels, split_names)
+    write_manifest(tmp_path, {"columns": ["a", "b", "c", "d"]}, [("part-00001", 3)])
+
+    parts, done = read_parts(tmp_path)
+    assert parts == [("part-00001", 3)]
+    assert done == {sha(i) for i in range(3)}
+    assert not list(tmp_path.glob("*.tmp"))
+
+    [(name, X, y, split)] = list(open_parts(tmp_path))
+    assert name == "part-00001"
+    assert isinstance(X, np.memmap)
+    assert X.tolist() == [[i] * 4 for i in range(3)]
+    assert y.tolist() == [BENIGN, GREY, MALICIOUS]
+    assert [split_names[i] for i in split] == [row["split"] for row in labels]
+    assert json.loads((tmp_path / MANIFEST_NAME).read_text())["rows"] == 3
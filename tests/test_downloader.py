@@ -0,0 +1,23 @@
+import io
+import zipfile
+
+import pytest
+
+import downloader
+from downloader import open_spool
+
+
+@pytest.mark.parametrize("max_memory", [1 << 20, 1024])
+def test_zipfile_reads_from_spool(monkeypatch, max_memory):
+    # 小於上限時留在記憶體，超過時轉存到暫存檔；兩種情況 zipfile 都要能讀 (Python 3.10 需要 seekable())
+    monkeypatch.setattr(downloader, "get_spool_max_memory", lambda: max_memory)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("bin/tool.exe", b"MZ" + bytes(8190))
+
+    with open_spool() as spool:
+        spool.write(buffer.getvalue())
+        spool.seek(0)
+        assert spool.seekable() and spool.readable()
+        with zipfile.ZipFile(spool) as z:
+            assert z.read("bin/tool.exe")[:2] == b"MZ"
@@ -0,0 +1,150 @@
+import threading
+
+import pytest
+
+import fetch_engine
+from fetch_engine import FetchEngine, TokenBucket
+
+SETTINGS = {
+    "DEFAULT": {"WORKERS": 2, "RATE_PER_SEC": 1.0, "BURST": 2},
+    "HOSTS": {
+        "github.com": {"WORKERS": 4, "RATE_PER_SEC": 2.0, "BURST": 4},
+        "api.github.com": {"WORKERS": 1, "RATE_PER_SEC": 0},
+    },
+    "URL_OVERRIDES": {"https://github.com/": "http://127.0.0.1:8000/github/"},
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    假的 monotonic 時鐘：time.sleep 只會把時間往前推，並記下每次睡多久。
+    """
+    class Clock:
+        def __init__(self):
+            self.now = 100.0
+            self.sleeps = []
+
+        def monotonic(self):
+            return self.now
+
+        def sleep(self, seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(fetch_engine.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(fetch_engine.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def engine():
+    engine = FetchEngine(SETTINGS)
+    yield engine
+    engine.close()
+
+
+def test_bucket_allows_a_burst_then_waits(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [0.5]
+
+
+def test_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 10
+    # 最多只累積 capacity 個
+    for _ in range(2):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [1.0]
+
+
+def test_bucket_capacity_is_at_least_one(clock):
+    bucket = TokenBucket(rate=1.0, capacity=0)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [1.0]
+
+
+@pytest.mark.parametrize("rate", [0, -1])
+def test_bucket_without_rate_is_unlimited(clock, rate):
+    bucket = TokenBucket(rate=rate, capacity=1)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+def test_pool_per_host_settings(engine):
+    pool = engine.pool_for("https://github.com/owner/repo/releases")
+    assert pool.host == "github.com"
+    assert pool.executor._max_workers == 4
+    assert pool.bucket.rate == 2.0 and pool.bucket.capacity == 4
+    # 沒有設定的主機使用 DEFAULT
+    other = engine.pool_for("https://example.org/file.zip")
+    assert other.host == "example.org"
+    assert other.executor._max_workers == 2
+    assert other.bucket.rate == 1.0 and other.bucket.capacity == 2
+
+
+def test_pool_is_shared_by_host_and_subdomains(engine):
+    pool = engine.pool_for("https://github.com/a")
+    assert engine.pool_for("https://github.com/b") is pool
+    assert engine.pool_for("https://codeload.github.com/a.zip") is pool
+    # 完全相符的主機設定優先於上層網域
+    assert engine.pool_for("https://api.github.com/repos/a/b").host == "api.github.com"
+
+
+def test_unlimited_host_does_not_wait(engine, clock):
+    pool = engine.pool_for("https://api.github.com/repos/a/b")
+    for _ in range(20):
+        pool.bucket.acquire()
+    assert clock.sleeps == []
+
+
+def test_url_overrides(engine):
+    assert engine.resolve("https://github.com/a/b.zip") == "http://127.0.0.1:8000/github/a/b.zip"
+    assert engine.resolve("https://example.org/a.zip") == "https://example.org/a.zip"
+
+
+def test_submit_runs_on_the_host_workers(engine):
+    name = engine.submit("https://github.com/a", lambda: threading.current_thread().name).result()
+    assert name.startswith("github.com")
+
+
+def test_slot_limits_concurrent_downloads_per_host(engine):
+    url = "https://example.org/a.zip"
+    slots = engine.pool_for(url).slots
+    with engine.slot(url):
+        with engine.slot(url):
+            # DEFAULT 的 WORKERS 是 2，第三個下載要等前面的離開
+            assert not slots.acquire(blocking=False)
+        assert slots.acquire(blocking=False)
+        slots.release()
+    # 其他主機有自己的名額
+    with engine.slot(url), engine.slot(url), engine.slot("https://github.com/a"):
+        pass
+
+
+def test_slot_is_released_on_error(engine):
+    url = "https://example.org/a.zip"
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            with engine.slot(url):
+                raise ValueError
+    assert engine.pool_for(url).slots._value == 2
+
+
+def test_close_shuts_down_pools(engine):
+    pool = engine.pool_for("https://github.com/a")
+    engine.close()
+    with pytest.raises(RuntimeError):
+        pool.executor.submit(lambda: None)
+    assert engine.pool_for("https://github.com/a") is not pool
@@ -0,0 +1,174 @@
+import itertools
+import json
+import os
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+
+import http_cache
+from http_cache import HttpCache
+from state_db import StateDB
+
+URL = "https://api.example/repos?page=1"
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    """
+    假的 session_request：以 ETag 回答條件式請求，body 或 etag 改變就代表內容更新了。
+    """
+
+    def __init__(self, body=b'{"items": [1]}', etag='"v1"', last_modified=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = []
+
+    def __call__(self, method, url, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append(headers)
+        validators = {}
+        if self.etag:
+            validators["ETag"] = self.etag
+        if self.last_modified:
+            validators["Last-Modified"] = self.last_modified
+        if ((self.etag and headers.get("If-None-Match") == self.etag) or
+                (self.last_modified and headers.get("If-Modified-Since") == self.last_modified)):
+            return FakeResponse(304, headers={"X-RateLimit-Remaining": "41", **validators})
+        return FakeResponse(200, self.body, {"Content-Type": "application/json", "X-RateLimit-Remaining": "42",
+                                             "Link": '<https://next>; rel="next"', **validators})
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = StateDB(tmp_path / "state.db")
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def cache(db, tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(http_cache.time, "time", lambda: float(next(clock)))
+    return HttpCache(db, tmp_path / "http_cache")
+
+
+def test_not_modified_is_served_from_cache(cache):
+    server = FakeServer()
+    first = cache.get(server, URL)
+    assert first.status_code == 200 and not getattr(first, "from_cache", False)
+
+    second = cache.get(server, URL)
+    assert server.requests[1]["If-None-Match"] == '"v1"'
+    assert second.from_cache
+    assert second.status_code == 200
+    assert second.json() == {"items": [1]}
+    # 保存的 header 與 304 回應中最新的速率限制資訊合併
+    assert second.headers["Content-Type"] == "application/json"
+    assert second.headers["Link"] == '<https://next>; rel="next"'
+    assert second.headers["X-RateLimit-Remaining"] == "41"
+
+
+def test_last_modified_validator(cache):
+    server = FakeServer(etag=None, last_modified="Mon, 01 Jan 2026 00:00:00 GMT")
+    cache.get(server, URL)
+    assert cache.get(server, URL).from_cache
+    assert server.requests[1] == {"If-Modified-Since": "Mon, 01 Jan 2026 00:00:00 GMT"}
+
+
+def test_changed_content_replaces_entry(cache):
+    server = FakeServer()
+    cache.get(server, URL)
+    server.body, server.etag = b'{"items": [2]}', '"v2"'
+    updated = cache.get(server, URL)
+    assert updated.status_code == 200 and updated.content == b'{"items": [2]}'
+    assert cache.get(server, URL).json() == {"items": [2]}
+    assert server.requests[2]["If-None-Match"] == '"v2"'
+
+
+def test_response_without_validators_is_not_cached(cache):
+    server = FakeServer(etag=None)
+    cache.get(server, URL)
+    cache.get(server, URL)
+    assert server.requests == [{}, {}]
+
+
+def test_caller_headers_are_kept(cache):
+    server = FakeServer()
+    cache.get(server, URL, headers={"Accept": "application/json"})
+    cache.get(server, URL, headers={"Accept": "application/json"})
+    assert server.requests[1] == {"Accept": "application/json", "If-None-Match": '"v1"'}
+
+
+def test_varying_request_headers_are_cached_separately(cache, db):
+    server = FakeServer()
+    cache.get(server, URL, headers={"Accept": "application/json"})
+    cache.get(server, URL, headers={"Accept": "text/html"})
+    cache.get(server, URL, headers={"Accept": "application/json", "Authorization": "token secret"})
+    assert [h.get("If-None-Match") for h in server.requests] == [None, None, None]
+    assert cache.get(server, URL, headers={"accept": "text/html"}).from_cache
+    assert db.query("SELECT COUNT(*) FROM http_cache WHERE url = ?", (URL,))[0][0] == 3
+    # token 不會以明文保存
+    assert not any("secret" in str(row) for row in db.query("SELECT * FROM http_cache"))
+
+
+def test_other_request_headers_share_the_entry(cache):
+    server = FakeServer()
+    cache.get(server, URL, headers={"X-Request-Id": "1"})
+    assert cache.get(server, URL, headers={"X-Request-Id": "2"}).from_cache
+
+
+def test_missing_body_is_not_used(cache):
+    server = FakeServer()
+    cache.get(server, URL)
+    os.remove(cache._body_path(cache._key(URL)))
+    res = cache.get(server, URL)
+    assert server.requests[1] == {}
+    assert res.status_code == 200 and not getattr(res, "from_cache", False)
+
+
+def test_body_removed_after_lookup_is_fetched_again(cache, monkeypatch):
+    server = FakeServer()
+    cache.get(server, URL)
+
+    def remove_then_answer(method, url, headers=None, **kwargs):
+        # 送出請求之後、讀取快取內容之前被淘汰
+        if headers.get("If-None-Match"):
+            os.remove(cache._body_path(cache._key(URL)))
+        return server(method, url, headers=headers, **kwargs)
+
+    res = cache.get(remove_then_answer, URL)
+    assert res.status_code == 200 and res.content == server.body
+    assert server.requests[2] == {}
+    assert not cache.db.query("SELECT 1 FROM http_cache WHERE key = ?", (cache._key(URL),))
+
+
+def test_lru_eviction(db, tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(http_cache.time, "time", lambda: float(next(clock)))
+    cache = HttpCache(db, tmp_path / "http_cache", max_size=250)
+    server = FakeServer(body=b"x" * 100)
+    urls = [f"https://api.example/{i}" for i in range(3)]
+    cache.get(server, urls[0])
+    cache.get(server, urls[1])
+    # 使用過的項目較新，超過上限時先淘汰最久沒用的 urls[1]
+    assert cache.get(server, urls[0]).from_cache
+    cache.get(server, urls[2])
+
+    cached = {row[0] for row in db.query("SELECT url FROM http_cache")}
+    assert cached == {urls[0], urls[2]}
+    assert not cache._body_path(cache._key(urls[1])).exists()
+    sizes = db.query("SELECT SUM(size) FROM http_cache")[0][0]
+    assert sizes <= 250
+    assert json.loads(db.query("SELECT headers FROM http_cache WHERE url = ?", (urls[0],))[0][0]) == {
+        "Content-Type": "application/json", "Link": '<https://next>; rel="next"'}
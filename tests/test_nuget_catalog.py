@@ -0,0 +1,138 @@
+import datetime
+from concurrent.futures import Future
+
+import pytest
+
+import nuget_catalog
+from fingerprint import DOTNET
+from nuget_catalog import get_catalog_packages, parse_timestamp
+
+CURSOR = datetime.datetime(2026, 1, 1)
+
+
+def stamp(minute):
+    return f"2026-01-01T00:{minute:02d}:00.1234567Z"
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code != 200:
+            raise RuntimeError(self.status_code)
+
+
+class FakeCatalog:
+    """
+    單頁的假 catalog：leaves 是 (名稱, commit 分鐘) 的清單，status 指定某些 leaf 回傳的狀態碼，
+    entries 指定某些 leaf 的 packageEntries (預設是一個 tools/ 底下的 exe)。
+    """
+
+    def __init__(self, leaves, status=None, entries=None):
+        self.leaves = leaves
+        self.status = status or {}
+        self.entries = entries or {}
+        self.requested = []
+
+    def get(self, url, **kwargs):
+        if url == nuget_catalog.CATALOG_INDEX_URL:
+            return FakeResponse(200, {"items": [{"@id": "page0", "commitTimeStamp": stamp(59)}]})
+        if url == "page0":
+            return FakeResponse(200, {"items": [
+                {"@id": name, "@type": nuget_catalog.PACKAGE_DETAILS, "commitTimeStamp": stamp(minute),
+                 "nuget:id": name, "nuget:version": "1.0.0"}
+                for name, minute in self.leaves]})
+        self.requested.append(url)
+        status = self.status.get(url, 200)
+        if status != 200:
+            return FakeResponse(status)
+        entries = self.entries.get(url, ["tools/app.exe"])
+        return FakeResponse(200, {"packageEntries": [{"fullName": name} for name in entries],
+                                  "packageSize": 1000})
+
+    def submit(self, key, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+# a、b 同一個 commit；d、e 同一個 commit
+LEAVES = [("a", 1), ("b", 1), ("c", 2), ("d", 3), ("e", 3), ("f", 4)]
+
+
+def ids(packages):
+    return [package["id"] for package in packages]
+
+
+def test_parse_timestamp_truncates_to_microseconds():
+    assert parse_timestamp("2026-01-01T00:01:02.1234567Z") == datetime.datetime(2026, 1, 1, 0, 1, 2, 123456)
+    assert parse_timestamp("2026-01-01T00:01:02Z") == datetime.datetime(2026, 1, 1, 0, 1, 2)
+
+
+def test_cursor_advances_to_last_commit():
+    packages, cursor, deferred = get_catalog_packages(FakeCatalog(LEAVES), CURSOR, 100)
+    assert ids(packages) == ["a", "b", "c", "d", "e", "f"]
+    assert cursor == parse_timestamp(stamp(4))
+    assert deferred == []
+
+
+def test_leaves_at_or_before_cursor_are_ignored():
+    packages, cursor, _ = get_catalog_packages(FakeCatalog(LEAVES), parse_timestamp(stamp(2)), 100)
+    assert ids(packages) == ["d", "e", "f"]
+    assert cursor == parse_timestamp(stamp(4))
+
+
+def test_failed_leaf_keeps_cursor_before_its_commit():
+    catalog = FakeCatalog(LEAVES, status={"d": 503})
+    packages, cursor, _ = get_catalog_packages(catalog, CURSOR, 100)
+    # 同一個 commit 的 e 仍然回傳，但游標停在 c 的 commit，下一輪重新讀取 d
+    assert ids(packages) == ["a", "b", "c", "e"]
+    assert cursor == parse_timestamp(stamp(2))
+
+
+def test_failed_leaf_in_first_commit_keeps_cursor():
+    packages, cursor, _ = get_catalog_packages(FakeCatalog(LEAVES, status={"a": 500}), CURSOR, 100)
+    assert ids(packages) == ["b"]
+    assert cursor == CURSOR
+
+
+def test_missing_leaf_is_skipped():
+    packages, cursor, _ = get_catalog_packages(FakeCatalog(LEAVES, status={"d": 404}), CURSOR, 100)
+    assert ids(packages) == ["a", "b", "c", "e", "f"]
+    assert cursor == parse_timestamp(stamp(4))
+
+
+@pytest.mark.parametrize("limit, expected, minute", [
+    (1, ["a", "b"], 1),
+    (2, ["a", "b"], 1),
+    (4, ["a", "b", "c", "d", "e"], 3),
+])
+def test_max_packages_stops_at_commit_boundary(limit, expected, minute):
+    packages, cursor, _ = get_catalog_packages(FakeCatalog(LEAVES), CURSOR, limit)
+    assert ids(packages) == expected
+    assert cursor == parse_timestamp(stamp(minute))
+
+
+def test_packages_without_pe_still_advance_cursor():
+    catalog = FakeCatalog(LEAVES, entries={name: ["content/readme.txt"] for name, _ in LEAVES})
+    packages, cursor, _ = get_catalog_packages(catalog, CURSOR, 100)
+    assert packages == []
+    assert cursor == parse_timestamp(stamp(4))
+
+
+def test_over_quota_categories_are_deferred():
+    catalog = FakeCatalog(LEAVES, entries={"b": ["lib/net8.0/b.dll"], "e": ["runtimes/win-x64/lib/net8.0/e.dll"]})
+    packages, cursor, deferred = get_catalog_packages(catalog, CURSOR, 3, skip_categories={DOTNET})
+    # 延後的套件不佔名額
+    assert ids(packages) == ["a", "c", "d"]
+    assert ids(deferred) == ["b", "e"]
+    assert all(package["category"] == DOTNET for package in deferred)
+    assert cursor == parse_timestamp(stamp(3))
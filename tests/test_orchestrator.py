@@ -0,0 +1,140 @@
+import types
+
+import pytest
+
+import orchestrator
+from orchestrator import CURSOR_SOURCE, Orchestrator
+from state_db import StateDB
+
+SETTINGS = {
+    "SOURCES": {
+        "fast": {"MODULE": "fast", "PRIORITY": 3, "BACKLOG_INTERVAL": 60, "IDLE_INTERVAL": 1800},
+        "slow": {"MODULE": "slow", "PRIORITY": 1, "BACKLOG_INTERVAL": 600, "IDLE_INTERVAL": 3600},
+        "off": {"MODULE": "off", "ENABLED": False},
+    },
+    "ERROR_BACKOFF": 300,
+    "RATE_LIMIT_BACKOFF": 900,
+    "AGING_SECONDS": 3600,
+}
+
+
+class FakeEngine:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = StateDB(tmp_path / "state.db")
+    monkeypatch.setattr(orchestrator, "get_db", lambda: db)
+    return db
+
+
+def make(db, **crawlers):
+    """
+    建立排程器，crawlers 是 {來源名稱: main 函式}，取代真正的爬蟲模組。
+    """
+    orch = Orchestrator(SETTINGS)
+    for source in orch.sources:
+        if source.name in crawlers:
+            source._module = types.SimpleNamespace(main=crawlers[source.name])
+    return orch
+
+
+def source(orch, name):
+    return next(s for s in orch.sources if s.name == name)
+
+
+def saved_next_run(db, name):
+    return db.get_cursor(CURSOR_SOURCE, name, None)
+
+
+def test_disabled_sources_are_skipped(db):
+    assert [s.name for s in make(db).sources] == ["fast", "slow"]
+
+
+@pytest.mark.parametrize("result, delay", [
+    ({"backlog": 10}, 60),
+    ({"backlog": 0}, 1800),
+    ({"rate_limited": True}, 900),
+    ({"rate_limited": True, "retry_at": 1000 + 120}, 120),
+    ({"rate_limited": True, "retry_at": 1000 - 50}, 0),
+    (None, 1800),
+])
+def test_schedule(db, result, delay):
+    orch = make(db)
+    fast = source(orch, "fast")
+    orch.schedule(fast, result, 1000)
+    assert fast.next_run == 1000 + delay
+    assert saved_next_run(db, "fast") == 1000 + delay
+
+
+def test_next_run_survives_restart(db):
+    orch = make(db)
+    orch.schedule(source(orch, "slow"), {"backlog": 1}, 1000)
+    assert source(make(db), "slow").next_run == 1600
+
+
+def test_next_source_prefers_priority_then_age(db):
+    orch = make(db)
+    fast, slow = source(orch, "fast"), source(orch, "slow")
+    fast.next_run = slow.next_run = 1000
+    assert orch.next_source(1000) is fast
+    # 低優先的來源逾期夠久之後會排到前面
+    slow.next_run = 1000 - 3 * 3600
+    assert orch.next_source(1000) is slow
+    fast.next_run = slow.next_run = 2000
+    assert orch.next_source(1000) is None
+
+
+def test_next_run_is_saved_before_the_crawler_runs(db, monkeypatch):
+    monkeypatch.setattr(orchestrator.time, "time", lambda: 1000.0)
+    seen = []
+
+    def main():
+        # 行程在這裡被強制結束時，重新啟動後要等錯誤退避時間
+        seen.append(saved_next_run(db, "fast"))
+        return {"backlog": 1}
+
+    orch = make(db, fast=main)
+    orch.run_source(source(orch, "fast"))
+    assert seen == [1300.0]
+    assert saved_next_run(db, "fast") == 1060.0
+
+
+def test_failed_crawler_backs_off(db, monkeypatch):
+    monkeypatch.setattr(orchestrator.time, "time", lambda: 1000.0)
+
+    def main():
+        raise RuntimeError("boom")
+
+    orch = make(db, fast=main)
+    fast = source(orch, "fast")
+    orch.run_source(fast)
+    assert fast.runs == 1
+    assert fast.next_run == saved_next_run(db, "fast") == 1300.0
+
+
+def test_run_once_runs_each_source_by_priority_and_closes(db, monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(orchestrator, "get_engine", lambda: engine)
+    order = []
+    orch = make(db, fast=lambda: order.append("fast") or {}, slow=lambda: order.append("slow") or {})
+    orch.run(once=True)
+    assert order == ["fast", "slow"]
+    assert engine.closed
+
+
+def test_run_closes_engine_when_interrupted(db, monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(orchestrator, "get_engine", lambda: engine)
+
+    def main():
+        raise KeyboardInterrupt
+
+    orch = make(db, fast=main)
+    with pytest.raises(KeyboardInterrupt):
+        orch.run(once=True)
+    assert engine.closed
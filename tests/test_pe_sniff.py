@@ -0,0 +1,81 @@
+import struct
+
+import pytest
+
+from fixture_server import build_pe
+from pe_sniff import NEED_MORE, OK, SNIFF_SIZE, is_pe_bytes, sniff_pe_header, sniff_stream
+from utils import is_pe_file
+
+PE = build_pe(1, 8192)
+E_LFANEW = struct.unpack_from("<I", PE, 0x3C)[0]
+OPTIONAL = E_LFANEW + 24
+
+
+def patched(offset, fmt, value, data=PE):
+    data = bytearray(data)
+    struct.pack_into(fmt, data, offset, value)
+    return bytes(data)
+
+
+def test_valid_pe():
+    assert sniff_pe_header(PE[:SNIFF_SIZE]) == (OK, None)
+    assert is_pe_bytes(PE)
+
+
+@pytest.mark.parametrize("machine", [
+    0x014C,  # i386
+    0x8664,  # AMD64
+    0xAA64,  # ARM64
+    0xA641,  # ARM64EC
+    0x01C2,  # Thumb-2
+    0x01C4,  # ARMNT
+    0x0166,  # MIPS R4000 (WinCE)
+    0x01A2,  # SH3 (WinCE)
+    0x0EBC,  # EFI byte code
+])
+def test_any_machine_type_is_accepted(machine):
+    assert sniff_pe_header(patched(E_LFANEW + 4, "<H", machine))[0] == OK
+
+
+@pytest.mark.parametrize("data, verdict", [
+    (b"PK\x03\x04" + bytes(100), "not_mz"),
+    (patched(0x3C, "<I", 2), "bad_e_lfanew"),
+    (patched(E_LFANEW, "<4s", b"NE\0\0"), "no_pe_signature"),
+    (patched(E_LFANEW + 6, "<H", 0), "bad_sections"),
+    (patched(E_LFANEW + 20, "<H", 0x10), "bad_optional_header"),
+    (patched(OPTIONAL, "<H", 0x107), "bad_optional_magic"),
+    (patched(OPTIONAL + 0x24, "<I", 0x300), "bad_alignment"),
+    (patched(OPTIONAL + 0x20, "<I", 0x100), "bad_alignment"),
+])
+def test_rejects_malformed_headers(data, verdict):
+    assert sniff_pe_header(data)[0] == verdict
+    assert not is_pe_bytes(data)
+
+
+def test_needs_more_data():
+    assert sniff_pe_header(PE[:0x20]) == (NEED_MORE, 0x40)
+    verdict, needed = sniff_pe_header(PE[:E_LFANEW + 8])
+    assert verdict == NEED_MORE and needed > E_LFANEW + 8
+    # e_lfanew 超過 SNIFF_SIZE 時回報需要讀到哪裡
+    far = patched(0x3C, "<I", 0x2000)
+    assert sniff_pe_header(far[:SNIFF_SIZE]) == (NEED_MORE, 0x2000 + 24 + 0x28)
+
+
+def test_sniff_stream_keeps_all_bytes():
+    chunks = [PE[i:i + 1000] for i in range(0, len(PE), 1000)]
+    verdict, _, rest = sniff_stream(iter(chunks))
+    assert verdict == OK
+    assert b"".join(rest) == PE
+
+
+def test_sniff_stream_short_content():
+    verdict, detail, _ = sniff_stream(iter([PE[:0x30]]))
+    assert verdict == "truncated"
+
+
+def test_is_pe_file(tmp_path):
+    (tmp_path / "a.exe").write_bytes(PE)
+    (tmp_path / "b.txt").write_bytes(b"hello")
+    assert is_pe_file(tmp_path / "a.exe")
+    assert not is_pe_file(tmp_path / "b.txt")
+    assert not is_pe_file(tmp_path / "missing.exe")
@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import pipeline
+from pipeline import Pipeline, Stage, build_pipeline, get_process_pool, shutdown_process_pools
+
+
+@pytest.fixture(autouse=True)
+def pools():
+    yield
+    shutdown_process_pools()
+
+
+def test_items_flow_through_stages():
+    results = []
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    stages = [Stage("double", lambda x: [x * 2], workers=3, queue_size=2),
+              Stage("split", lambda x: [x, x + 1], workers=2, queue_size=2),
+              Stage("collect", collect)]
+    with Pipeline(stages) as p:
+        for i in range(50):
+            p.put(i)
+    assert sorted(results) == sorted([2 * i for i in range(50)] + [2 * i + 1 for i in range(50)])
+    stats = p.stats()
+    assert stats["double"]["processed"] == 50 and stats["double"]["workers"] == 3
+    assert stats["collect"]["processed"] == 100
+
+
+def test_errors_are_reported_and_do_not_stop_the_stage():
+    errors = []
+
+    def check(x):
+        if x % 2:
+            raise ValueError(x)
+        return [x]
+
+    with Pipeline([Stage("check", check)], on_error=lambda stage, item, e: errors.append((stage, item))) as p:
+        for i in range(6):
+            p.put(i)
+    assert errors == [("check", 1), ("check", 3), ("check", 5)]
+    assert p.stats()["check"]["errors"] == 3
+    assert p.stats()["check"]["processed"] == 6
+
+
+def test_close_is_idempotent():
+    p = Pipeline([Stage("noop", lambda x: None)]).start()
+    p.close()
+    p.close()
+
+
+def test_build_pipeline_worker_overrides():
+    p = build_pipeline([("fetch", None, 4), ("scan", None, 2)],
+                       settings={"WORKERS": {"scan": 6}, "QUEUE_SIZE": 3, "PROCESS_WORKERS": 2})
+    assert [stage.workers for stage in p.stages] == [4, 6]
+    assert p.stages[0].queue.maxsize == 3
+    assert p.process_workers == 2
+
+
+def test_run_cpu_without_process_pool_runs_inline():
+    assert Pipeline([], process_workers=0).run_cpu(os.getpid) == os.getpid()
+
+
+def test_pipelines_share_the_process_pool():
+    first, second = Pipeline([], process_workers=1), Pipeline([], process_workers=1)
+    pid = first.run_cpu(os.getpid)
+    assert pid != os.getpid()
+    # 同一個 worker 行程，不會為每個管線重新啟動
+    assert second.run_cpu(os.getpid) == pid
+    assert get_process_pool(1) is get_process_pool(1)
+    assert get_process_pool(1) is not get_process_pool(2)
+
+
+def test_broken_pool_is_replaced():
+    p = Pipeline([], process_workers=1)
+    broken = get_process_pool(1)
+    with pytest.raises(BrokenProcessPool):
+        p.run_cpu(os._exit, 1)
+    assert 1 not in pipeline._process_pools
+    assert get_process_pool(1) is not broken
+    assert p.run_cpu(os.getpid) != os.getpid()
+
+
+def test_shutdown_process_pools():
+    pool = get_process_pool(1)
+    shutdown_process_pools()
+    assert pipeline._process_pools == {}
+    with pytest.raises(RuntimeError):
+        pool.submit(os.getpid)
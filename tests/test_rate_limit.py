@@ -0,0 +1,201 @@
+import email.utils
+
+import pytest
+
+import rate_limit
+from rate_limit import (EPOCH_THRESHOLD, ApiFamily, RateLimited, RateLimitPacer, parse_rate_limit,
+                        parse_retry_after)
+
+NOW = 1_800_000_000.0
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    假的時鐘：time.sleep 只會把時間往前推，並記下每次睡多久。
+    """
+    class Clock:
+        def __init__(self):
+            self.now = NOW
+            self.sleeps = []
+
+        def time(self):
+            return self.now
+
+        def sleep(self, seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "time", clock.time)
+    monkeypatch.setattr(rate_limit.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_retry_after_seconds():
+    assert parse_retry_after({"Retry-After": "120"}, NOW) == NOW + 120
+    assert parse_retry_after({"Retry-After": " 0 "}, NOW) == NOW
+
+
+def test_retry_after_http_date():
+    value = email.utils.formatdate(NOW + 300, usegmt=True)
+    assert parse_retry_after({"Retry-After": value}, NOW) == NOW + 300
+
+
+@pytest.mark.parametrize("headers", [{}, {"Retry-After": ""}, {"Retry-After": "soon"}])
+def test_retry_after_missing_or_invalid(headers):
+    assert parse_retry_after(headers, NOW) is None
+
+
+def test_rate_limit_epoch_reset():
+    headers = {"X-RateLimit-Remaining": "10", "X-RateLimit-Limit": "5000", "X-RateLimit-Reset": str(int(NOW) + 60)}
+    assert parse_rate_limit(headers, NOW) == (10, 5000, NOW + 60)
+
+
+def test_rate_limit_relative_reset():
+    # 小於 EPOCH_THRESHOLD 的值是「幾秒後重置」
+    headers = {"RateLimit-Remaining": "3", "RateLimit-Limit": "100", "RateLimit-Reset": "30"}
+    assert parse_rate_limit(headers, NOW) == (3, 100, NOW + 30)
+    boundary = {"X-RateLimit-Reset": str(EPOCH_THRESHOLD)}
+    assert parse_rate_limit(boundary, NOW) == (None, None, EPOCH_THRESHOLD)
+    assert parse_rate_limit({"X-RateLimit-Reset": str(EPOCH_THRESHOLD - 1)}, NOW)[2] == NOW + EPOCH_THRESHOLD - 1
+
+
+def test_rate_limit_missing_or_invalid():
+    assert parse_rate_limit({}, NOW) == (None, None, None)
+    assert parse_rate_limit({"X-RateLimit-Remaining": "many"}, NOW) == (None, None, None)
+
+
+def test_family_spreads_remaining_requests(clock):
+    family = ApiFamily("core", "https://api.example/", reserve=1)
+    family.update(FakeResponse(headers={"X-RateLimit-Remaining": "5", "X-RateLimit-Reset": "40"}))
+    for _ in range(4):
+        family.acquire(max_wait=120)
+    # 4 個可用額度分散在重置前的 40 秒內：第一個立刻送出，之後每個都要等，但都在重置前送出
+    assert len(clock.sleeps) == 3
+    assert clock.sleeps[0] == 10.0
+    assert all(wait >= 10.0 for wait in clock.sleeps)
+    assert clock.now < NOW + 40
+    assert family.remaining == 1
+
+
+def test_family_waits_for_reset_when_reserve_is_reached(clock):
+    family = ApiFamily("core", "https://api.example/", reserve=1)
+    family.update(FakeResponse(headers={"X-RateLimit-Remaining": "1", "X-RateLimit-Reset": "30"}))
+    family.acquire(max_wait=120)
+    assert clock.sleeps == [31.0]
+
+
+def test_family_raises_when_wait_exceeds_max_wait(clock):
+    family = ApiFamily("search", "https://api.example/search", reserve=1)
+    family.update(FakeResponse(headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "600"}))
+    with pytest.raises(RateLimited) as info:
+        family.acquire(max_wait=120)
+    assert info.value.family == "search"
+    assert info.value.retry_at == NOW + 601
+    assert clock.sleeps == []
+
+
+def test_retry_after_blocks_the_family(clock):
+    family = ApiFamily("core", "https://api.example/")
+    family.update(FakeResponse(429, {"Retry-After": "20"}))
+    family.acquire(max_wait=120)
+    assert clock.sleeps == [20.0]
+
+
+def test_exhausted_403_blocks_until_reset(clock):
+    family = ApiFamily("core", "https://api.example/", reserve=0)
+    family.update(FakeResponse(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "50"}))
+    assert family.blocked_until == NOW + 51
+
+
+def test_plain_403_does_not_block(clock):
+    family = ApiFamily("core", "https://api.example/")
+    family.update(FakeResponse(403, {"X-RateLimit-Remaining": "100", "X-RateLimit-Reset": "50"}))
+    assert family.blocked_until == 0.0
+
+
+def test_configured_window_without_headers(clock):
+    family = ApiFamily("html", "https://example/", limit=11, window=100, reserve=1)
+    family.acquire(max_wait=120)
+    family.acquire(max_wait=120)
+    assert clock.sleeps == [10.0]
+
+
+def test_unknown_family_is_not_paced(clock):
+    family = ApiFamily("other", "https://example/")
+    for _ in range(5):
+        family.acquire(max_wait=1)
+    assert clock.sleeps == []
+
+
+@pytest.fixture
+def pacer():
+    return RateLimitPacer({
+        "MAX_RETRIES": 3, "MAX_WAIT": 120, "BACKOFF": 2.0, "MAX_BACKOFF": 60,
+        "FAMILIES": {
+            "search": {"URL": "https://api.github.com/search/", "LIMIT": 30, "WINDOW": 60},
+            "core": {"URL": "https://api.github.com/"},
+        },
+    })
+
+
+def test_family_for_uses_the_first_matching_prefix(pacer):
+    assert pacer.family_for("https://api.github.com/search/repositories").name == "search"
+    assert pacer.family_for("https://api.github.com/repos/a/b").name == "core"
+    assert pacer.family_for("https://example/") is None
+
+
+def test_rate_limit_403_is_retried_after_reset(pacer, clock):
+    response = FakeResponse(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "30"})
+    assert pacer.retry_delay(response, 0) == 31
+
+
+def test_403_with_retry_after_is_retried(pacer, clock):
+    assert pacer.retry_delay(FakeResponse(403, {"Retry-After": "15"}), 0) == 15
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-RateLimit-Remaining": "42", "X-RateLimit-Reset": "30"}])
+def test_plain_403_is_not_retried(pacer, clock, headers):
+    assert pacer.retry_delay(FakeResponse(403, headers), 0) is None
+
+
+@pytest.mark.parametrize("status", [200, 301, 400, 404])
+def test_other_statuses_are_not_retried(pacer, clock, status):
+    assert pacer.retry_delay(FakeResponse(status), 0) is None
+
+
+@pytest.mark.parametrize("attempt", [0, 1, 2])
+def test_backoff_with_equal_jitter(pacer, clock, attempt):
+    step = 2.0 * 2 ** attempt
+    for _ in range(20):
+        assert step / 2 <= pacer.retry_delay(FakeResponse(503), attempt) <= step
+
+
+def test_backoff_is_capped(clock):
+    pacer = RateLimitPacer({"MAX_RETRIES": 20, "MAX_BACKOFF": 60, "MAX_WAIT": 120})
+    assert 30 <= pacer.retry_delay(FakeResponse(502), 10) <= 60
+
+
+def test_no_retry_after_max_retries(pacer, clock):
+    assert pacer.retry_delay(FakeResponse(429), 3) is None
+
+
+def test_wait_longer_than_max_wait_is_not_retried(pacer, clock):
+    assert pacer.retry_delay(FakeResponse(429, {"Retry-After": "121"}), 0) is None
+    assert pacer.retry_delay(FakeResponse(429, {"Retry-After": "120"}), 0) == 120
+
+
+def test_pacer_acquire_raises_for_exhausted_family(pacer, clock):
+    family = pacer.family_for("https://api.github.com/repos/a/b")
+    family.update(FakeResponse(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "900"}))
+    with pytest.raises(RateLimited):
+        pacer.acquire("https://api.github.com/repos/a/b")
+    # 其他 family 不受影響
+    assert pacer.acquire("https://api.github.com/search/code").name == "search"
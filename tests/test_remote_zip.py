@@ -0,0 +1,149 @@
+import io
+import random
+import struct
+import zipfile
+
+import pytest
+
+from remote_zip import EOCD_SIGNATURE, ZIP64_EOCD_SIGNATURE, RangeNotSupported, RemoteZip
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.url = "https://example.test/release.zip"
+
+    def iter_content(self, chunk_size=1):
+        # 刻意切成很小的區塊，local header 會橫跨多個區块
+        for i in range(0, len(self.content), 7):
+            yield self.content[i:i + 7]
+
+    def close(self):
+        pass
+
+
+class RangeServer:
+    """
+    只支援 Range 請求的假 FetchEngine；cut 可以截短成員的內容 (模擬連線中斷)。
+    """
+
+    def __init__(self, blob, ranges=True, cut=None):
+        self.blob = blob
+        self.ranges = ranges
+        self.cut = cut
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        spec = headers["Range"][len("bytes="):]
+        self.requests.append(spec)
+        if not self.ranges:
+            return FakeResponse(200, self.blob)
+        if spec.startswith("-"):
+            start = max(0, len(self.blob) - int(spec[1:]))
+            end = len(self.blob) - 1
+        else:
+            start, end = map(int, spec.split("-"))
+        data = self.blob[start:end + 1]
+        if stream and self.cut is not None:
+            data = data[:self.cut]
+        return FakeResponse(206, data, {"Content-Range": f"bytes {start}-{end}/{len(self.blob)}"})
+
+
+def build_zip(members, comment=b"", compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+        z.comment = comment
+    return buffer.getvalue()
+
+
+MEMBERS = {
+    "bin/tool.exe": b"MZ" + random.Random(1).randbytes(10000),
+    "README.txt": b"hello\n",
+    "lib/empty.dll": b"",
+}
+
+
+def read_all(remote):
+    return {entry.filename: b"".join(remote.iter_member(entry)) for entry in remote.entries()}
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_reads_members(compression):
+    server = RangeServer(build_zip(MEMBERS, compression=compression))
+    remote = RemoteZip(server, "https://example.test/release.zip")
+    assert read_all(remote) == MEMBERS
+    assert remote.size == len(server.blob)
+
+
+def test_end_offsets_bound_each_member():
+    remote = RemoteZip(RangeServer(build_zip(MEMBERS)), "u")
+    ordered = sorted(remote.entries(), key=lambda e: e.header_offset)
+    for current, following in zip(ordered, ordered[1:]):
+        assert current.end_offset == following.header_offset
+
+
+def test_archive_comment():
+    blob = build_zip(MEMBERS, comment=b"Release 1.0 built by CI\n" * 100)
+    remote = RemoteZip(RangeServer(blob), "u")
+    assert read_all(remote) == MEMBERS
+
+
+def test_zip64(monkeypatch):
+    # 把 ZIP64 的門檻調低，讓小檔案也寫成 ZIP64 (中央目錄的欄位都是 0xFFFFFFFF，真正的值在 extra 欄位)
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 16)
+    monkeypatch.setattr(zipfile, "ZIP_FILECOUNT_LIMIT", 1)
+    blob = build_zip(MEMBERS)
+    assert ZIP64_EOCD_SIGNATURE in blob
+    remote = RemoteZip(RangeServer(blob), "u")
+    entries = {entry.filename: entry for entry in remote.entries()}
+    assert entries["bin/tool.exe"].file_size == len(MEMBERS["bin/tool.exe"])
+    assert read_all(remote) == MEMBERS
+
+
+def test_missing_end_of_central_directory():
+    with pytest.raises(ValueError):
+        RemoteZip(RangeServer(b"MZ" + bytes(1000)), "u").entries()
+
+
+def test_truncated_end_of_central_directory():
+    blob = build_zip(MEMBERS)
+    cut = blob[:blob.rfind(EOCD_SIGNATURE) + 10]
+    with pytest.raises(ValueError):
+        RemoteZip(RangeServer(cut), "u").entries()
+
+
+@pytest.mark.parametrize("cut", [10, 40, 500])
+def test_truncated_member_raises_value_error(cut):
+    # 不論斷在 local header、檔名或資料中，都必須是 ValueError (不是 StopIteration 變成的 RuntimeError)
+    remote = RemoteZip(RangeServer(build_zip(MEMBERS), cut=cut), "u")
+    entry = next(e for e in remote.entries() if e.filename == "bin/tool.exe")
+    with pytest.raises(ValueError):
+        b"".join(remote.iter_member(entry))
+
+
+def test_crc_mismatch():
+    blob = bytearray(build_zip({"a.exe": b"MZ" + bytes(100)}, compression=zipfile.ZIP_STORED))
+    data_start = 30 + len("a.exe")
+    blob[data_start + 10] ^= 0xFF
+    remote = RemoteZip(RangeServer(bytes(blob)), "u")
+    with pytest.raises(ValueError, match="CRC"):
+        b"".join(remote.iter_member(remote.entries()[0]))
+
+
+def test_encrypted_member_is_refused():
+    blob = bytearray(build_zip({"a.exe": b"MZ"}))
+    central = blob.rfind(b"PK\x01\x02")
+    flags = struct.unpack_from("<H", blob, central + 8)[0]
+    struct.pack_into("<H", blob, central + 8, flags | 0x1)
+    remote = RemoteZip(RangeServer(bytes(blob)), "u")
+    with pytest.raises(ValueError, match="encrypted"):
+        list(remote.iter_member(remote.entries()[0]))
+
+
+def test_server_without_range_support():
+    with pytest.raises(RangeNotSupported):
+        RemoteZip(RangeServer(build_zip(MEMBERS), ranges=False), "u").entries()
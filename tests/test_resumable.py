@@ -0,0 +1,183 @@
+import io
+import random
+
+import pytest
+
+import downloader
+import resumable
+from resumable import ResumableDownload, content_range_total
+
+BLOB = b"MZ" + random.Random(2).randbytes(20000)
+
+
+class FakeRaw:
+    def __init__(self, data, fail_after=None):
+        self.data = io.BytesIO(data)
+        self.fail_after = fail_after
+
+    def read(self, size, decode_content=True):
+        if self.fail_after is not None and self.data.tell() >= self.fail_after:
+            raise ConnectionError("connection reset")
+        if self.fail_after is not None:
+            size = min(size, self.fail_after - self.data.tell())
+        return self.data.read(size)
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=b"", headers=None, fail_after=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = "https://mirror/file.exe"
+        self.content = data
+        self.raw = FakeRaw(data, fail_after)
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    """
+    假的 FetchEngine。total 決定 Content-Range 的總長度 ("auto" 為實際長度、"*" 為未知、None 為不送這個標頭)；
+    ranges=False 時一律回傳完整內容；fail_after 讓第一個分段請求在讀到這麼多位元組後斷線。
+    length 可以讓完整回應的 Content-Length 與實際內容不符。
+    """
+
+    def __init__(self, blob=BLOB, total="auto", ranges=True, etag='"v1"', fail_after=None, length=None):
+        self.blob = blob
+        self.total = total
+        self.length = len(blob) if length is None else length
+        self.ranges = ranges
+        self.etag = etag
+        self.fail_after = fail_after
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False, timeout=None, allow_redirects=True):
+        headers = headers or {}
+        self.requests.append((url, headers.get("Range"), headers.get("If-Range")))
+        validator = {"ETag": self.etag} if self.etag else {}
+        if not self.ranges or "Range" not in headers or headers.get("If-Range", self.etag) != self.etag:
+            return FakeResponse(200, self.blob, {"Content-Length": str(self.length), **validator})
+        start, end = map(int, headers["Range"][len("bytes="):].split("-"))
+        if start >= len(self.blob):
+            return FakeResponse(416, headers={"Content-Range": f"bytes */{len(self.blob)}"})
+        data = self.blob[start:end + 1]
+        response_headers = dict(validator)
+        if self.total is not None:
+            total = len(self.blob) if self.total == "auto" else self.total
+            response_headers["Content-Range"] = f"bytes {start}-{start + len(data) - 1}/{total}"
+        fail_after = None
+        if self.fail_after is not None and len(self.requests) > 1:
+            fail_after, self.fail_after = self.fail_after, None
+        return FakeResponse(206, data, response_headers, fail_after)
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(downloader, "_settings", {})
+    monkeypatch.setattr(resumable.time, "sleep", lambda seconds: None)
+    return downloader._settings
+
+
+def download(server, tmp_path, **kwargs):
+    return ResumableDownload(server, "https://example/file.exe", tmp_path / "parts", **kwargs)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes 0-4095/123456", 123456),
+    ("bytes */123456", 123456),
+    ("bytes 0-4095/*", None),
+    ("bytes 0-4095", None),
+    ("", None),
+    (None, None),
+])
+def test_content_range_total(value, expected):
+    assert content_range_total(value) == expected
+
+
+def test_range_download(tmp_path):
+    server = FakeServer()
+    path = download(server, tmp_path).run()
+    assert path.read_bytes() == BLOB
+    # 探測之後改用跳轉後的位址，從頭開始抓剩下的內容
+    assert server.requests[1][0] == "https://mirror/file.exe"
+    assert server.requests[1][1] == f"bytes=0-{len(BLOB) - 1}"
+    assert not list((tmp_path / "parts").glob("*.json"))
+
+
+@pytest.mark.parametrize("total", [None, "*"])
+def test_unknown_total_falls_back_to_plain_download(tmp_path, total):
+    server = FakeServer(total=total)
+    path = download(server, tmp_path).run()
+    assert path.read_bytes() == BLOB
+    assert [rng for _, rng, _ in server.requests] == [f"bytes=0-{resumable.SNIFF_SIZE - 1}", None]
+
+
+def test_server_without_range_support(tmp_path):
+    server = FakeServer(ranges=False)
+    path = download(server, tmp_path).run()
+    assert path.read_bytes() == BLOB
+    assert len(server.requests) == 1
+
+
+def test_rejected_head_discards_download(tmp_path):
+    server = FakeServer()
+    assert download(server, tmp_path, check_head=lambda head: False).run() is None
+    assert len(server.requests) == 1
+    assert not list((tmp_path / "parts").iterdir())
+
+
+def test_interrupted_segment_is_retried_from_where_it_stopped(tmp_path):
+    server = FakeServer(fail_after=5000)
+    path = download(server, tmp_path).run()
+    assert path.read_bytes() == BLOB
+    assert [rng for _, rng, _ in server.requests[1:]] == [f"bytes=0-{len(BLOB) - 1}",
+                                                         f"bytes=5000-{len(BLOB) - 1}"]
+
+
+def test_resume_from_existing_part(tmp_path):
+    first = download(FakeServer(), tmp_path)
+    first._save_meta({"url": first.url, "total": len(BLOB), "validator": '"v1"', "segments": 1})
+    first._segment_path(0).write_bytes(BLOB[:7000])
+
+    server = FakeServer()
+    path = download(server, tmp_path).run()
+    assert path.read_bytes() == BLOB
+    assert server.requests[0][2] == '"v1"'
+    assert server.requests[1][1:] == (f"bytes=7000-{len(BLOB) - 1}", '"v1"')
+
+
+def test_changed_file_restarts_download(tmp_path):
+    old = download(FakeServer(), tmp_path)
+    old._save_meta({"url": old.url, "total": len(BLOB), "validator": '"v0"', "segments": 1})
+    old._segment_path(0).write_bytes(b"stale content")
+
+    server = FakeServer()
+    path = download(server, tmp_path).run()
+    # If-Range 不符：伺服器回傳完整內容，舊的 .part 被丟棄
+    assert path.read_bytes() == BLOB
+    assert server.requests[0][2] == '"v0"'
+
+
+def test_parallel_segments(tmp_path, settings):
+    settings.update(PARALLEL_RANGES=4, PARALLEL_MIN_MB=0)
+    server = FakeServer()
+    path = download(server, tmp_path).run()
+    assert path.read_bytes() == BLOB
+    assert len(server.requests) == 5
+
+
+def test_length_mismatch_raises(tmp_path):
+    server = FakeServer(ranges=False, length=len(BLOB) + 10)
+    with pytest.raises(IOError, match="length mismatch"):
+        download(server, tmp_path).run()
+    assert not list((tmp_path / "parts").iterdir())
+
+
+def test_unsatisfiable_range_gives_up_after_retries(tmp_path):
+    server = FakeServer(total=len(BLOB) + 10)
+    first = download(server, tmp_path)
+    first._save_meta({"url": first.url, "total": len(BLOB) + 10, "validator": '"v1"', "segments": 1})
+    first._segment_path(0).write_bytes(BLOB)
+    with pytest.raises(IOError, match="giving up"):
+        first.run()
+    assert len(server.requests) == 1 + 1 + first.max_retries
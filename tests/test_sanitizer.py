@@ -0,0 +1,119 @@
+import subprocess
+
+import pytest
+
+import clamd_scanner
+import utils
+from clamd_scanner import CLEAN, ERROR, INFECTED
+from sanitizer import plan_item
+
+SIZE, MTIME, SHA256 = 1000, 1700000000.0, "ab" * 32
+
+
+def cached(size=SIZE, mtime=MTIME, is_pe=1, signed=0, clean=1, clamav_db="27000"):
+    return (size, mtime, SHA256, is_pe, signed, clean, clamav_db)
+
+
+def plan(entry, db_version="27000", full=False):
+    return plan_item("benign_pe/a.exe", SIZE, MTIME, entry, db_version, full)
+
+
+def test_uncached_file_is_inspected_and_scanned():
+    item = plan(None)
+    assert item["inspect"] and item["scan"]
+    assert item["sha256"] is None
+
+
+def test_full_run_ignores_cache():
+    item = plan(cached(), full=True)
+    assert item["inspect"] and item["scan"]
+
+
+@pytest.mark.parametrize("entry", [cached(size=SIZE + 1), cached(mtime=MTIME + 1)])
+def test_changed_file_is_rechecked(entry):
+    item = plan(entry)
+    assert item["inspect"] and item["scan"]
+
+
+def test_unchanged_file_reuses_cached_verdict():
+    item = plan(cached(signed=1))
+    assert not item["inspect"] and not item["scan"]
+    assert item["sha256"] == SHA256
+    assert item["is_pe"] is True and item["signed"] is True and item["clean"] is True
+
+
+def test_cached_malware_is_kept_as_malware():
+    item = plan(cached(clean=0))
+    assert not item["scan"]
+    assert item["clean"] is False
+
+
+@pytest.mark.parametrize("entry, db_version", [
+    (cached(), "27001"),               # 病毒庫更新
+    (cached(clean=None), "27000"),     # 上次掃描出錯
+    (cached(), None),                  # 取不到目前的病毒庫版本
+    (cached(clamav_db=None), "27000"),  # 快取沒有記錄病毒庫版本
+])
+def test_rescan_cases(entry, db_version):
+    item = plan(entry, db_version)
+    assert not item["inspect"]
+    assert item["scan"]
+
+
+def test_non_pe_is_never_scanned():
+    item = plan(cached(is_pe=0, clean=None), db_version=None)
+    assert not item["inspect"] and not item["scan"]
+    assert item["is_pe"] is False
+
+
+class FakeScanner:
+    def __init__(self, verdict):
+        self.verdict = verdict
+
+    def scan_file(self, path):
+        return self.verdict, "detail"
+
+
+@pytest.fixture
+def scanner(monkeypatch):
+    """
+    設定 clamd 的結果 (None 代表沒有 clamd) 與 clamscan 的回傳碼 (None 代表 clamscan 無法執行)。
+    """
+    calls = []
+
+    def configure(verdict, returncode):
+        def run(cmd, **kwargs):
+            calls.append(cmd)
+            if returncode is None:
+                raise FileNotFoundError("clamscan")
+            return subprocess.CompletedProcess(cmd, returncode, "", "error")
+
+        monkeypatch.setattr(clamd_scanner, "get_default_scanner",
+                            lambda: None if verdict is None else FakeScanner(verdict))
+        monkeypatch.setattr(subprocess, "run", run)
+        return calls
+
+    return configure
+
+
+@pytest.mark.parametrize("verdict, returncode, expected", [
+    (CLEAN, None, True),
+    (INFECTED, None, False),
+    (ERROR, 0, True),
+    (ERROR, 1, False),
+    (ERROR, 2, None),
+    (ERROR, None, None),
+    (None, 0, True),
+    (None, 2, None),
+])
+def test_clamav_verdict(scanner, verdict, returncode, expected):
+    calls = scanner(verdict, returncode)
+    assert utils.clamav_verdict("a.exe") is expected
+    # clamd 有明確結果時不會再呼叫 clamscan
+    assert bool(calls) == (verdict not in (CLEAN, INFECTED))
+
+
+@pytest.mark.parametrize("returncode, expected", [(0, True), (1, False), (2, True), (None, True)])
+def test_scan_with_clamav_fails_open(scanner, returncode, expected):
+    scanner(None, returncode)
+    assert utils.scan_with_clamav("a.exe") is expected
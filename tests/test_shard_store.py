@@ -0,0 +1,118 @@
+import hashlib
+import random
+
+import pytest
+
+from shard_store import RAW, ShardStore, is_shard_path, sample_path, zstd_available
+from state_db import StateDB
+
+COMPRESSIBLE = b"MZ" + b"\x90" * 5000 + bytes(range(256)) * 200
+INCOMPRESSIBLE = b"MZ" + random.Random(3).randbytes(300 * 1024)
+
+CODECS = ["raw", "zlib", "lzma", pytest.param("zstd", marks=pytest.mark.skipif(
+    not zstd_available(), reason="zstandard is not installed"))]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = StateDB(tmp_path / "state.db")
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def make_store(db, tmp_path):
+    stores = []
+
+    def make(**settings):
+        store = ShardStore(db, root=tmp_path / "shards", settings=settings)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def add(store, tmp_path, data):
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = tmp_path / sha256
+    path.write_bytes(data)
+    return store.append(sha256, path)
+
+
+def test_sample_path():
+    assert sample_path("ab" * 32) == "shard:" + "ab" * 32
+    assert is_shard_path(sample_path("ab" * 32))
+    assert not is_shard_path("benign_pe/objects/ab/abab.exe")
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip(make_store, tmp_path, codec):
+    store = make_store(CODEC=codec)
+    members = [add(store, tmp_path, data) for data in (COMPRESSIBLE, b"", b"MZ\x00")]
+    assert members[0].codec == codec
+    # 空檔案不壓縮
+    assert members[1].codec == RAW
+
+    for member, data in zip(members, (COMPRESSIBLE, b"", b"MZ\x00")):
+        assert store.contains(member.sha256)
+        assert store.locate(member.sha256) == member
+        assert store.read(member.sha256) == data
+        assert bytes(store.view(member.sha256)) == data
+        extracted = store.extract(member, tmp_path)
+        assert extracted.read_bytes() == data
+    assert [m.sha256 for m in store.members()] == [m.sha256 for m in members]
+
+
+def test_incompressible_member_is_stored_raw(make_store, tmp_path):
+    store = make_store(CODEC="zlib")
+    member = add(store, tmp_path, INCOMPRESSIBLE)
+    assert member.codec == RAW
+    assert member.length == member.size == len(INCOMPRESSIBLE)
+    assert store.read(member.sha256) == INCOMPRESSIBLE
+
+
+def test_mismatched_content_is_not_indexed(make_store, tmp_path):
+    store = make_store(CODEC="zlib")
+    path = tmp_path / "sample.exe"
+    path.write_bytes(COMPRESSIBLE)
+    with pytest.raises(ValueError):
+        store.append("00" * 32, path)
+    assert not store.contains("00" * 32)
+
+    # 後面的成員仍然可以 reindex
+    member = add(store, tmp_path, b"MZ after")
+    store.db.execute("DELETE FROM shard_index")
+    assert store.reindex() == 1
+    assert store.locate(member.sha256) == member
+
+
+def test_delete_survives_reindex(make_store, tmp_path):
+    store = make_store(CODEC="zlib")
+    kept = add(store, tmp_path, COMPRESSIBLE)
+    deleted = add(store, tmp_path, b"MZ deleted")
+    store.delete(deleted.sha256)
+    assert not store.contains(deleted.sha256)
+    assert store.read(deleted.sha256) is None
+
+    store.db.execute("DELETE FROM shard_index")
+    assert store.reindex() == 1
+    assert store.contains(kept.sha256) and not store.contains(deleted.sha256)
+    assert store.read(kept.sha256) == COMPRESSIBLE
+
+
+def test_full_shard_rolls_over(make_store, tmp_path):
+    store = make_store(CODEC="zlib", MAX_SHARD_MB=0)
+    first = add(store, tmp_path, COMPRESSIBLE)
+    second = add(store, tmp_path, b"MZ second")
+    assert [path.name for path in store.shard_files()] == ["shard-00001.pack", "shard-00002.pack"]
+    assert first.shard != second.shard
+    assert store.read(first.sha256) == COMPRESSIBLE
+    assert store.read(second.sha256) == b"MZ second"
+
+
+def test_reopened_store_reads_existing_shards(make_store, tmp_path):
+    member = add(make_store(CODEC="lzma"), tmp_path, COMPRESSIBLE)
+    other = make_store(CODEC="zlib")
+    assert other.read(member.sha256) == COMPRESSIBLE
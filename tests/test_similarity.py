@@ -0,0 +1,167 @@
+import random
+import struct
+
+import pefile
+import pytest
+
+from fixture_server import build_pe
+from similarity import NUM_BINS, SIGNATURE_FORMAT, SimilarityIndex, estimate, minhash, similarity_pe
+from state_db import StateDB
+
+pytest.importorskip("numpy")
+
+E_LFANEW = 0x80
+TIMESTAMP = E_LFANEW + 8
+CHECKSUM = E_LFANEW + 24 + 64
+SECURITY_DIR = E_LFANEW + 24 + 96 + 32
+
+
+def random_bytes(seed, size):
+    return random.Random(seed).randbytes(size)
+
+
+def signature(seed, changed=(), base=None):
+    """
+    合成的簽名：changed 中的桶換成不同的值，與 base 的相似度正好是 1 - len(changed) / NUM_BINS。
+    """
+    values = list(base or random.Random(seed).sample(range(1, 1 << 25), NUM_BINS))
+    for index in changed:
+        values[index] += 1 << 26
+    return struct.pack(SIGNATURE_FORMAT, *values), values
+
+
+def analyse(data):
+    return similarity_pe(pefile.PE(data=data, fast_load=True))
+
+
+def test_minhash_needs_at_least_one_shingle():
+    assert minhash([b"MZ", b""]) is None
+    assert minhash([b"12345678"]) is not None
+
+
+def test_minhash_identical_content():
+    data = random_bytes(1, 50000)
+    assert minhash([data]) == minhash([bytes(data)])
+    assert estimate(minhash([data]), minhash([data])) == 1.0
+
+
+def test_minhash_estimates_jaccard():
+    shared = random_bytes(1, 100000)
+    a = minhash([shared + random_bytes(2, 100000)])
+    b = minhash([shared + random_bytes(3, 100000)])
+    # 兩邊各有約 100000 個 shingle 相同、100000 個不同：Jaccard ≈ 1/3
+    assert abs(estimate(a, b) - 1 / 3) < 0.15
+    assert estimate(a, minhash([random_bytes(4, 200000)])) < 0.1
+
+
+def test_minhash_with_empty_bins():
+    # shingle 比桶少：空桶由鄰近的桶補上，結果仍是合法且可比較的簽名
+    small = minhash([b"abcdefghij"])
+    assert len(small) == NUM_BINS * 4
+    assert estimate(small, minhash([b"abcdefghij"])) == 1.0
+
+
+def test_similarity_pe_ignores_timestamp_checksum_and_signature():
+    original = build_pe(1, 16384)
+    rebuilt = bytearray(original)
+    struct.pack_into("<I", rebuilt, TIMESTAMP, 0x12345678)
+    struct.pack_into("<I", rebuilt, CHECKSUM, 0xDEADBEEF)
+    certificate = b"\x00" * 8 + random_bytes(5, 2000)
+    struct.pack_into("<II", rebuilt, SECURITY_DIR, len(rebuilt), len(certificate))
+    rebuilt += certificate
+
+    a, _ = analyse(original)
+    b, _ = analyse(bytes(rebuilt))
+    assert a == b
+
+
+def test_similarity_pe_unrelated_samples():
+    a, _ = analyse(build_pe(1, 16384))
+    b, _ = analyse(build_pe(2, 16384))
+    assert estimate(a, b) < 0.5
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = StateDB(tmp_path / "state.db")
+    yield db
+    db.close()
+
+
+# 相似度 0.75，只改動前半的桶：後 8 個 band 不變，LSH 一定會把它列為候選，由門檻決定是否相似
+FAR = range(0, 64, 2)
+
+
+def index_of(db, **settings):
+    return SimilarityIndex(db, dict({"THRESHOLD": 0.8, "IMPHASH_THRESHOLD": 0.6, "MAX_VARIANTS": 3,
+                                     "BANDS": 16}, **settings))
+
+
+def test_estimate_of_synthetic_signatures():
+    base, values = signature(1)
+    variant, _ = signature(1, changed=range(0, 128, 8), base=values)
+    assert estimate(base, variant) == 1 - 16 / NUM_BINS
+
+
+def test_variants_join_the_same_cluster(db):
+    index = index_of(db)
+    base, values = signature(1)
+    assert index.record("a", base, "") == "a"
+    near, _ = signature(1, changed=range(0, 128, 16), base=values)   # 0.9375
+    far, _ = signature(1, changed=FAR, base=values)
+    assert index.record("b", near, "") == "a"
+    assert index.record("c", far, "") == "c"
+    assert index.members("a") == ["a", "b"]
+    assert index.clusters() == [("a", 2)]
+
+    cluster, variants, score = index.check(near, "")
+    assert (cluster, variants, score) == ("a", 2, 1.0)
+    assert index.check(signature(2)[0], "") == (None, 0, 0.0)
+
+
+def test_same_imphash_relaxes_threshold(db):
+    index = index_of(db)
+    base, values = signature(1)
+    index.record("a", base, "imp1")
+    far, _ = signature(1, changed=FAR, base=values)
+    assert index.check(far, "imp2")[0] is None
+    assert index.check(far, "imp1")[0] == "a"
+
+
+def test_max_variants(db):
+    index = index_of(db, MAX_VARIANTS=3)
+    base, values = signature(1)
+    for i in range(3):
+        variant, _ = signature(1, changed=[i * 8], base=values)
+        index.record(f"v{i}", variant, "")
+    _, variants, _ = index.check(base, "")
+    assert variants == 3 and index.over_cap(variants)
+    assert not index.over_cap(2)
+    assert not index_of(db, MAX_VARIANTS=0).over_cap(1000)
+
+
+def test_check_excludes_the_sample_itself(db):
+    index = index_of(db)
+    base, _ = signature(1)
+    index.record("a", base, "")
+    assert index.check(base, "", exclude="a") == (None, 0, 0.0)
+
+
+def test_remove_and_reindex(db):
+    index = index_of(db)
+    base, values = signature(1)
+    index.record("a", base, "")
+    index.record("b", signature(1, changed=[0], base=values)[0], "")
+    index.remove("b")
+    assert index.indexed() == {"a"}
+
+    # 修改 BANDS 之後，舊的 bucket 找不到候選，reindex 後才找得到
+    rebanded = index_of(db, BANDS=8)
+    assert rebanded.check(base, "")[0] is None
+    assert rebanded.reindex() == 1
+    assert rebanded.check(base, "")[0] == "a"
+
+
+def test_bands_must_divide_bins(db):
+    with pytest.raises(ValueError):
+        index_of(db, BANDS=7)
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+
+import pytest
+
+from state_db import StateDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = StateDB(tmp_path / "state.db", batch_size=100, batch_seconds=60)
+    yield db
+    db.close()
+
+
+def other_connection(db, timeout=0.2):
+    return sqlite3.connect(str(db.path), timeout=timeout, isolation_level=None)
+
+
+def test_reads_see_pending_writes(db):
+    db.add_history("github", "https://a")
+    db.set_cursor("github", "page", 3)
+    assert db.seen("github", "https://a")
+    assert db.get_cursor("github", "page") == 3
+    assert db.get_cursor("github", "missing", []) == []
+
+
+def test_pending_batch_does_not_hold_the_write_lock(db):
+    db.add_history("github", "https://a")
+    # 批次還在記憶體中，其他行程可以立刻寫入
+    other = other_connection(db)
+    other.execute("INSERT INTO history (source, url, added_at) VALUES ('choco', 'x', 0)")
+    assert not other.execute("SELECT 1 FROM history WHERE source = 'github'").fetchall()
+    db.commit()
+    assert other.execute("SELECT url FROM history WHERE source = 'github'").fetchall() == [("https://a",)]
+
+
+def test_batch_size_triggers_commit(tmp_path):
+    db = StateDB(tmp_path / "state.db", batch_size=3, batch_seconds=60)
+    for i in range(3):
+        db.add_history("github", f"https://{i}")
+    assert other_connection(db).execute("SELECT COUNT(*) FROM history").fetchone() == (3,)
+    db.close()
+
+
+def test_failed_statement_only_drops_itself(db, capsys):
+    db.add_history("github", "https://a")
+    db.execute("INSERT INTO no_such_table VALUES (1)")
+    db.add_history("github", "https://b")
+    # 觸發寫入的讀取端不會收到其他呼叫端的錯誤
+    assert db.seen("github", "https://a") and db.seen("github", "https://b")
+    assert "no_such_table" in capsys.readouterr().out
+
+
+def test_constraint_error_does_not_reach_readers(db):
+    db.execute("INSERT INTO history (source, url, added_at) VALUES ('github', 'https://a', 0)")
+    db.execute("INSERT INTO history (source, url, added_at) VALUES ('github', 'https://a', 0)")
+    assert db.query("SELECT count(*) FROM history") == [(1,)]
+
+
+def test_failed_statement_in_timer_commit(tmp_path, capsys):
+    db = StateDB(tmp_path / "state.db", batch_size=100, batch_seconds=0.05)
+    errors = []
+    hook, threading.excepthook = threading.excepthook, errors.append
+    try:
+        db.execute("INSERT INTO no_such_table VALUES (1)")
+        db.add_history("github", "https://a")
+        timer = db._timer
+        timer.join(2)
+        assert not errors
+        assert db._batch_started is None
+        assert "no_such_table" in capsys.readouterr().out
+        assert db.seen("github", "https://a")
+    finally:
+        threading.excepthook = hook
+        db.close()
+
+
+def test_busy_database_keeps_the_batch(db):
+    other = other_connection(db)
+    other.execute("BEGIN IMMEDIATE")
+    db.conn.execute("PRAGMA busy_timeout=50")
+    db.add_history("github", "https://a")
+    db.commit()
+    assert db._pending
+    other.execute("COMMIT")
+    db.commit()
+    assert not db._pending
+    assert db.seen("github", "https://a")
+
+
+def test_busy_database_in_timer_commit(tmp_path):
+    db = StateDB(tmp_path / "state.db", batch_size=100, batch_seconds=0.05)
+    other = other_connection(db)
+    errors = []
+    hook, threading.excepthook = threading.excepthook, errors.append
+    try:
+        other.execute("BEGIN IMMEDIATE")
+        db.conn.execute("PRAGMA busy_timeout=50")
+        db.add_history("github", "https://a")
+        first = db._timer
+        first.join(2)
+        assert not errors
+        # 整批放回佇列並重新排定 timer
+        assert db._pending and db._timer is not first
+        other.execute("COMMIT")
+        assert db.seen("github", "https://a")
+    finally:
+        threading.excepthook = hook
+        db.close()
+
+
+def test_reset_history_keeps_file_records(db):
+    db.add_history("github", "https://a")
+    db.add_history("choco", "https://b")
+    db.set_cursor("github", "page", 2)
+    db.record_file("ab" * 32, "github", "https://a", "benign_pe/objects/ab/x", 10, True, "clean")
+    assert db.reset_history("github") == (1, 1)
+    assert not db.seen("github", "https://a")
+    assert db.seen("choco", "https://b")
+    assert db.reset_history() == (1, 0)
+    assert db.has_sha256("ab" * 32)